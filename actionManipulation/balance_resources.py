@@ -15,6 +15,9 @@ balance_resources.py file is as follows:
         - Similarly, the receiver DRC's resources are checked to ensure they do not fall below 20% after the transfer.
         - The transfer is performed by moving the specified number of cases from the donor to the receiver.
         - A round-robin method is used to balance back the resources, excluding the rtom.
+        - The round-robin take counts are computed directly from the bucket sizes, so balancing back
+          takes one pass over the resources however large the transfer is, and a receiver without
+          enough cases to give back is reported as a shortfall instead of looping forever.
 '''
 
 # balance_resources.py
@@ -24,6 +27,43 @@ from utils.Custom_Exceptions import ResourceBalanceError
 
 logger = get_logger("amend_status_logger")
 
+def compute_balance_back_takes(bucket_sizes, transfer_value):
+    """
+    Computes how many cases a round-robin balance-back takes from each bucket.
+    The round-robin visits the buckets in the given order and takes one case from every
+    non-empty bucket per round until transfer_value cases have been taken.
+    Returns: (takes, shortfall) where takes lines up with bucket_sizes and shortfall is the
+    number of cases that could not be taken because every bucket ran out.
+    """
+    total_available = sum(bucket_sizes)
+    if transfer_value >= total_available:
+        return list(bucket_sizes), transfer_value - total_available
+
+    # Find the number of complete rounds: after k rounds, sum(min(size, k)) cases are taken
+    full_rounds = 0
+    taken = 0
+    active_buckets = len(bucket_sizes)
+    for size in sorted(bucket_sizes):
+        round_cost = (size - full_rounds) * active_buckets
+        if taken + round_cost > transfer_value:
+            break
+        taken += round_cost
+        full_rounds = size
+        active_buckets -= 1
+    full_rounds += (transfer_value - taken) // active_buckets
+    taken += ((transfer_value - taken) // active_buckets) * active_buckets
+
+    # The remaining cases come one each from the first buckets that still have cases
+    remaining_value = transfer_value - taken
+    takes = []
+    for size in bucket_sizes:
+        take = min(size, full_rounds)
+        if size > full_rounds and remaining_value > 0:
+            take += 1
+            remaining_value -= 1
+        takes.append(take)
+    return takes, 0
+
 def balance_resources(drcs, receiver_drc, donor_drc, rtom, transfer_value):
     """
     Balances resources between DRCs based on the given logic.
@@ -33,58 +73,105 @@ def balance_resources(drcs, receiver_drc, donor_drc, rtom, transfer_value):
     for case_id, (drc, resource) in drcs.items():
         resource_tracker[drc][resource].append(case_id)
 
+    success_balance_buckets, balance_result = balance_case_buckets(resource_tracker, receiver_drc, donor_drc, rtom, transfer_value)
+    if not success_balance_buckets:
+        return False, balance_result
+
+    # Convert resource_tracker back to the original drcs format
+    updated_drcs = {}
+    for drc, resources in resource_tracker.items():
+        for resource, case_ids in resources.items():
+            for case_id in case_ids:
+                updated_drcs[case_id] = [drc, resource]
+
+    return True, updated_drcs  # Success
+
+def balance_case_buckets(resource_tracker, receiver_drc, donor_drc, rtom, transfer_value):
+    """
+    Balances case ID buckets ({drc: {rtom: [case_ids]}}) in place: balance_resource_counts decides how many
+    cases move per resource, and the first case IDs of a bucket are moved to the end of the other DRC's bucket.
+    Returns: (success, resource_tracker or error_message)
+    """
+    bucket_counts = {drc: {resource: len(case_ids) for resource, case_ids in resources.items()} for drc, resources in resource_tracker.items()}
+    success_balance_counts, updated_counts = balance_resource_counts(bucket_counts, receiver_drc, donor_drc, rtom, transfer_value)
+    if not success_balance_counts:
+        return False, updated_counts
+
+    try:
+        # The transfer and the balance-back only move cases between the receiver and the donor
+        for resource, updated_count in updated_counts[receiver_drc].items():
+            moved_count = updated_count - bucket_counts[receiver_drc][resource]
+            if moved_count > 0:
+                _move_cases(resource_tracker[donor_drc][resource], resource_tracker[receiver_drc][resource], moved_count)
+            elif moved_count < 0:
+                _move_cases(resource_tracker[receiver_drc][resource], resource_tracker[donor_drc][resource], -moved_count)
+        return True, resource_tracker
+    except Exception as balance_error:
+        logger.error(f"Error balancing resources: {balance_error}")
+        raise ResourceBalanceError(f"Error balancing resources: {balance_error}")
+
+def _move_cases(source_case_ids, target_case_ids, count):
+    """
+    Moves the first count case IDs of source_case_ids to the end of target_case_ids.
+    """
+    if count > len(source_case_ids):
+        raise IndexError(f"cannot move {count} cases from a bucket of {len(source_case_ids)}")
+    target_case_ids.extend(source_case_ids[:count])
+    del source_case_ids[:count]
+
+def balance_resource_counts(counts, receiver_drc, donor_drc, rtom, transfer_value):
+    """
+    Applies the balancing logic to per-(DRC, RTOM) case counts. balance_resources moves case IDs by
+    these counts, and batches that are too large to load into memory are planned from them directly.
+    counts is {drc: {rtom: count}} and is not modified.
+    Returns: (success, updated_counts or error_message)
+    """
+    updated_counts = {drc: dict(resources) for drc, resources in counts.items()}
+
     try:
         # Step 1: Check if receiver_drc and donor_drc exist
-        if receiver_drc not in resource_tracker or donor_drc not in resource_tracker:
+        if receiver_drc not in updated_counts or donor_drc not in updated_counts:
             logger.error(f"One of the DRCs ({receiver_drc} or {donor_drc}) does not exist.")
             return False, f"One of the DRCs ({receiver_drc} or {donor_drc}) does not exist."
 
         # Step 2: Check if rtom exists in both receiver_drc and donor_drc
-        if rtom not in resource_tracker[receiver_drc] or rtom not in resource_tracker[donor_drc]:
+        if rtom not in updated_counts[receiver_drc] or rtom not in updated_counts[donor_drc]:
             logger.error(f"The resource {rtom} does not exist in both {receiver_drc} and {donor_drc}.")
             return False, f"The resource {rtom} does not exist in both {receiver_drc} and {donor_drc}."
 
         # Step 3: Check if donor_drc can donate without going below 20% of its resources
-        donor_resource_count = len(resource_tracker[donor_drc][rtom])
+        donor_resource_count = updated_counts[donor_drc][rtom]
         if donor_resource_count > 0 and (donor_resource_count - transfer_value < 0.2 * donor_resource_count):
             logger.error(f"Insufficient resources in {donor_drc} for the Donate.")
             return False, f"Insufficient resources in {donor_drc} for the Donate."
 
         # Step 4: Check if receiver_drc can receive without going below 20% of its resources
-        receiver_resource_count = len(resource_tracker[receiver_drc][rtom])
+        receiver_resource_count = updated_counts[receiver_drc][rtom]
         if receiver_resource_count > 0 and (receiver_resource_count - transfer_value < 0.2 * receiver_resource_count):
             logger.error(f"Insufficient resources in {receiver_drc} for the Balance.")
             return False, f"Insufficient resources in {receiver_drc} for the Balance."
 
         # Step 5: Perform the transfer
-        for _ in range(transfer_value):
-            case_id = resource_tracker[donor_drc][rtom].pop(0)
-            resource_tracker[receiver_drc][rtom].append(case_id)
+        updated_counts[donor_drc][rtom] -= transfer_value
+        updated_counts[receiver_drc][rtom] += transfer_value
 
         # Step 6: Balance back using round-robin method
-        common_resources = set(resource_tracker[receiver_drc].keys()).intersection(set(resource_tracker[donor_drc].keys()))
+        common_resources = set(updated_counts[receiver_drc]).intersection(updated_counts[donor_drc])
         common_resources.discard(rtom)  # Exclude the rtom from balancing back
 
-        sorted_resources = sorted(common_resources, key=lambda x: len(resource_tracker[receiver_drc][x]), reverse=True)
-
-        remaining_value = transfer_value
-        index = 0
-        while remaining_value > 0:
-            resource = sorted_resources[index % len(sorted_resources)]
-            if len(resource_tracker[receiver_drc][resource]) >= 1:
-                case_id = resource_tracker[receiver_drc][resource].pop(0)
-                resource_tracker[donor_drc][resource].append(case_id)
-                remaining_value -= 1
-            index += 1
-
-        # Convert resource_tracker back to the original drcs format
-        updated_drcs = {}
-        for drc, resources in resource_tracker.items():
-            for resource, case_ids in resources.items():
-                for case_id in case_ids:
-                    updated_drcs[case_id] = [drc, resource]
-
-        return True, updated_drcs  # Success
+        sorted_resources = sorted(common_resources, key=lambda x: (-updated_counts[receiver_drc][x], x))
+
+        takes, shortfall = compute_balance_back_takes([updated_counts[receiver_drc][resource] for resource in sorted_resources], transfer_value)
+        if shortfall:
+            error_message = f"Not enough cases in {receiver_drc} to balance back {shortfall} of {transfer_value} cases to {donor_drc}."
+            logger.error(error_message)
+            return False, error_message
+
+        for resource, take in zip(sorted_resources, takes):
+            updated_counts[receiver_drc][resource] -= take
+            updated_counts[donor_drc][resource] += take
+
+        return True, updated_counts  # Success
     except Exception as balance_error:
-        logger.error(f"Error balancing resources: {balance_error}")
-        raise ResourceBalanceError(f"Error balancing resources: {balance_error}")
\ No newline at end of file
+        logger.error(f"Error balancing resource counts: {balance_error}")
+        raise ResourceBalanceError(f"Error balancing resource counts: {balance_error}")
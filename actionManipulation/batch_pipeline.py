@@ -0,0 +1,155 @@
+'''
+batch_pipeline.py file is as follows:
+
+    Purpose: This script runs amend tasks through a fetch -> plan -> commit pipeline with bounded queues.
+    Created Date: 2025-03-22
+    Created By:  T.S.Balasooriya (tharindutsb@gmail.com) , Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Last Modified Date: 2025-03-22
+    Modified By: T.S.Balasooriya (tharindutsb@gmail.com), Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Version: Python 3.9
+    Dependencies: queue, threading, functools, utils.loggers, utils.connectDB, utils.batch_lock, utils.Custom_Exceptions, actionManipulation.plan_batches, actionManipulation.database_checks
+    Notes:
+        - The prefetcher loads the next batches while the planner balances and the committer writes,
+          so total time approaches the slowest stage instead of the sum of all three.
+        - Queues between the stages are bounded: a slow committer stops the prefetcher from loading
+          more batches into memory than the queues can hold.
+        - A batch is not loaded again until the task ahead of it on the same batch has been committed,
+          so every plan is computed from the data it will overwrite.
+        - The committer queues task statuses and writes them in one bulk write when [STATUS] BULK_SIZE
+          are pending or it has nothing else to commit. Batch locks are released after that write.
+'''
+
+import queue
+import threading
+from functools import partial
+from utils.loggers import get_logger
+from utils.connectDB import get_collection
+from utils.batch_lock import release_batch_lock
+from utils.Custom_Exceptions import TaskProcessingException, BatchLockedError, CircuitOpenError
+from actionManipulation.plan_batches import plan_batch_context
+from actionManipulation.database_checks import TaskStatusBatch, release_task_claim, mark_task_error
+
+logger = get_logger("amend_status_logger")
+
+# Marks the end of the work in a stage queue
+_END_OF_TASKS = None
+
+def _prefetch_stage(tasks, plan_queue, batch_in_flight, load_batch_for_task, system_task_collection, stage_errors):
+    """
+    Loads the cases and transactions of every task and hands them to the planner.
+    An error outside the load of a single task stops the prefetcher; it is appended to stage_errors.
+    """
+    try:
+        for task in tasks:
+            batch_id = task["parameters"].get("Case_Distribution_Batch_ID")
+            previous_commit = batch_in_flight.get(batch_id)
+            if previous_commit is not None:
+                previous_commit.wait()
+            batch_in_flight[batch_id] = threading.Event()
+
+            try:
+                plan_queue.put((task, batch_id, load_batch_for_task(task, system_task_collection), None))
+            except Exception as load_error:
+                plan_queue.put((task, batch_id, None, load_error))
+    except Exception as prefetch_error:
+        logger.error(f"Amend prefetcher stopped: {prefetch_error}")
+        stage_errors.append(prefetch_error)
+    finally:
+        # The planner and the committer only stop at the end marker, so it is sent however the prefetcher ends
+        plan_queue.put(_END_OF_TASKS)
+
+def _plan_stage(plan_queue, commit_queue):
+    """
+    Balances every loaded batch and hands the plan to the committer.
+    """
+    while True:
+        item = plan_queue.get()
+        if item is _END_OF_TASKS:
+            commit_queue.put(_END_OF_TASKS)
+            return
+
+        task, batch_id, batch_context, error = item
+        batch_plan = None
+        if error is None:
+            try:
+                success_plan_batch, batch_plan = plan_batch_context(batch_context)
+                if not success_plan_batch:
+                    error = batch_plan
+            except Exception as planning_error:
+                error = str(planning_error)
+            # The full case map is not needed by the committer once the plan exists
+            batch_context["drcs"] = None
+        commit_queue.put((task, batch_id, batch_context, batch_plan, error))
+
+def process_batches_in_pipeline(tasks, load_batch_for_task, commit_batch_plan, queue_size=4):
+    """
+    Processes tasks through three concurrent stages: a prefetcher thread, a planner thread and
+    the committer, which runs in the calling thread so that all writes come from one place.
+    load_batch_for_task and commit_batch_plan are the fetch and write stages of task_processor.
+    Raises TaskProcessingException, once the loaded tasks are committed, if the prefetcher stopped early.
+    """
+    system_task_collection = get_collection("System_tasks")
+    plan_queue = queue.Queue(maxsize=queue_size)
+    commit_queue = queue.Queue(maxsize=queue_size)
+    batch_in_flight = {}
+    stage_errors = []
+
+    prefetcher = threading.Thread(
+        target=_prefetch_stage,
+        args=(tasks, plan_queue, batch_in_flight, load_batch_for_task, system_task_collection, stage_errors),
+        name="amend-prefetcher",
+        daemon=True
+    )
+    planner = threading.Thread(target=_plan_stage, args=(plan_queue, commit_queue), name="amend-planner", daemon=True)
+    prefetcher.start()
+    planner.start()
+    logger.info(f"Started amend pipeline for {len(tasks)} tasks with queue size {queue_size}.")
+
+    status_batch = TaskStatusBatch(system_task_collection)
+    committed_items = []
+
+    def flush_statuses():
+        # Write the queued statuses, then give up the batches they belong to
+        status_batch.flush()
+        for batch_id, batch_context in committed_items:
+            if batch_context is not None:
+                release_batch_lock(batch_context["batch_lock"])
+            # Let the prefetcher load the next task on this batch
+            batch_in_flight[batch_id].set()
+        committed_items.clear()
+
+    while True:
+        item = commit_queue.get()
+        if item is _END_OF_TASKS:
+            break
+
+        task, batch_id, batch_context, batch_plan, error = item
+        task_id = task["Task_Id"]
+        try:
+            if isinstance(error, (BatchLockedError, CircuitOpenError)):
+                # Another process is amending this batch, or the database is failing fast: leave the task to the next run
+                logger.warning(f"Skipping Task ID {task_id}: {error}")
+                continue
+            if error is not None:
+                raise TaskProcessingException(str(error))
+            commit_batch_plan(batch_context, batch_plan, system_task_collection, status_batch)
+        except CircuitOpenError as circuit_error:
+            logger.warning(f"Skipping Task ID {task_id}: {circuit_error}")
+            release_task_claim(system_task_collection, task_id, batch_context["claim_owner"])
+        except Exception as error_message:
+            logger.error(f"Error in Task ID {task_id}: {error_message}")
+            # A failed bulk write falls back to a write of its own, so the task does not stay "processing"
+            status_batch.add(task_id, "error", str(error_message), partial(mark_task_error, system_task_collection, task_id, str(error_message)))
+        finally:
+            committed_items.append((batch_id, batch_context))
+            # Statuses are written in bulk, but never held back while the committer would wait for work
+            if len(status_batch) >= status_batch.bulk_size or commit_queue.empty():
+                flush_statuses()
+    flush_statuses()
+
+    prefetcher.join()
+    planner.join()
+    if stage_errors:
+        # Tasks the prefetcher did not reach are still open, and are picked up by the next run
+        raise TaskProcessingException(f"Amend pipeline stopped before every task was loaded: {stage_errors[0]}")
+    logger.info("Amend pipeline drained.")
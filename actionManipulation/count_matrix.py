@@ -0,0 +1,184 @@
+'''
+count_matrix.py file is as follows:
+
+    Purpose: This script keeps a per-batch DRC x RTOM case count matrix on the transaction document, updated with the delta of every amend.
+    Created Date: 2025-04-09
+    Created By:  T.S.Balasooriya (tharindutsb@gmail.com) , Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Last Modified Date: 2025-04-09
+    Modified By: T.S.Balasooriya (tharindutsb@gmail.com), Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Version: Python 3.9
+    Dependencies: collections, utils.loggers, utils.Custom_Exceptions, utils.resilience, utils.read_amend_processing_ini, actionManipulation.database_checks
+    Notes:
+        - The matrix is stored as count_matrix: {drc: {rtom: count}} with a count_matrix_version on the batch's
+          Case_distribution_drc_transactions document. It is built once per batch by grouping the cases on the server
+          (or from the summary when [COUNT_MATRIX] SEED_FROM_SUMMARY says the summary is verified) and then only changed
+          by the deltas of committed amends, so the precheck, the out-of-core planning and the summary update read
+          O(DRCs x RTOMs) values instead of scanning cases.
+        - count_matrix_amend_batch_seq records the amend whose moves were applied last. While it is another amend,
+          the matrix also holds the counts before the current amend, which is what an out-of-core plan needs.
+        - Updates $set only the changed cells, guarded by count_matrix_version: a retried update is recognised as
+          already applied, and a concurrent change is reported instead of being overwritten.
+        - DRC and RTOM codes are used as field names. A batch with a code containing "." or "$" is not memoized.
+'''
+
+from collections import defaultdict
+from utils.loggers import get_logger
+from utils.Custom_Exceptions import TaskProcessingError, DatabaseUpdateError
+from utils.resilience import call_with_retry
+from utils.read_amend_processing_ini import get_processing_setting
+from actionManipulation.database_checks import fetch_summary_counts_for_batch, fetch_case_counts_for_batch
+
+logger = get_logger("amend_status_logger")
+
+def _is_valid_field_name(code):
+    return isinstance(code, str) and code and "." not in code and not code.startswith("$")
+
+def fetch_count_matrix(transaction_collection, summary_collection, case_collection, case_distribution_batch_id):
+    """
+    Reads the count matrix of a batch, building and storing it the first time.
+    Returns: (success, {"counts": {drc: {rtom: count}}, "version": version or None if not memoized,
+              "amend_batch_seq": batch_seq of the last amend applied, or None if unknown} or error)
+    """
+    try:
+        transaction_record = call_with_retry(
+            "fetch_count_matrix",
+            transaction_collection.find_one,
+            {"Case_Distribution_Batch_ID": case_distribution_batch_id},
+            {"count_matrix": 1, "count_matrix_version": 1, "count_matrix_amend_batch_seq": 1}
+        )
+    except TaskProcessingError:
+        raise
+    except Exception as fetch_error:
+        logger.error(f"Failed to read the count matrix of Batch ID {case_distribution_batch_id}: {fetch_error}")
+        raise DatabaseUpdateError(f"Failed to read the count matrix of Batch ID {case_distribution_batch_id}: {fetch_error}")
+    if transaction_record is not None and "count_matrix" in transaction_record:
+        counts = {
+            drc: {rtom: count for rtom, count in resources.items() if count}
+            for drc, resources in transaction_record["count_matrix"].items()
+        }
+        return True, {
+            "counts": {drc: resources for drc, resources in counts.items() if resources},
+            "version": transaction_record.get("count_matrix_version", 0),
+            "amend_batch_seq": transaction_record.get("count_matrix_amend_batch_seq")
+        }
+
+    # First use: build the matrix from the cases, as the summary may be stale, unless the summary is known to be verified
+    success_fetch_counts = False
+    if get_processing_setting("COUNT_MATRIX", "SEED_FROM_SUMMARY", False, bool):
+        success_fetch_counts, counts = fetch_summary_counts_for_batch(summary_collection, case_distribution_batch_id)
+    if not success_fetch_counts:
+        success_fetch_counts, counts = fetch_case_counts_for_batch(case_collection, case_distribution_batch_id)
+        if not success_fetch_counts:
+            return False, counts
+
+    if transaction_record is None or not all(_is_valid_field_name(drc) and all(_is_valid_field_name(rtom) for rtom in resources) for drc, resources in counts.items()):
+        logger.warning(f"Count matrix of Batch ID {case_distribution_batch_id} cannot be stored, it will be rebuilt on every amend.")
+        return True, {"counts": counts, "version": None, "amend_batch_seq": None}
+
+    try:
+        call_with_retry(
+            "fetch_count_matrix",
+            transaction_collection.update_one,
+            {"Case_Distribution_Batch_ID": case_distribution_batch_id, "count_matrix": {"$exists": False}},
+            {"$set": {"count_matrix": counts, "count_matrix_version": 0}}
+        )
+    except TaskProcessingError:
+        raise
+    except Exception as update_error:
+        logger.error(f"Failed to store the count matrix of Batch ID {case_distribution_batch_id}: {update_error}")
+        raise DatabaseUpdateError(f"Failed to store the count matrix of Batch ID {case_distribution_batch_id}: {update_error}")
+    logger.info(f"Built the count matrix of Batch ID {case_distribution_batch_id}: {len(counts)} DRCs.")
+    return True, {"counts": counts, "version": 0, "amend_batch_seq": None}
+
+def compute_flow_count_deltas(case_flows):
+    """
+    Count changes per (DRC, RTOM) caused by (from_drc, to_drc, rtom, count) case flows.
+    Returns: {(drc, rtom): delta}
+    """
+    deltas = defaultdict(int)
+    for from_drc, to_drc, rtom, count in case_flows:
+        deltas[(from_drc, rtom)] -= count
+        deltas[(to_drc, rtom)] += count
+    return {bucket: delta for bucket, delta in deltas.items() if delta}
+
+def apply_count_deltas(counts, deltas):
+    """
+    Returns a new {drc: {rtom: count}} with the deltas applied (empty buckets are left out).
+    """
+    updated_counts = {drc: dict(resources) for drc, resources in counts.items()}
+    for (drc, rtom), delta in deltas.items():
+        resources = updated_counts.setdefault(drc, {})
+        resources[rtom] = resources.get(rtom, 0) + delta
+        if resources[rtom] < 0:
+            raise DatabaseUpdateError(f"Count matrix would hold {resources[rtom]} cases for {drc} / {rtom}.")
+        if resources[rtom] == 0:
+            del resources[rtom]
+    return {drc: resources for drc, resources in updated_counts.items() if resources}
+
+def update_count_matrix(transaction_collection, case_distribution_batch_id, count_matrix, deltas, amend_batch_seq=None):
+    """
+    Stores the cells changed by deltas (the moves of amend_batch_seq) and bumps the matrix version.
+    Returns: (success, count matrix after the update)
+    """
+    updated_counts = apply_count_deltas(count_matrix["counts"], deltas)
+    if count_matrix["version"] is None or not deltas:
+        return True, dict(count_matrix, counts=updated_counts)
+    updated_matrix = {"counts": updated_counts, "version": count_matrix["version"] + 1, "amend_batch_seq": amend_batch_seq}
+
+    _set_count_matrix_cells(transaction_collection, case_distribution_batch_id, count_matrix["version"], {
+        bucket: updated_counts.get(bucket[0], {}).get(bucket[1], 0) for bucket in deltas
+    }, amend_batch_seq)
+    logger.info(f"Count matrix of Batch ID {case_distribution_batch_id} updated to version {updated_matrix['version']} ({len(deltas)} cells).")
+    return True, updated_matrix
+
+def rollback_count_matrix(transaction_collection, case_distribution_batch_id, original_matrix, updated_matrix):
+    """
+    Puts back the cells of original_matrix that update_count_matrix changed.
+    Returns: (success, message or error)
+    """
+    if original_matrix["version"] is None or updated_matrix["version"] == original_matrix["version"]:
+        return True, "Count matrix unchanged."
+    changed_buckets = {
+        (drc, rtom)
+        for counts in (original_matrix["counts"], updated_matrix["counts"])
+        for drc, resources in counts.items() for rtom in resources
+    }
+    try:
+        _set_count_matrix_cells(transaction_collection, case_distribution_batch_id, updated_matrix["version"], {
+            (drc, rtom): original_matrix["counts"].get(drc, {}).get(rtom, 0)
+            for drc, rtom in changed_buckets
+            if original_matrix["counts"].get(drc, {}).get(rtom, 0) != updated_matrix["counts"].get(drc, {}).get(rtom, 0)
+        }, original_matrix.get("amend_batch_seq"))
+    except TaskProcessingError as rollback_error:
+        logger.error(f"Failed to roll back the count matrix of Batch ID {case_distribution_batch_id}: {rollback_error}")
+        return False, str(rollback_error)
+    logger.info(f"Count matrix of Batch ID {case_distribution_batch_id} rolled back.")
+    return True, "Count matrix rolled back."
+
+def _set_count_matrix_cells(transaction_collection, case_distribution_batch_id, expected_version, cells, amend_batch_seq):
+    """
+    $sets count_matrix cells and the amend they belong to on the version the caller read, and moves the version on by one.
+    Raises DatabaseUpdateError if the update fails or the matrix is at another version.
+    """
+    try:
+        result = call_with_retry(
+            "update_count_matrix",
+            transaction_collection.update_one,
+            {"Case_Distribution_Batch_ID": case_distribution_batch_id, "count_matrix_version": expected_version},
+            {
+                "$set": dict({f"count_matrix.{drc}.{rtom}": count for (drc, rtom), count in cells.items()}, count_matrix_amend_batch_seq=amend_batch_seq),
+                "$inc": {"count_matrix_version": 1}
+            }
+        )
+        current = None
+        if result.matched_count == 0:
+            current = call_with_retry("update_count_matrix", transaction_collection.find_one, {"Case_Distribution_Batch_ID": case_distribution_batch_id}, {"count_matrix_version": 1}) or {}
+    except TaskProcessingError:
+        raise
+    except Exception as update_error:
+        logger.error(f"Failed to update the count matrix of Batch ID {case_distribution_batch_id}: {update_error}")
+        raise DatabaseUpdateError(f"Failed to update the count matrix of Batch ID {case_distribution_batch_id}: {update_error}")
+    if current is not None:
+        if current.get("count_matrix_version") != expected_version + 1:
+            raise DatabaseUpdateError(f"Count matrix of Batch ID {case_distribution_batch_id} is at version {current.get('count_matrix_version')}, expected {expected_version}.")
+        # A retry of an update the server had already applied
@@ -7,48 +7,182 @@ database_checks.py file is as follows:
     Last Modified Date: 2025-03-15
     Modified By: T.S.Balasooriya (tharindutsb@gmail.com), Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)     
     Version: Python 3.9
-    Dependencies: datetime, utils.loggers, utils.Custom_Exceptions
+    Dependencies: uuid, datetime, pymongo, utils.loggers, utils.Custom_Exceptions, utils.resilience, utils.read_amend_processing_ini, actionManipulation.plan_batches
     Notes:
+        - Every status change is also appended to the task's status_history ({status, dtm, description}),
+          capped at [STATUS] HISTORY_LIMIT entries, so the timeline of a task survives later transitions.
 '''
 
+import uuid
 from datetime import datetime
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
 from utils.loggers import get_logger
-from utils.Custom_Exceptions import TaskValidationError
+from utils.Custom_Exceptions import TaskProcessingError, TaskValidationError
+from utils.resilience import call_with_retry
+from utils.read_amend_processing_ini import get_processing_setting
+from actionManipulation.plan_batches import plan_batch_counts
 
 logger = get_logger("amend_status_logger")
 
+def build_status_update(status, status_description=None, history_limit=None):
+    """
+    Builds the write of one status transition: the current status fields, and the transition
+    appended to the task's status_history, which keeps the last [STATUS] HISTORY_LIMIT entries.
+    Returns: (extra filter, update) - the filter makes a retried write of the same transition match nothing.
+    """
+    if history_limit is None:
+        history_limit = get_processing_setting("STATUS", "HISTORY_LIMIT", 20, int)
+    now = datetime.now()
+    update_fields = {
+        "task_status": status,
+        "status_changed_dtm": now,
+        "last_updated": now
+    }
+    if status_description:
+        update_fields["status_description"] = status_description
+    return {"status_changed_dtm": {"$ne": now}}, {
+        "$set": update_fields,
+        "$push": {"status_history": {"$each": [{"status": status, "dtm": now, "description": status_description}], "$slice": -history_limit}}
+    }
+
 def update_task_status(system_task_collection, task_id, status, error_description=None):
     """
     Updates the status of a task in the system_task collection.
-    Also updates status_changed_dtm and status_description (if provided).
+    Also updates status_changed_dtm and status_description (if provided), and appends the transition to status_history.
     Returns: (success, error)
     """
     try:
         logger.info(f"Updating task status to '{status}' for Task ID {task_id}...")
-        
-        # Prepare the update fields
-        update_fields = {
-            "task_status": status,
-            "status_changed_dtm": datetime.now(),
-            "last_updated": datetime.now()
-        }
-        
-        # Add status_description if an error description is provided
-        if error_description:
-            update_fields["status_description"] = error_description
-        
-        # Update the task status and related fields
-        system_task_collection.update_one(
-            {"Task_Id": task_id},
-            {"$set": update_fields}
+
+        # Update the task status and related fields, and record the transition
+        status_filter, status_update = build_status_update(status, error_description)
+        call_with_retry(
+            "update_task_status",
+            system_task_collection.update_one,
+            dict(status_filter, Task_Id=task_id),
+            status_update
         )
         
         logger.info(f"Task ID {task_id} status updated to '{status}' successfully.")
         return True, None
+    except TaskProcessingError:
+        raise
     except Exception as update_error:
         logger.error(f"Failed to update task status for Task ID {task_id}: {update_error}")
         raise TaskValidationError(f"Failed to update task status for Task ID {task_id}: {update_error}")
 
+def claim_task(system_task_collection, task_id, owner=None, status_description="Task is being processed"):
+    """
+    Moves an open task to "processing" in one conditional write, so only one process can take it.
+    The claim is the task's "processing" transition, so a task is written twice in all: here and at its final status.
+    It cannot wait for the final status, as the claim has to be won before any case is moved.
+    owner is stored as claimed_by, which lets a retried claim recognise its own earlier write.
+    Returns: (success, None or the status the task already had)
+    """
+    owner = owner or uuid.uuid4().hex
+    # The claim is conditional on the task's state, so the retry filter of build_status_update is not needed
+    _, status_update = build_status_update("processing", status_description)
+    status_update["$set"]["claimed_by"] = owner
+    try:
+        claimed_task = call_with_retry(
+            "claim_task",
+            system_task_collection.find_one_and_update,
+            {"Task_Id": task_id, "$or": [{"task_status": "open"}, {"task_status": "processing", "claimed_by": owner}]},
+            status_update,
+            projection={"_id": 1}
+        )
+    except Exception as claim_error:
+        logger.error(f"Failed to claim Task ID {task_id}: {claim_error}")
+        raise TaskValidationError(f"Failed to claim Task ID {task_id}: {claim_error}")
+
+    if claimed_task is None:
+        current_task = system_task_collection.find_one({"Task_Id": task_id}, {"task_status": 1}) or {}
+        return False, current_task.get("task_status")
+    logger.info(f"Task ID {task_id} claimed for processing.")
+    return True, None
+
+def release_task_claim(system_task_collection, task_id, owner, status_description="Task released, it will be retried"):
+    """
+    Moves a task claimed by owner from "processing" back to "open", for tasks that could not be processed
+    now but did not fail (e.g. a circuit breaker was open). Never raises.
+    Returns: (success, error)
+    """
+    try:
+        _, status_update = build_status_update("open", status_description)
+        status_update["$set"]["claimed_by"] = None
+        call_with_retry(
+            "release_task_claim",
+            system_task_collection.update_one,
+            {"Task_Id": task_id, "task_status": "processing", "claimed_by": owner},
+            status_update
+        )
+        logger.info(f"Task ID {task_id} released and left open.")
+        return True, None
+    except Exception as release_error:
+        logger.error(f"Task ID {task_id} could not be released: {release_error}")
+        return False, str(release_error)
+
+class TaskStatusBatch:
+    """
+    Collects the status transitions of many tasks and writes them with one unordered bulk_write
+    per [STATUS] BULK_SIZE transitions, for the parallel and pipeline modes.
+    """
+
+    def __init__(self, system_task_collection, bulk_size=None):
+        self.system_task_collection = system_task_collection
+        self.bulk_size = bulk_size or get_processing_setting("STATUS", "BULK_SIZE", 100, int)
+        self._pending = []
+
+    def __len__(self):
+        return len(self._pending)
+
+    def add(self, task_id, status, status_description=None, on_failure=None):
+        """
+        Queues a transition. on_failure is called if the transition cannot be written.
+        Returns: True when the batch is full and should be flushed
+        """
+        status_filter, status_update = build_status_update(status, status_description)
+        self._pending.append((task_id, UpdateOne(dict(status_filter, Task_Id=task_id), status_update), on_failure))
+        return len(self._pending) >= self.bulk_size
+
+    def flush(self):
+        """
+        Writes every queued transition.
+        Returns: (success, Task_Ids whose transition could not be written)
+        """
+        if not self._pending:
+            return True, []
+        pending, self._pending = self._pending, []
+        try:
+            call_with_retry("flush_task_statuses", self.system_task_collection.bulk_write, [request for _, request, _ in pending], ordered=False)
+        except Exception as flush_error:
+            if isinstance(flush_error, BulkWriteError):
+                # The write was unordered: only the transitions it reports are missing, the others are in
+                failed_indexes = {write_error["index"] for write_error in flush_error.details.get("writeErrors", [])}
+                failed = [pending[index] for index in sorted(failed_indexes)]
+            else:
+                failed = pending
+            failed_task_ids = [task_id for task_id, _, _ in failed]
+            logger.error(f"Failed to write the status of Task IDs {failed_task_ids}: {flush_error}")
+            for task_id, _, on_failure in failed:
+                if on_failure is not None:
+                    on_failure()
+            return False, failed_task_ids
+        logger.info(f"Task status updated for {len(pending)} tasks in one bulk write.")
+        return True, []
+
+def mark_task_error(system_task_collection, task_id, error_description):
+    """
+    Marks a task as "error". Never raises, so that a failing status update cannot stop the other tasks.
+    Returns: (success, error)
+    """
+    try:
+        return update_task_status(system_task_collection, task_id, "error", error_description)
+    except Exception as update_error:
+        logger.error(f"Task ID {task_id} could not be marked as error: {update_error}")
+        return False, str(update_error)
+
 def fetch_and_validate_template_task(template_task_collection, template_task_id, task_type):
     """
     Fetches and validates the template task from the template_task collection.
@@ -79,7 +213,7 @@ def fetch_transaction_details(transaction_collection, case_distribution_batch_id
         transaction_record = transaction_collection.find_one({
             "Case_Distribution_Batch_ID": case_distribution_batch_id,
             "summery_status": "open",
-            "batch_seq_details.CRD_Distribution_Status":"open"
+            "batch_seq_details": {"$elemMatch": {"action_type": "amend", "CRD_Distribution_Status": "open"}}
         })
         if not transaction_record:
             error_message = f"No open transaction record found for Batch ID {case_distribution_batch_id}."
@@ -128,4 +262,107 @@ def fetch_cases_for_batch(case_collection, case_distribution_batch_id):
         return True, cases
     except Exception as fetch_error:
         logger.error(f"Failed to fetch cases for batch ID {case_distribution_batch_id}: {fetch_error}")
-        raise TaskValidationError(f"Failed to fetch cases for batch ID {case_distribution_batch_id}: {fetch_error}")
\ No newline at end of file
+        raise TaskValidationError(f"Failed to fetch cases for batch ID {case_distribution_batch_id}: {fetch_error}")
+
+def prior_drc(case, amend_batch_seq=None):
+    """
+    Returns the DRC a case held before the given amend action: the Amend_Prior_DRC_ID stamped by that
+    action if it already moved the case, otherwise the current DRC (NEW_DRC_ID once amended, else DRC_Id).
+    """
+    if amend_batch_seq is not None and case.get("Amend_Batch_Seq") == amend_batch_seq:
+        return case.get("Amend_Prior_DRC_ID")
+    return case.get("NEW_DRC_ID") or case.get("DRC_Id")
+
+def prior_drc_filter(drc, amend_batch_seq=None):
+    """
+    Builds the query condition matching the cases for which prior_drc(case, amend_batch_seq) is drc.
+    """
+    current_drc_conditions = [{"NEW_DRC_ID": drc}, {"NEW_DRC_ID": None, "DRC_Id": drc}]
+    if amend_batch_seq is None:
+        return {"$or": current_drc_conditions}
+    return {"$or": [{"Amend_Batch_Seq": amend_batch_seq, "Amend_Prior_DRC_ID": drc}] + [
+        dict(condition, Amend_Batch_Seq={"$ne": amend_batch_seq}) for condition in current_drc_conditions
+    ]}
+
+def _prior_drc_expression(amend_batch_seq=None):
+    """
+    Aggregation expression of prior_drc(case, amend_batch_seq).
+    """
+    current_drc = {"$ifNull": ["$NEW_DRC_ID", "$DRC_Id"]}
+    if amend_batch_seq is None:
+        return current_drc
+    return {"$cond": [{"$eq": ["$Amend_Batch_Seq", amend_batch_seq]}, "$Amend_Prior_DRC_ID", current_drc]}
+
+def fetch_case_counts_for_batch(case_collection, case_distribution_batch_id, amend_batch_seq=None):
+    """
+    Counts the cases of the given batch per DRC and RTOM on the database server, without loading them.
+    Cases are counted under their current DRC, or under their DRC before amend_batch_seq when it is given.
+    Returns: (success, {drc: {rtom: count}} or error)
+    """
+    try:
+        logger.info(f"Counting cases per DRC and RTOM for Batch ID {case_distribution_batch_id}...")
+        bucket_counts = {}
+        for bucket in case_collection.aggregate([
+            {"$match": {"Case_Distribution_Batch_ID": case_distribution_batch_id}},
+            {"$group": {"_id": {"DRC_Id": _prior_drc_expression(amend_batch_seq), "RTOM": "$RTOM"}, "Count": {"$sum": 1}}}
+        ]):
+            drc = bucket["_id"].get("DRC_Id")
+            rtom = bucket["_id"].get("RTOM")
+            if drc is None or rtom is None:
+                logger.warning(f"Skipping {bucket['Count']} cases with missing DRC_Id or RTOM in Batch ID {case_distribution_batch_id}.")
+                continue
+            bucket_counts.setdefault(drc, {})[rtom] = bucket["Count"]
+        return True, bucket_counts
+    except Exception as fetch_error:
+        logger.error(f"Failed to count cases for batch ID {case_distribution_batch_id}: {fetch_error}")
+        raise TaskValidationError(f"Failed to count cases for batch ID {case_distribution_batch_id}: {fetch_error}")
+
+def fetch_summary_counts_for_batch(summary_collection, case_distribution_batch_id):
+    """
+    Reads the per-(DRC, RTOM) case counts of the given batch from the summary collection.
+    Returns: (success, {drc: {rtom: count}} or error)
+    """
+    try:
+        logger.info(f"Reading summary counts for Batch ID {case_distribution_batch_id}...")
+        bucket_counts = {}
+        for summary in summary_collection.find(
+            {"Case_Distribution_Batch_ID": case_distribution_batch_id},
+            {"DRC_Id": 1, "RTOM": 1, "Count": 1, "_id": 0}
+        ):
+            # Empty buckets are left out, the same way they are when cases are loaded
+            if summary.get("Count"):
+                bucket_counts.setdefault(summary["DRC_Id"], {})[summary["RTOM"]] = int(summary["Count"])
+        if not bucket_counts:
+            error_message = f"No summary counts found for Batch ID {case_distribution_batch_id}."
+            logger.warning(error_message)
+            return False, error_message
+        return True, bucket_counts
+    except Exception as fetch_error:
+        logger.error(f"Failed to read summary counts for batch ID {case_distribution_batch_id}: {fetch_error}")
+        raise TaskValidationError(f"Failed to read summary counts for batch ID {case_distribution_batch_id}: {fetch_error}")
+
+def precheck_distributions(summary_collection, case_collection, case_distribution_batch_id, array_of_distributions, count_source="summary", bucket_counts=None, amend_batch_seq=None):
+    """
+    Runs every distribution of an amend action against per-(DRC, RTOM) counts only, so that distributions
+    which would fail the 20% donor / receiver checks are rejected before any case is loaded.
+    Counts are bucket_counts when given (e.g. the batch's count matrix), otherwise they come from the summary
+    collection, or from a $group over the cases when count_source is "cases" or the batch has no summary.
+    The cases are grouped by their DRC before amend_batch_seq, the same way they are planned.
+    Returns: (success, bucket_counts or error)
+    """
+    success_fetch_counts = bucket_counts is not None
+    if not success_fetch_counts and count_source == "summary":
+        success_fetch_counts, bucket_counts = fetch_summary_counts_for_batch(summary_collection, case_distribution_batch_id)
+    if not success_fetch_counts:
+        success_fetch_counts, bucket_counts = fetch_case_counts_for_batch(case_collection, case_distribution_batch_id, amend_batch_seq)
+        if not success_fetch_counts:
+            return False, bucket_counts
+
+    success_plan_counts, planned_counts = plan_batch_counts(bucket_counts, array_of_distributions)
+    if not success_plan_counts:
+        error_message = f"Precheck failed for Batch ID {case_distribution_batch_id}: {planned_counts}"
+        logger.error(error_message)
+        return False, error_message
+
+    logger.info(f"Precheck passed for {len(array_of_distributions)} distributions in Batch ID {case_distribution_batch_id}.")
+    return True, bucket_counts
@@ -0,0 +1,258 @@
+'''
+move_plan_export.py file is as follows:
+
+    Purpose: This script writes the move plan of every committed amend task to a compact, memory-mappable file for audits.
+    Created Date: 2025-04-11
+    Created By:  T.S.Balasooriya (tharindutsb@gmail.com) , Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Last Modified Date: 2025-04-11
+    Modified By: T.S.Balasooriya (tharindutsb@gmail.com), Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Version: Python 3.9
+    Dependencies: json, mmap, os, struct, datetime, utils.loggers, utils.read_amend_processing_ini, pyarrow (optional)
+    Notes:
+        - One file per task, <OUTPUT_DIR>/task_<Task_Id>.moveplan, written when [MOVE_PLAN] ENABLED is true.
+          A re-run of the task replaces it.
+        - Layout (little-endian):
+            header    8s magic "DRSMOVE1", u16 version, u16 case id kind (0 = int64, 1 = string), u64 record count,
+                      u64 metadata length, u64 records offset, u64 string heap offset
+            metadata  UTF-8 JSON: Task_Id, Case_Distribution_Batch_ID, code table, array_of_distributions, created_dtm
+            records   16 bytes each: i64 case id (or index into the string heap), u16 from DRC, u16 to DRC,
+                      u16 RTOM (indexes into the code table), u16 distribution index (0xFFFF = not attributable)
+            heap      string case ids only: u64 offsets (record count + 1), then the UTF-8 case ids
+        - Records are fixed-size and 8-byte aligned, so MovePlanFile maps the file and reads any record
+          without loading the others.
+        - A move is attributed to the first distribution whose transfer (donor -> receiver in its RTOM) or
+          balance-back (receiver -> donor in another RTOM) it matches. A case moved by several distributions
+          is written once with its net move, which may match none of them.
+        - With [MOVE_PLAN] FORMAT = parquet the same columns are written as task_<Task_Id>.parquet with pyarrow,
+          if it is installed. Otherwise the binary file is written.
+'''
+
+import json
+import mmap
+import os
+import struct
+from datetime import datetime
+from utils.loggers import get_logger
+from utils.read_amend_processing_ini import get_processing_setting
+
+logger = get_logger("amend_status_logger")
+
+MAGIC = b"DRSMOVE1"
+VERSION = 1
+CASE_ID_INT = 0
+CASE_ID_STRING = 1
+UNATTRIBUTED = 0xFFFF
+HEADER = struct.Struct("<8sHHQQQQ")
+RECORD = struct.Struct("<qHHHH")
+OFFSET = struct.Struct("<Q")
+
+def _align(position, alignment=8):
+    return (position + alignment - 1) // alignment * alignment
+
+def attribute_distribution(array_of_distributions, from_drc, to_drc, rtom):
+    """
+    Index of the first distribution that explains a move, or UNATTRIBUTED.
+    """
+    for distribution_index, distribution in enumerate(array_of_distributions):
+        donor_drc = distribution.get("donor_drc_id")
+        receiver_drc = distribution.get("receiver_drc_id")
+        if (from_drc, to_drc) == (donor_drc, receiver_drc) and rtom == distribution.get("rtom"):
+            return distribution_index
+        if (from_drc, to_drc) == (receiver_drc, donor_drc) and rtom != distribution.get("rtom"):
+            return distribution_index
+    return UNATTRIBUTED
+
+def write_move_plan(file_path, task_id, case_distribution_batch_id, array_of_distributions, case_moves):
+    """
+    Writes a move plan file. case_moves is a list of (from_drc, to_drc, rtom, case_ids).
+    The file is written next to file_path and renamed into place, so readers never see half a plan.
+    Returns: (success, number of moves written)
+    """
+    codes = {}
+    def code(label):
+        return codes.setdefault(label, len(codes))
+    flows = [
+        (code(from_drc), code(to_drc), code(rtom), attribute_distribution(array_of_distributions, from_drc, to_drc, rtom), case_ids)
+        for from_drc, to_drc, rtom, case_ids in case_moves
+    ]
+    if len(codes) > UNATTRIBUTED:
+        raise ValueError(f"Move plan of Task ID {task_id} has {len(codes)} DRC / RTOM codes, at most {UNATTRIBUTED} fit.")
+
+    record_count = sum(len(case_ids) for *_, case_ids in flows)
+    case_id_kind = CASE_ID_INT
+    if not all(type(case_id) is int and -2 ** 63 <= case_id < 2 ** 63 for *_, case_ids in flows for case_id in case_ids):
+        case_id_kind = CASE_ID_STRING
+
+    metadata = json.dumps({
+        "Task_Id": task_id,
+        "Case_Distribution_Batch_ID": case_distribution_batch_id,
+        "codes": list(codes),
+        "array_of_distributions": array_of_distributions,
+        "created_dtm": datetime.now().isoformat()
+    }, default=str).encode("utf-8")
+    records_offset = _align(HEADER.size + len(metadata))
+    heap_offset = records_offset + record_count * RECORD.size
+
+    temporary_path = f"{file_path}.tmp"
+    with open(temporary_path, "wb") as plan_file:
+        plan_file.write(HEADER.pack(MAGIC, VERSION, case_id_kind, record_count, len(metadata), records_offset, heap_offset))
+        plan_file.write(metadata)
+        plan_file.write(b"\0" * (records_offset - HEADER.size - len(metadata)))
+
+        record_index = 0
+        for from_code, to_code, rtom_code, distribution_index, case_ids in flows:
+            records = bytearray(len(case_ids) * RECORD.size)
+            for position, case_id in enumerate(case_ids):
+                RECORD.pack_into(records, position * RECORD.size, case_id if case_id_kind == CASE_ID_INT else record_index + position, from_code, to_code, rtom_code, distribution_index)
+            plan_file.write(records)
+            record_index += len(case_ids)
+
+        if case_id_kind == CASE_ID_STRING:
+            encoded_case_ids = [str(case_id).encode("utf-8") for *_, case_ids in flows for case_id in case_ids]
+            offset = 0
+            for encoded_case_id in encoded_case_ids:
+                plan_file.write(OFFSET.pack(offset))
+                offset += len(encoded_case_id)
+            plan_file.write(OFFSET.pack(offset))
+            for encoded_case_id in encoded_case_ids:
+                plan_file.write(encoded_case_id)
+    os.replace(temporary_path, file_path)
+    return True, record_count
+
+def write_move_plan_parquet(file_path, task_id, case_distribution_batch_id, array_of_distributions, case_moves):
+    """
+    Writes the move plan columns as a Parquet file with pyarrow (ImportError if it is not installed).
+    Returns: (success, number of moves written)
+    """
+    import pyarrow
+    import pyarrow.parquet
+
+    columns = {"Case_Id": [], "from_drc": [], "to_drc": [], "rtom": [], "distribution_index": []}
+    for from_drc, to_drc, rtom, case_ids in case_moves:
+        distribution_index = attribute_distribution(array_of_distributions, from_drc, to_drc, rtom)
+        columns["Case_Id"].extend(str(case_id) for case_id in case_ids)
+        for column, value in (("from_drc", from_drc), ("to_drc", to_drc), ("rtom", rtom), ("distribution_index", None if distribution_index == UNATTRIBUTED else distribution_index)):
+            columns[column].extend([value] * len(case_ids))
+
+    table = pyarrow.table({
+        "Case_Id": pyarrow.array(columns["Case_Id"], pyarrow.string()),
+        "from_drc": pyarrow.array(columns["from_drc"], pyarrow.string()).dictionary_encode(),
+        "to_drc": pyarrow.array(columns["to_drc"], pyarrow.string()).dictionary_encode(),
+        "rtom": pyarrow.array(columns["rtom"], pyarrow.string()).dictionary_encode(),
+        "distribution_index": pyarrow.array(columns["distribution_index"], pyarrow.uint16()),
+    }).replace_schema_metadata({
+        "Task_Id": str(task_id),
+        "Case_Distribution_Batch_ID": str(case_distribution_batch_id),
+        "array_of_distributions": json.dumps(array_of_distributions, default=str)
+    })
+    pyarrow.parquet.write_table(table, f"{file_path}.tmp")
+    os.replace(f"{file_path}.tmp", file_path)
+    return True, table.num_rows
+
+def move_plan_path(task_id, output_dir=None, plan_format="binary"):
+    """
+    Path of the move plan file of a task.
+    """
+    if output_dir is None:
+        output_dir = get_processing_setting("MOVE_PLAN", "OUTPUT_DIR", "move_plans")
+    return os.path.join(output_dir, f"task_{task_id}.{'parquet' if plan_format == 'parquet' else 'moveplan'}")
+
+def export_move_plan(task_id, case_distribution_batch_id, array_of_distributions, case_moves):
+    """
+    Writes the move plan of a committed task if [MOVE_PLAN] ENABLED. Never raises: a plan that cannot be
+    written is logged and the task goes on.
+    Returns: (success, file path, or None if export is disabled or failed)
+    """
+    if not get_processing_setting("MOVE_PLAN", "ENABLED", False, bool):
+        return True, None
+
+    plan_format = get_processing_setting("MOVE_PLAN", "FORMAT", "binary").lower()
+    try:
+        os.makedirs(get_processing_setting("MOVE_PLAN", "OUTPUT_DIR", "move_plans"), exist_ok=True)
+        if plan_format == "parquet":
+            try:
+                file_path = move_plan_path(task_id, plan_format="parquet")
+                success_write, move_count = write_move_plan_parquet(file_path, task_id, case_distribution_batch_id, array_of_distributions, case_moves)
+                logger.info(f"Move plan of Task ID {task_id} written to {file_path}: {move_count} moves.")
+                return True, file_path
+            except ImportError:
+                logger.warning("pyarrow is not installed, writing the move plan in the binary format.")
+        file_path = move_plan_path(task_id)
+        success_write, move_count = write_move_plan(file_path, task_id, case_distribution_batch_id, array_of_distributions, case_moves)
+        logger.info(f"Move plan of Task ID {task_id} written to {file_path}: {move_count} moves.")
+        return True, file_path
+    except (OSError, ValueError) as export_error:
+        logger.error(f"Failed to write the move plan of Task ID {task_id}: {export_error}")
+        return False, None
+
+def remove_move_plan(file_path):
+    """
+    Removes the move plan of a task whose commit was rolled back. Never raises.
+    """
+    if file_path is None:
+        return
+    try:
+        os.remove(file_path)
+        logger.info(f"Removed move plan {file_path} of a rolled back task.")
+    except OSError as remove_error:
+        logger.error(f"Failed to remove move plan {file_path}: {remove_error}")
+
+class MovePlanFile:
+    """
+    Read-only, memory-mapped view of a move plan file: len(), plan[i] and iteration give
+    (case_id, from_drc, to_drc, rtom, distribution_index or None) without reading the whole file.
+    """
+
+    def __init__(self, file_path):
+        self._file = open(file_path, "rb")
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            # An empty file cannot be mapped
+            self._file.close()
+            raise ValueError(f"{file_path} is not a move plan file.")
+        magic, version, self.case_id_kind, self.record_count, metadata_length, self._records_offset, self._heap_offset = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            self.close()
+            raise ValueError(f"{file_path} is not a version {VERSION} move plan file.")
+        self.metadata = json.loads(self._map[HEADER.size:HEADER.size + metadata_length].decode("utf-8"))
+        self.codes = self.metadata["codes"]
+        self.task_id = self.metadata["Task_Id"]
+        self.case_distribution_batch_id = self.metadata["Case_Distribution_Batch_ID"]
+        self.array_of_distributions = self.metadata["array_of_distributions"]
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.record_count
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += self.record_count
+        if not 0 <= index < self.record_count:
+            raise IndexError("move plan record out of range")
+        return self._decode(RECORD.unpack_from(self._map, self._records_offset + index * RECORD.size))
+
+    def __iter__(self):
+        records = memoryview(self._map)[self._records_offset:self._heap_offset]
+        try:
+            for record in RECORD.iter_unpack(records):
+                yield self._decode(record)
+        finally:
+            records.release()
+
+    def _decode(self, record):
+        case_id, from_code, to_code, rtom_code, distribution_index = record
+        if self.case_id_kind == CASE_ID_STRING:
+            start, end = struct.unpack_from("<QQ", self._map, self._heap_offset + case_id * OFFSET.size)
+            strings_offset = self._heap_offset + (self.record_count + 1) * OFFSET.size
+            case_id = self._map[strings_offset + start:strings_offset + end].decode("utf-8")
+        return case_id, self.codes[from_code], self.codes[to_code], self.codes[rtom_code], None if distribution_index == UNATTRIBUTED else distribution_index
+
+    def close(self):
+        self._map.close()
+        self._file.close()
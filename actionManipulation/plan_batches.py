@@ -0,0 +1,185 @@
+'''
+plan_batches.py file is as follows:
+
+    Purpose: This script computes the move plans of amend batches, serially or on a process pool.
+    Created Date: 2025-03-20
+    Created By:  T.S.Balasooriya (tharindutsb@gmail.com) , Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Last Modified Date: 2025-03-20
+    Modified By: T.S.Balasooriya (tharindutsb@gmail.com), Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Version: Python 3.9
+    Dependencies: os, collections, concurrent.futures, multiprocessing, utils.loggers, actionManipulation.balance_resources
+    Notes:
+        - Planning is pure CPU work, so batches are planned in separate processes to get around the GIL.
+        - Workers are spawned, not forked: the caller holds MongoClient connections and runs threads (pipeline
+          stages, pymongo monitors) that a forked child would copy in whatever state they were in.
+        - Allocations are sent to a worker as they are (pickled in C), and a worker sends back only the cases
+          its plan moves, so the caller does no per-case work for the round trip.
+        - Only planning runs in the workers. Writing the plans back stays with the single caller process.
+        - Out-of-core batches (loaded as per-(DRC, RTOM) counts only) are planned from the counts and turn
+          into case flows, which the writer streams case IDs for.
+'''
+
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from utils.loggers import get_logger
+from actionManipulation.balance_resources import balance_case_buckets, balance_resource_counts
+
+logger = get_logger("amend_status_logger")
+
+def plan_batch_moves(drcs, array_of_distributions):
+    """
+    Applies every distribution of an amend action to the batch allocation, in order.
+    Each distribution is balanced on top of the result of the previous one.
+    Returns: (success, updated_drcs or error_message)
+    """
+    success_plan_buckets, resource_tracker = plan_case_buckets(_bucket_cases(drcs), array_of_distributions)
+    if not success_plan_buckets:
+        return False, resource_tracker
+
+    updated_drcs = {}
+    for drc, resources in resource_tracker.items():
+        for resource, case_ids in resources.items():
+            for case_id in case_ids:
+                updated_drcs[case_id] = [drc, resource]
+    return True, updated_drcs
+
+def plan_batch_moved_cases(drcs, array_of_distributions):
+    """
+    Plans a batch like plan_batch_moves, but only returns the cases that change DRC.
+    Returns: (success, {case_id: [new_drc, rtom]} or error_message)
+    """
+    success_plan_buckets, resource_tracker = plan_case_buckets(_bucket_cases(drcs), array_of_distributions)
+    if not success_plan_buckets:
+        return False, resource_tracker
+
+    moved_cases = {}
+    for drc, resources in resource_tracker.items():
+        for resource, case_ids in resources.items():
+            for case_id in case_ids:
+                if drcs[case_id][0] != drc:
+                    moved_cases[case_id] = [drc, resource]
+    return True, moved_cases
+
+def plan_case_buckets(resource_tracker, array_of_distributions):
+    """
+    Applies every distribution of an amend action, in order, to case ID buckets {drc: {rtom: [case_ids]}} in place.
+    Returns: (success, resource_tracker or error_message)
+    """
+    for distribution in array_of_distributions:
+        receiver_drc = distribution.get("receiver_drc_id")
+        donor_drc = distribution.get("donor_drc_id")
+        rtom = distribution.get("rtom")
+        transfer_value = distribution.get("transfer_count")
+
+        success_balance_buckets, balance_result = balance_case_buckets(resource_tracker, receiver_drc, donor_drc, rtom, transfer_value)
+        if not success_balance_buckets:
+            return False, balance_result
+
+    return True, resource_tracker
+
+def _bucket_cases(drcs):
+    resource_tracker = defaultdict(lambda: defaultdict(list))
+    for case_id, (drc, resource) in drcs.items():
+        resource_tracker[drc][resource].append(case_id)
+    return resource_tracker
+
+def plan_batch_counts(bucket_counts, array_of_distributions):
+    """
+    Applies every distribution of an amend action to per-(DRC, RTOM) case counts, in order.
+    Returns: (success, updated_counts or error_message)
+    """
+    updated_counts = bucket_counts
+    for distribution in array_of_distributions:
+        receiver_drc = distribution.get("receiver_drc_id")
+        donor_drc = distribution.get("donor_drc_id")
+        rtom = distribution.get("rtom")
+        transfer_value = distribution.get("transfer_count")
+
+        success_balance_counts, updated_counts = balance_resource_counts(updated_counts, receiver_drc, donor_drc, rtom, transfer_value)
+        if not success_balance_counts:
+            return False, updated_counts
+
+    return True, updated_counts
+
+def compute_case_flows(bucket_counts, updated_counts):
+    """
+    Turns the difference between two count matrices into net case flows, so that every case moves at most once.
+    Returns: list of (from_drc, to_drc, rtom, count)
+    """
+    deltas = defaultdict(dict)
+    for drc in set(bucket_counts).union(updated_counts):
+        for rtom in set(bucket_counts.get(drc, {})).union(updated_counts.get(drc, {})):
+            delta = updated_counts.get(drc, {}).get(rtom, 0) - bucket_counts.get(drc, {}).get(rtom, 0)
+            if delta:
+                deltas[rtom][drc] = delta
+
+    case_flows = []
+    for rtom in sorted(deltas):
+        donors = [[drc, -delta] for drc, delta in sorted(deltas[rtom].items()) if delta < 0]
+        receivers = [[drc, delta] for drc, delta in sorted(deltas[rtom].items()) if delta > 0]
+        donor_index = 0
+        for receiver_drc, needed in receivers:
+            while needed > 0:
+                donor = donors[donor_index]
+                count = min(needed, donor[1])
+                case_flows.append((donor[0], receiver_drc, rtom, count))
+                donor[1] -= count
+                needed -= count
+                if donor[1] == 0:
+                    donor_index += 1
+    return case_flows
+
+def plan_batch_context(batch_context):
+    """
+    Plans a loaded batch: full case maps are balanced case by case, out-of-core batches from their counts.
+    Returns: (success, batch_plan or error_message)
+        batch_plan is updated_drcs, or {"case_flows": [...], "updated_counts": {...}} for out-of-core batches.
+    """
+    if batch_context.get("bucket_counts") is None:
+        return plan_batch_moves(batch_context["drcs"], batch_context["array_of_distributions"])
+
+    success_plan_counts, updated_counts = plan_batch_counts(batch_context["bucket_counts"], batch_context["array_of_distributions"])
+    if not success_plan_counts:
+        return False, updated_counts
+    return True, {
+        "case_flows": compute_case_flows(batch_context["bucket_counts"], updated_counts),
+        "updated_counts": updated_counts
+    }
+
+def plan_batches_in_parallel(batch_allocations, max_workers=None):
+    """
+    Plans many independent batches across CPU cores.
+    batch_allocations maps a key (e.g. Task_Id) to (drcs, array_of_distributions).
+    Returns: {key: (success, moved cases {case_id: [new_drc, rtom]} or error_message)}
+    """
+    if not max_workers:
+        max_workers = os.cpu_count() or 1
+    max_workers = min(max_workers, len(batch_allocations))
+
+    plans = {}
+    if max_workers <= 1:
+        # Nothing to gain from a pool for a single batch or a single core
+        for key, (drcs, array_of_distributions) in batch_allocations.items():
+            try:
+                plans[key] = plan_batch_moved_cases(drcs, array_of_distributions)
+            except Exception as planning_error:
+                logger.error(f"Failed to plan batch {key}: {planning_error}")
+                plans[key] = (False, str(planning_error))
+        return plans
+
+    logger.info(f"Planning {len(batch_allocations)} batches on {max_workers} processes...")
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+        futures = {
+            key: executor.submit(plan_batch_moved_cases, drcs, array_of_distributions)
+            for key, (drcs, array_of_distributions) in batch_allocations.items()
+        }
+        for key, future in futures.items():
+            try:
+                plans[key] = future.result()
+            except Exception as planning_error:
+                logger.error(f"Failed to plan batch {key}: {planning_error}")
+                plans[key] = (False, str(planning_error))
+
+    return plans
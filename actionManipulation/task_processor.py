@@ -7,17 +7,26 @@ task_processor.py file is as follows:
     Last Modified Date: 2025-03-15
     Modified By: T.S.Balasooriya (tharindutsb@gmail.com), Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)     
     Version: Python 3.9
-    Dependencies: utils.loggers, actionManipulation.database_checks, actionManipulation.balance_resources, actionManipulation.update_databases, utils.connectDB, utils.read_template_task_id_ini, datetime, utils.Custom_Exceptions
+    Dependencies: functools, uuid, utils.loggers, actionManipulation.database_checks, actionManipulation.plan_batches, actionManipulation.batch_pipeline, actionManipulation.task_scheduler, actionManipulation.move_plan_export, actionManipulation.count_matrix, actionManipulation.update_databases, utils.connectDB, utils.read_template_task_id_ini, utils.read_amend_processing_ini, utils.batch_lock, utils.task_profiler, datetime, utils.Custom_Exceptions
     Notes:
 '''
 
+from functools import partial
+import uuid
 from utils.loggers import get_logger
-from actionManipulation.database_checks import update_task_status, fetch_and_validate_template_task, fetch_transaction_details, fetch_cases_for_batch
-from actionManipulation.balance_resources import balance_resources
-from actionManipulation.update_databases import update_case_distribution_collection, update_summary_in_mongo, rollback_case_distribution_collection, rollback_summary_in_mongo, update_template_task_collection
+from actionManipulation.database_checks import update_task_status, claim_task, release_task_claim, mark_task_error, TaskStatusBatch, fetch_and_validate_template_task, fetch_transaction_details, fetch_cases_for_batch, fetch_case_counts_for_batch, precheck_distributions, prior_drc
+from actionManipulation.plan_batches import plan_batch_context, plan_batches_in_parallel
+from actionManipulation.batch_pipeline import process_batches_in_pipeline
+from actionManipulation.task_scheduler import schedule_tasks
+from actionManipulation.move_plan_export import export_move_plan, remove_move_plan
+from actionManipulation.count_matrix import fetch_count_matrix, compute_flow_count_deltas, apply_count_deltas, update_count_matrix, rollback_count_matrix
+from actionManipulation.update_databases import update_case_distribution_collection, update_case_distribution_in_windows, update_summary_counts_in_mongo, rollback_case_distribution_collection, rollback_summary_in_mongo, update_template_task_collection
 from utils.connectDB import get_collection
 from utils.read_template_task_id_ini import get_template_task_id
-from utils.Custom_Exceptions import TaskProcessingException
+from utils.read_amend_processing_ini import get_processing_setting
+from utils.task_profiler import is_profiling_requested, profile_task
+from utils.batch_lock import acquire_batch_lock, renew_batch_lock, release_batch_lock
+from utils.Custom_Exceptions import TaskProcessingError, TaskProcessingException, BatchLockedError, CircuitOpenError
 
 # Initialize logger
 logger = get_logger("amend_status_logger")
@@ -43,9 +52,11 @@ def check_template_task_in_system_tasks(template_task_id):
         logger.error(f"Failed to check System_tasks collection: {db_check_error}")
         return False, str(db_check_error)
 
-def validate_template_task_parameters(system_task, template_task):
+def validate_template_task_parameters(system_task, template_task, batch_id=None):
     """
     Validates that the Template_Task_Id, task_type, and parameters match between the System_tasks and Template_Task collections.
+    With batch_id (the batch whose lock the caller holds), Case_Distribution_Batch_ID is checked against it instead of
+    the template task's parameters, which other processes point at their own batches.
     Returns: (success, message or error)
     """
     try:
@@ -61,7 +72,7 @@ def validate_template_task_parameters(system_task, template_task):
 
         # Check parameters (e.g., Case_Distribution_Batch_ID)
         system_task_batch_id = system_task["parameters"].get("Case_Distribution_Batch_ID", "")
-        template_task_batch_id = template_task["parameters"].get("Case_Distribution_Batch_ID", "")
+        template_task_batch_id = template_task["parameters"].get("Case_Distribution_Batch_ID", "") if batch_id is None else batch_id
 
         if system_task_batch_id != template_task_batch_id:
             mismatch_batch_id_error = f"Case_Distribution_Batch_ID mismatch: System_tasks has {system_task_batch_id}, Template_Task has {template_task_batch_id}."
@@ -74,22 +85,64 @@ def validate_template_task_parameters(system_task, template_task):
         logger.error(f"Failed to validate template task parameters: {validation_error}")
         return False, str(validation_error)
 
-def process_single_batch(task):
+def load_batch_for_task(task, system_task_collection, template_validated=False):
     """
-    Processes a single batch for the given task.
+    Fetch stage of a task: locks its batch, claims the task for processing, validates it and loads the cases of its batch.
+    The lock is released on failure; on success it is in batch_context["batch_lock"] and must be
+    released with release_batch_lock once the task is committed or has failed.
+    template_validated skips Steps 2-3 for tasks amend_task_processing has already checked against the template task.
+    Returns: batch context dictionary (raises TaskProcessingException on failure, BatchLockedError if the task could not be locked or claimed)
     """
     task_id = task["Task_Id"]
-    template_task_id = task["Template_Task_Id"]
-    task_type = task["task_type"]
     case_distribution_batch_id = task["parameters"]["Case_Distribution_Batch_ID"]
 
+    # Step 0: Lock the batch, so that no other process amends it at the same time
+    batch_lock = None
     try:
-        # Step 1: Update task status to "processing"
-        system_task_collection = get_collection("System_tasks")
-        success_update_task_status, error = update_task_status(system_task_collection, task_id, "processing", "Task is being processed")
-        if not success_update_task_status:
-            raise TaskProcessingException(error)
+        if get_processing_setting("LOCKING", "ENABLED", True, bool):
+            success_lock, batch_lock = acquire_batch_lock(case_distribution_batch_id)
+            if not success_lock:
+                raise BatchLockedError(f"Batch ID {case_distribution_batch_id} could not be locked.")
+
+        # Step 1: Claim the task, moving it from "open" to "processing" in one conditional write
+        claim_owner = batch_lock["owner"] if batch_lock is not None else uuid.uuid4().hex
+        success_claim_task, current_status = claim_task(system_task_collection, task_id, claim_owner)
+        if not success_claim_task:
+            raise BatchLockedError(f"Task ID {task_id} is already '{current_status}', another process has taken it.")
+    except TaskProcessingError as claim_error:
+        # The task has not been claimed by this process, so it is left open instead of being marked as error
+        release_batch_lock(batch_lock)
+        if isinstance(claim_error, BatchLockedError):
+            raise
+        raise BatchLockedError(f"Task ID {task_id} could not be claimed: {claim_error}")
 
+    try:
+        batch_context = _load_batch(task, system_task_collection, template_validated, batch_lock["batch_id"] if batch_lock is not None else None)
+    except Exception as load_error:
+        if isinstance(load_error, CircuitOpenError):
+            # The database is failing fast, so the task is given back to be retried instead of marked as error
+            release_task_claim(system_task_collection, task_id, claim_owner)
+        release_batch_lock(batch_lock)
+        raise
+
+    batch_context["claim_owner"] = claim_owner
+    batch_context["batch_lock"] = batch_lock
+    batch_context["fencing_token"] = batch_lock["fencing_token"] if batch_lock is not None else None
+    return batch_context
+
+def _load_batch(task, system_task_collection, template_validated=False, locked_batch_id=None):
+    """
+    Steps 2-5 of load_batch_for_task, run while the batch is locked and the task is claimed.
+    locked_batch_id is the batch the lock is held on, which the task's batch is validated against.
+    """
+    task_id = task["Task_Id"]
+    template_task_id = task["Template_Task_Id"]
+    task_type = task["task_type"]
+    case_distribution_batch_id = task["parameters"]["Case_Distribution_Batch_ID"]
+
+    # The template task only points at one batch at a time, so tasks that were validated before
+    # being queued for the parallel or pipeline modes are not checked against it again
+    if not template_validated:
         # Step 2: Fetch and validate template task
         template_task_collection = get_collection("Template_task")
         success_fetch_template_task, template_task = fetch_and_validate_template_task(template_task_collection, template_task_id, task_type)
@@ -97,71 +150,287 @@ def process_single_batch(task):
             raise TaskProcessingException(template_task)
 
         # Step 3: Validate that the Template_Task_Id, task_type, and parameters match between System_tasks and Template_Task collections
-        success_validate_parameters, error = validate_template_task_parameters(task, template_task)
+        success_validate_parameters, error = validate_template_task_parameters(task, template_task, locked_batch_id)
         if not success_validate_parameters:
             raise TaskProcessingException(error)
 
-        # Step 4: Fetch transaction details
-        transaction_collection = get_collection("Case_distribution_drc_transactions")
-        success_fetch_transaction_details, amend_details = fetch_transaction_details(transaction_collection, case_distribution_batch_id)
-        if not success_fetch_transaction_details:
-            raise TaskProcessingException(amend_details)
-
-        # Step 5: Fetch cases for the batch
-        case_collection = get_collection("DRS.Tmp_Case_Distribution_DRC")
-        success_fetch_cases_for_batch, cases = fetch_cases_for_batch(case_collection, case_distribution_batch_id)
-        if not success_fetch_cases_for_batch:
-            raise TaskProcessingException(cases)
-
-        # Convert cases to a dictionary format for balancing logic
-        drcs = {} 
-        existing_drcs = {}
-        for case in cases:
-            if "Case_Id" in case and "DRC_Id" in case and "RTOM" in case:
-                drcs[case["Case_Id"]] = [case["DRC_Id"], case["RTOM"]]
-                existing_drcs[case["Case_Id"]] = case["DRC_Id"]
+    # Step 4: Fetch transaction details
+    transaction_collection = get_collection("Case_distribution_drc_transactions")
+    success_fetch_transaction_details, amend_details = fetch_transaction_details(transaction_collection, case_distribution_batch_id)
+    if not success_fetch_transaction_details:
+        raise TaskProcessingException(amend_details)
+
+    batch_context = {
+        "task_id": task_id,
+        "case_distribution_batch_id": case_distribution_batch_id,
+        "array_of_distributions": amend_details.get("array_of_distributions", []),
+        "amend_batch_seq": amend_details.get("batch_seq"),
+        "drcs": None,
+        "existing_drcs": None,
+        "bucket_counts": None,
+        "count_matrix": None
+    }
+
+    # Step 4a: Read the DRC x RTOM count matrix of the batch (built once, then kept current by every commit)
+    case_collection = get_collection("DRS.Tmp_Case_Distribution_DRC")
+    summary_collection = get_collection("DRS_Database.Case_Distribution_DRC_Summary")
+    success_fetch_count_matrix, count_matrix = fetch_count_matrix(transaction_collection, summary_collection, case_collection, case_distribution_batch_id)
+    if not success_fetch_count_matrix:
+        raise TaskProcessingException(count_matrix)
+    batch_context["count_matrix"] = count_matrix
+
+    # Step 4b: Fail fast on distributions that cannot pass the 20% checks, using counts only
+    if get_processing_setting("PRECHECK", "ENABLED", True, bool):
+        count_source = get_processing_setting("PRECHECK", "COUNT_SOURCE", "matrix").lower()
+        success_precheck, precheck_result = precheck_distributions(
+            summary_collection, case_collection, case_distribution_batch_id, batch_context["array_of_distributions"], count_source,
+            count_matrix["counts"] if count_source == "matrix" else None, batch_context["amend_batch_seq"]
+        )
+        if not success_precheck:
+            raise TaskProcessingException(precheck_result)
+
+    # Out-of-core mode: batches above the configured size are only counted, never loaded
+    out_of_core_case_threshold = get_processing_setting("OUT_OF_CORE", "CASE_THRESHOLD", 0, int)
+    if out_of_core_case_threshold > 0:
+        case_count = sum(sum(resources.values()) for resources in count_matrix["counts"].values())
+        if case_count > out_of_core_case_threshold:
+            # The windowed update picks the moving cases by their DRC before this amend, so the plan is made from the same grouping.
+            # The matrix holds exactly those counts unless this amend's moves are already in it (a re-run), or that is not known.
+            if count_matrix["version"] is not None and count_matrix["amend_batch_seq"] is not None and count_matrix["amend_batch_seq"] != batch_context["amend_batch_seq"]:
+                bucket_counts = count_matrix["counts"]
             else:
-                logger.warning(f"Skipping case due to missing fields: {case}")
-
-        # Step 6: Process amendments
-        array_of_distributions = amend_details.get("array_of_distributions", [])
-        for distribution in array_of_distributions:
-            receiver_drc = distribution.get("receiver_drc_id")
-            donor_drc = distribution.get("donor_drc_id")
-            rtom = distribution.get("rtom")
-            transfer_value = distribution.get("transfer_count")
-
-            # Step 7: Run the balancing logic
-            success_balance_resources, updated_drcs = balance_resources(drcs, receiver_drc, donor_drc, rtom, transfer_value)
-            if not success_balance_resources:
-                raise TaskProcessingException(updated_drcs)
-
-            # Step 8: Update case distribution collection
-            success_update_case_distribution, original_states = update_case_distribution_collection(case_collection, updated_drcs, existing_drcs)
-            if not success_update_case_distribution:
-                raise TaskProcessingException(original_states)
-
-            # Step 9: Update summary in MongoDB
-            summary_collection = get_collection("DRS_Database.Case_Distribution_DRC_Summary")
-            success_update_summary, original_counts = update_summary_in_mongo(summary_collection, transaction_collection, updated_drcs, case_distribution_batch_id)
-            if not success_update_summary:
-                # Rollback case distribution collection if summary update fails
-                rollback_case_distribution_collection(case_collection, original_states)
-                raise TaskProcessingException(original_counts)
-
-        # Step 10: Update task status to "completed"
-        success_update_task_status_completed, error = update_task_status(system_task_collection, task_id, "completed", "Task completed successfully")
-        if not success_update_task_status_completed:
-            # Rollback both case distribution and summary collections if task status update fails
-            rollback_case_distribution_collection(case_collection, original_states)
-            rollback_summary_in_mongo(summary_collection, original_counts, case_distribution_batch_id)
-            raise TaskProcessingException(error)
-        logger.info(f"Task ID {task_id} completed successfully.")
+                success_count_cases, bucket_counts = fetch_case_counts_for_batch(case_collection, case_distribution_batch_id, batch_context["amend_batch_seq"])
+                if not success_count_cases:
+                    raise TaskProcessingException(bucket_counts)
+            logger.info(f"Batch ID {case_distribution_batch_id} has {case_count} cases, processing it out of core.")
+            batch_context["bucket_counts"] = bucket_counts
+            return batch_context
+
+    # Step 5: Fetch cases for the batch
+    success_fetch_cases_for_batch, cases = fetch_cases_for_batch(case_collection, case_distribution_batch_id)
+    if not success_fetch_cases_for_batch:
+        raise TaskProcessingException(cases)
+
+    # Convert cases to a dictionary format for balancing logic, from their DRC before this amend
+    drcs = {} 
+    existing_drcs = {}
+    for case in cases:
+        if "Case_Id" in case and "DRC_Id" in case and "RTOM" in case:
+            case_drc = prior_drc(case, batch_context["amend_batch_seq"])
+            drcs[case["Case_Id"]] = [case_drc, case["RTOM"]]
+            existing_drcs[case["Case_Id"]] = case_drc
+        else:
+            logger.warning(f"Skipping case due to missing fields: {case}")
+
+    batch_context["drcs"] = drcs
+    batch_context["existing_drcs"] = existing_drcs
+    return batch_context
+
+def commit_batch_plan(batch_context, batch_plan, system_task_collection, status_batch=None):
+    """
+    Write stage of a task: stores the planned allocation and marks the task as completed.
+    batch_plan is the updated_drcs of a loaded batch, or the case flows of an out-of-core batch.
+    Raises TaskProcessingException on failure, after rolling back what was already written
+    (CircuitOpenError as it is, so that the caller can leave the task open).
+    With a status_batch, the completed status is queued in it instead, and rolled back if its flush fails.
+    """
+    task_id = batch_context["task_id"]
+    case_distribution_batch_id = batch_context["case_distribution_batch_id"]
+    case_collection = get_collection("DRS.Tmp_Case_Distribution_DRC")
+    transaction_collection = get_collection("Case_distribution_drc_transactions")
+    summary_collection = get_collection("DRS_Database.Case_Distribution_DRC_Summary")
+    fencing_token = batch_context.get("fencing_token")
+
+    # Step 7a: Make sure the batch lock is still ours, and extend it for the writes
+    renew_batch_lock(batch_context.get("batch_lock"))
+
+    if batch_context.get("bucket_counts") is None:
+        # Step 8: Update case distribution collection
+        success_update_case_distribution, original_states, case_write_counts = update_case_distribution_collection(case_collection, batch_plan, batch_context["existing_drcs"], case_distribution_batch_id, fencing_token=fencing_token, amend_batch_seq=batch_context.get("amend_batch_seq"))
+    else:
+        # Step 8: Stream the moving cases into the case distribution collection window by window
+        window_size = get_processing_setting("OUT_OF_CORE", "WINDOW_SIZE", 1000, int)
+        success_update_case_distribution, original_states, case_write_counts = update_case_distribution_in_windows(case_collection, case_distribution_batch_id, batch_plan["case_flows"], window_size, fencing_token, batch_context.get("amend_batch_seq"))
+    if not success_update_case_distribution:
+        raise TaskProcessingException(original_states)
+
+    # Step 9: Update summary in MongoDB from the count matrix and the cases this amend actually moved
+    count_deltas = compute_flow_count_deltas(case_write_counts["case_flows"])
+    count_matrix = batch_context["count_matrix"]
+    try:
+        success_update_summary, original_counts = update_summary_counts_in_mongo(summary_collection, transaction_collection, apply_count_deltas(count_matrix["counts"], count_deltas), case_distribution_batch_id, fencing_token)
+    except TaskProcessingError as summary_error:
+        # Retries are exhausted at this point, so treat it like any other failed update
+        success_update_summary, original_counts = False, summary_error
+
+    if not success_update_summary:
+        # Rollback case distribution collection if summary update fails
+        rollback_case_distribution_collection(case_collection, original_states, case_distribution_batch_id, fencing_token)
+        raise _commit_error(original_counts)
+
+    # Step 9a: Apply the delta to the stored count matrix
+    try:
+        success_update_count_matrix, updated_count_matrix = update_count_matrix(transaction_collection, case_distribution_batch_id, count_matrix, count_deltas, batch_context["amend_batch_seq"])
+    except TaskProcessingError as count_matrix_error:
+        rollback_case_distribution_collection(case_collection, original_states, case_distribution_batch_id, fencing_token)
+        rollback_summary_in_mongo(summary_collection, original_counts, case_distribution_batch_id, fencing_token)
+        raise _commit_error(count_matrix_error)
+
+    # Step 9b: Write the move plan of the task for audits (if enabled; a failed export does not fail the task).
+    # A commit that moved nothing leaves any earlier plan of the task as it is, and so does its rollback.
+    move_plan_file = None
+    if case_write_counts["modified"]:
+        success_export_move_plan, move_plan_file = export_move_plan(task_id, case_distribution_batch_id, batch_context["array_of_distributions"], case_write_counts["case_moves"])
+
+    def rollback_commit():
+        # Rollback the case distribution and summary collections and the count matrix if the task status update fails
+        rollback_case_distribution_collection(case_collection, original_states, case_distribution_batch_id, fencing_token)
+        rollback_summary_in_mongo(summary_collection, original_counts, case_distribution_batch_id, fencing_token)
+        rollback_count_matrix(transaction_collection, case_distribution_batch_id, count_matrix, updated_count_matrix)
+        remove_move_plan(move_plan_file)
+
+    completed_description = f"Task completed successfully. Cases planned: {len(original_states)}, matched: {case_write_counts['matched']}, modified: {case_write_counts['modified']}"
+    if status_batch is not None:
+        # Step 10: Queue the "completed" status; the caller writes it with other tasks' statuses and keeps the lock until then
+        def on_status_failure():
+            rollback_commit()
+            mark_task_error(system_task_collection, task_id, "Failed to write the completed status, the amend was rolled back.")
+        status_batch.add(task_id, "completed", completed_description, on_status_failure)
+        logger.info(f"Task ID {task_id} committed, completed status queued: {len(original_states)} cases planned.")
+        return
+
+    # Step 10: Update task status to "completed"
+    try:
+        success_update_task_status_completed, error = update_task_status(system_task_collection, task_id, "completed", completed_description)
+    except TaskProcessingError as status_error:
+        success_update_task_status_completed, error = False, status_error
+    if not success_update_task_status_completed:
+        rollback_commit()
+        raise _commit_error(error)
+    logger.info(f"Task ID {task_id} completed successfully: {len(original_states)} cases planned, {case_write_counts['matched']} matched, {case_write_counts['modified']} modified.")
+
+def _commit_error(error):
+    """
+    Returns the exception a failed commit step raises: an open circuit breaker is passed on as it is,
+    anything else becomes a TaskProcessingException.
+    """
+    return error if isinstance(error, CircuitOpenError) else TaskProcessingException(str(error))
+
+def process_single_batch(task, template_validated=False):
+    """
+    Processes a single batch for the given task, under cProfile and tracemalloc if profiling is requested for it.
+    """
+    if is_profiling_requested(task):
+        with profile_task(task["Task_Id"]):
+            _process_single_batch(task, template_validated)
+    else:
+        _process_single_batch(task, template_validated)
+
+def _process_single_batch(task, template_validated=False):
+    """
+    Runs every stage of a single task: load, plan and commit.
+    """
+    task_id = task["Task_Id"]
+    system_task_collection = get_collection("System_tasks")
+    batch_context = None
 
-    except TaskProcessingException as error_message:
+    try:
+        # Steps 0-5: Lock the batch, validate the task and load its cases
+        batch_context = load_batch_for_task(task, system_task_collection, template_validated)
+
+        # Steps 6-7: Run the balancing logic for every distribution of the amend action
+        success_plan_batch, batch_plan = plan_batch_context(batch_context)
+        if not success_plan_batch:
+            raise TaskProcessingException(batch_plan)
+
+        # Steps 8-10: Write the new allocation and complete the task
+        commit_batch_plan(batch_context, batch_plan, system_task_collection)
+
+    except BatchLockedError as locked_error:
+        # Another process is amending this batch: leave the task to it, or to the next run
+        logger.warning(f"Skipping Task ID {task_id}: {locked_error}")
+    except CircuitOpenError as circuit_error:
+        # The database is failing fast: the task did not fail, so it is left open for the next run
+        logger.warning(f"Skipping Task ID {task_id}: {circuit_error}")
+        if batch_context is not None:
+            release_task_claim(system_task_collection, task_id, batch_context["claim_owner"])
+    except TaskProcessingError as error_message:
         logger.error(f"Error in Task ID {task_id}: {error_message}")
         # Update task status to "error" and add error description
-        update_task_status(system_task_collection, task_id, "error", str(error_message))
+        mark_task_error(system_task_collection, task_id, str(error_message))
+    finally:
+        if batch_context is not None:
+            release_batch_lock(batch_context["batch_lock"])
+
+def process_batches_in_parallel(tasks, max_workers=None, template_validated=False):
+    """
+    Processes many tasks in three stages: every batch is loaded first, all of them are planned
+    together on a process pool, and the plans are then written back one by one by this process.
+    Tasks that share a batch with an earlier task are processed serially afterwards, so each
+    plan is computed from the data its own task will write over.
+    """
+    system_task_collection = get_collection("System_tasks")
+    status_batch = TaskStatusBatch(system_task_collection)
+    batch_contexts = {}
+    deferred_tasks = []
+    planned_batch_ids = set()
+
+    # Stage 1: Fetch every batch
+    for task in tasks:
+        task_id = task["Task_Id"]
+        if task["parameters"].get("Case_Distribution_Batch_ID") in planned_batch_ids:
+            deferred_tasks.append(task)
+            continue
+        try:
+            batch_context = load_batch_for_task(task, system_task_collection, template_validated)
+            batch_contexts[task_id] = batch_context
+            planned_batch_ids.add(batch_context["case_distribution_batch_id"])
+        except (BatchLockedError, CircuitOpenError) as skip_error:
+            logger.warning(f"Skipping Task ID {task_id}: {skip_error}")
+        except TaskProcessingError as error_message:
+            logger.error(f"Error in Task ID {task_id}: {error_message}")
+            status_batch.add(task_id, "error", str(error_message), partial(mark_task_error, system_task_collection, task_id, str(error_message)))
+
+    try:
+        # Stage 2: Plan all batches on every core (out-of-core batches only need their counts planned)
+        plans = plan_batches_in_parallel(
+            {
+                task_id: (context["drcs"], context["array_of_distributions"])
+                for task_id, context in batch_contexts.items() if context["bucket_counts"] is None
+            },
+            max_workers
+        )
+        for task_id, context in batch_contexts.items():
+            if context["bucket_counts"] is not None:
+                # A failed plan fails its own task in Stage 3, like the plans of the pool
+                try:
+                    plans[task_id] = plan_batch_context(context)
+                except Exception as planning_error:
+                    logger.error(f"Failed to plan batch of Task ID {task_id}: {planning_error}")
+                    plans[task_id] = (False, str(planning_error))
+
+        # Stage 3: Single writer, with the task statuses written in bulk before the batch locks are released
+        for task_id, batch_context in batch_contexts.items():
+            try:
+                success_plan_batch, batch_plan = plans[task_id]
+                if not success_plan_batch:
+                    raise TaskProcessingException(batch_plan)
+                commit_batch_plan(batch_context, batch_plan, system_task_collection, status_batch)
+            except CircuitOpenError as circuit_error:
+                logger.warning(f"Skipping Task ID {task_id}: {circuit_error}")
+                release_task_claim(system_task_collection, task_id, batch_context["claim_owner"])
+            except TaskProcessingError as error_message:
+                logger.error(f"Error in Task ID {task_id}: {error_message}")
+                status_batch.add(task_id, "error", str(error_message), partial(mark_task_error, system_task_collection, task_id, str(error_message)))
+            if len(status_batch) >= status_batch.bulk_size:
+                status_batch.flush()
+        status_batch.flush()
+    finally:
+        for batch_context in batch_contexts.values():
+            release_batch_lock(batch_context["batch_lock"])
+
+    for task in deferred_tasks:
+        process_single_batch(task, template_validated)
 
 def amend_task_processing():
     """
@@ -172,6 +441,8 @@ def amend_task_processing():
     try:
         # Step 1: Read the TEMPLATE_TASK_ID from the INI file
         template_task_id = get_template_task_id()
+        processing_mode = get_processing_setting("PROCESSING", "PROCESSING_MODE", "serial").lower()
+        locking_enabled = get_processing_setting("LOCKING", "ENABLED", True, bool)
 
         # Step 2: Update the Template_Task collection with the new TEMPLATE_TASK_ID and parameters
         system_task_collection = get_collection("System_tasks")
@@ -184,6 +455,14 @@ def amend_task_processing():
             logger.warning(f"No open tasks found for Template_Task_Id {template_task_id}. Skipping resource balancing.")
             return
 
+        # Order the open tasks by estimated cost, so that small batches are not stuck behind large ones
+        success_schedule_tasks, scheduled_tasks = schedule_tasks(open_tasks)
+        if success_schedule_tasks:
+            open_tasks = scheduled_tasks
+        else:
+            logger.warning(f"Could not schedule the open tasks, processing them in arrival order: {scheduled_tasks}")
+
+        validated_tasks = []
         for task in open_tasks:
             case_distribution_batch_id = task["parameters"].get("Case_Distribution_Batch_ID", "")
             success_update_template_task, error = update_template_task_collection(case_distribution_batch_id)
@@ -202,13 +481,22 @@ def amend_task_processing():
                 logger.error(error_message)
                 raise TaskProcessingException(error_message)
 
-            # Step 4: Validate Template_Task_Id, task_type, and parameters
-            success_validate_parameters, error = validate_template_task_parameters(task, template_task)
+            # Step 4: Validate Template_Task_Id, task_type, and parameters. With batch locks, other processes may have
+            # pointed the template task at their own batch since, so the batch is validated under the lock instead.
+            success_validate_parameters, error = validate_template_task_parameters(task, template_task, case_distribution_batch_id if locking_enabled else None)
             if not success_validate_parameters:
                 raise TaskProcessingException(error)
 
-            # Step 5: Process the task
-            process_single_batch(task)
+            # Step 5: Process the task (profiled tasks run on their own, so their reports only cover their own work)
+            if processing_mode in ("parallel", "pipeline") and not is_profiling_requested(task):
+                validated_tasks.append(task)
+            else:
+                process_single_batch(task)
+
+        if validated_tasks and processing_mode == "pipeline":
+            process_batches_in_pipeline(validated_tasks, partial(load_batch_for_task, template_validated=True), commit_batch_plan, get_processing_setting("PIPELINE", "QUEUE_SIZE", 4, int))
+        elif validated_tasks:
+            process_batches_in_parallel(validated_tasks, get_processing_setting("PARALLEL", "MAX_WORKERS", 0, int), template_validated=True)
 
     except TaskProcessingException as processing_error:
         logger.error(f"An unexpected error occurred during task processing: {processing_error}")
@@ -0,0 +1,160 @@
+'''
+task_scheduler.py file is as follows:
+
+    Purpose: This script orders open amend tasks by their estimated cost before they are processed.
+    Created Date: 2025-04-07
+    Created By:  T.S.Balasooriya (tharindutsb@gmail.com) , Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Last Modified Date: 2025-04-07
+    Modified By: T.S.Balasooriya (tharindutsb@gmail.com), Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Version: Python 3.9
+    Dependencies: collections, heapq, utils.loggers, utils.connectDB, utils.read_amend_processing_ini, utils.resilience
+    Notes:
+        - The cost of a task is estimated as case_count * (1 + number of distributions): every case is loaded
+          once, and every distribution works through the buckets it moves cases between.
+        - Case counts come from Case_Distribution_DRC_Summary in one aggregate for all batches. Batches without
+          summary rows are counted on the case collection instead. If the counts cannot be read, the tasks are
+          processed in arrival order (fifo) rather than not at all.
+        - Policies ([SCHEDULER] POLICY):
+            fifo           - the order System_tasks returns (the behaviour without a scheduler).
+            shortest_first - higher "priority" first (missing, null or non-numeric is 0), then cheapest first, so that small batches are not
+                             queued behind a huge one.
+        - Tasks of the same batch always keep their original order, since each one amends the result of the
+          one before: only the next task of each batch is a candidate at any time.
+        - With [SCHEDULER] FAIR_SHARE the batches also take turns: at equal priority, the n-th task of a batch only
+          runs once every other batch has had n tasks scheduled (or has none left), so one batch's backlog cannot
+          hold back the others.
+'''
+
+from collections import OrderedDict, deque
+from heapq import heappop, heappush
+from utils.loggers import get_logger
+from utils.connectDB import get_collection, CASE_COLLECTION, CASE_DRC_SUMMARY, TRANSACTION_COLLECTION
+from utils.read_amend_processing_ini import get_processing_setting
+from utils.resilience import call_with_retry
+
+logger = get_logger("amend_status_logger")
+
+SCHEDULING_POLICIES = ("fifo", "shortest_first")
+
+def fetch_batch_case_counts(batch_ids):
+    """
+    Counts the cases of every batch, from the summary collection or, for batches without summary rows, the case collection.
+    Returns: (success, {batch_id: case count} or error)
+    """
+    try:
+        case_counts = {}
+        for summary in call_with_retry("schedule_tasks", lambda: list(get_collection(CASE_DRC_SUMMARY).aggregate([
+            {"$match": {"Case_Distribution_Batch_ID": {"$in": list(batch_ids)}}},
+            {"$group": {"_id": "$Case_Distribution_Batch_ID", "Count": {"$sum": "$Count"}}}
+        ]))):
+            case_counts[summary["_id"]] = summary["Count"]
+
+        missing_batch_ids = [batch_id for batch_id in batch_ids if not case_counts.get(batch_id)]
+        if missing_batch_ids:
+            for batch in call_with_retry("schedule_tasks", lambda: list(get_collection(CASE_COLLECTION).aggregate([
+                {"$match": {"Case_Distribution_Batch_ID": {"$in": missing_batch_ids}}},
+                {"$group": {"_id": "$Case_Distribution_Batch_ID", "Count": {"$sum": 1}}}
+            ]))):
+                case_counts[batch["_id"]] = batch["Count"]
+        return True, case_counts
+    except Exception as fetch_error:
+        logger.error(f"Failed to count the cases of the scheduled batches: {fetch_error}")
+        return False, str(fetch_error)
+
+def fetch_batch_distribution_counts(batch_ids):
+    """
+    Counts the distributions of the open amend action of every batch.
+    Returns: (success, {batch_id: distribution count} or error)
+    """
+    try:
+        distribution_counts = {}
+        for transaction in call_with_retry("schedule_tasks", lambda: list(get_collection(TRANSACTION_COLLECTION).find(
+            {"Case_Distribution_Batch_ID": {"$in": list(batch_ids)}, "summery_status": "open"},
+            {"Case_Distribution_Batch_ID": 1, "batch_seq_details": 1}
+        ))):
+            for batch_seq in transaction.get("batch_seq_details", []):
+                if batch_seq.get("action_type") == "amend" and batch_seq.get("CRD_Distribution_Status") == "open":
+                    distribution_counts[transaction["Case_Distribution_Batch_ID"]] = len(batch_seq.get("array_of_distributions", []))
+                    break
+        return True, distribution_counts
+    except Exception as fetch_error:
+        logger.error(f"Failed to count the distributions of the scheduled batches: {fetch_error}")
+        return False, str(fetch_error)
+
+def estimate_task_costs(tasks):
+    """
+    Estimates the processing cost of every task from its batch size and its number of distributions.
+    Returns: (success, {Task_Id: estimated cost} or error)
+    """
+    batch_ids = {task["parameters"].get("Case_Distribution_Batch_ID") for task in tasks}
+    success_case_counts, case_counts = fetch_batch_case_counts(batch_ids)
+    if not success_case_counts:
+        return False, case_counts
+    success_distribution_counts, distribution_counts = fetch_batch_distribution_counts(batch_ids)
+    if not success_distribution_counts:
+        return False, distribution_counts
+
+    task_costs = {}
+    for task in tasks:
+        batch_id = task["parameters"].get("Case_Distribution_Batch_ID")
+        task_costs[task["Task_Id"]] = case_counts.get(batch_id, 0) * (1 + distribution_counts.get(batch_id, 0))
+    return True, task_costs
+
+def _task_priority(task):
+    """
+    Returns the "priority" of a task as an int, 0 when it is missing, null or not a number.
+    """
+    try:
+        return int(task.get("priority") or 0)
+    except (TypeError, ValueError):
+        logger.warning(f"Task ID {task['Task_Id']} has a non-numeric priority {task.get('priority')!r}, scheduling it with priority 0.")
+        return 0
+
+def schedule_tasks(tasks, policy=None, fair_share=None):
+    """
+    Orders open tasks according to the scheduling policy (see the notes above).
+    Returns: (success, ordered tasks or error) - on error the caller keeps the arrival order.
+    """
+    if policy is None:
+        policy = get_processing_setting("SCHEDULER", "POLICY", "fifo").lower()
+    if policy not in SCHEDULING_POLICIES:
+        logger.warning(f"Unknown scheduling policy '{policy}', processing tasks in arrival order.")
+        policy = "fifo"
+    if policy == "fifo" or len(tasks) < 2:
+        return True, list(tasks)
+
+    success_estimate, task_costs = estimate_task_costs(tasks)
+    if not success_estimate:
+        return False, task_costs
+    if fair_share is None:
+        fair_share = get_processing_setting("SCHEDULER", "FAIR_SHARE", True, bool)
+
+    # One queue per batch, in arrival order; only the head of each queue can be scheduled
+    batch_queues = OrderedDict()
+    for task in tasks:
+        batch_queues.setdefault(task["parameters"].get("Case_Distribution_Batch_ID"), deque()).append(task)
+
+    def push_batch_head(batch_id, batch_turn):
+        task = batch_queues[batch_id][0]
+        # batch_turn first makes the batches take turns; arrival breaks the remaining ties
+        heappush(ready_tasks, (-priority[task["Task_Id"]], batch_turn if fair_share else 0, task_costs[task["Task_Id"]], arrival[task["Task_Id"]], batch_id, batch_turn))
+
+    arrival = {task["Task_Id"]: position for position, task in enumerate(tasks)}
+    priority = {task["Task_Id"]: _task_priority(task) for task in tasks}
+    ready_tasks = []
+    for batch_id in batch_queues:
+        push_batch_head(batch_id, 0)
+
+    ordered_tasks = []
+    while ready_tasks:
+        *_, batch_id, batch_turn = heappop(ready_tasks)
+        ordered_tasks.append(batch_queues[batch_id].popleft())
+        if batch_queues[batch_id]:
+            push_batch_head(batch_id, batch_turn + 1)
+
+    logger.info(
+        f"Scheduled {len(ordered_tasks)} tasks ({policy}): "
+        + ", ".join(f"{task['Task_Id']} (cost {task_costs[task['Task_Id']]})" for task in ordered_tasks[:20])
+        + (" ..." if len(ordered_tasks) > 20 else "")
+    )
+    return True, ordered_tasks
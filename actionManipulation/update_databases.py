@@ -7,16 +7,21 @@ update_databases.py file is as follows:
     Last Modified Date: 2025-03-15
     Modified By: T.S.Balasooriya (tharindutsb@gmail.com), Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)     
     Version: Python 3.9
-    Dependencies: datetime, collections, utils.loggers, utils.connectDB, utils.Custom_Exceptions, utils.read_template_task_id_ini
+    Dependencies: datetime, collections, utils.loggers, utils.connectDB, utils.Custom_Exceptions, utils.resilience, utils.batch_lock, utils.read_template_task_id_ini, actionManipulation.database_checks
     Notes:
+        - With a fencing_token (see utils.batch_lock), case and summary updates are stamped with it and skip
+          documents written under a newer token; a write rejected that way raises StaleFencingTokenError.
 '''
 # update_databases.py
 from datetime import datetime
 from collections import defaultdict
 from utils.loggers import get_logger
 from utils.connectDB import get_collection
-from utils.Custom_Exceptions import DatabaseUpdateError
+from utils.Custom_Exceptions import TaskProcessingError, DatabaseUpdateError, StaleFencingTokenError
+from utils.resilience import call_with_retry
+from utils.batch_lock import fencing_filter
 from utils.read_template_task_id_ini import get_template_task_id
+from actionManipulation.database_checks import prior_drc_filter
 
 logger = get_logger("amend_status_logger")
 
@@ -81,50 +86,188 @@ def update_template_task_collection(case_distribution_batch_id):
         logger.error(f"Failed to update Template_Task collection: {update_error}")
         return False, str(update_error)
 
-def update_case_distribution_collection(case_collection, updated_drcs, existing_drcs):
+def update_case_distribution_collection(case_collection, updated_drcs, existing_drcs, case_distribution_batch_id, chunk_size=1000, fencing_token=None, amend_batch_seq=None):
     """
     Updates the case distribution collection with the new DRC and resource values.
-    Returns: (success, message or error, original_states)
+    existing_drcs holds the DRC of every case before the amend action amend_batch_seq (see prior_drc).
+    Only cases of this batch that still hold that DRC are written, so a retry or re-run modifies nothing twice.
+    Returns: (success, original_states or error, write_counts)
+    write_counts holds the matched and modified totals, the (from_drc, to_drc, rtom, modified count)
+    case flows that were actually written, and the (from_drc, to_drc, rtom, case_ids) case_moves of the cases modified.
     """
     try:
         logger.info("Updating case distribution collection...")
         
-        # Store the original state for rollback
+        # Store the original state for rollback, and group the moving cases by (from DRC, to DRC, RTOM)
         original_states = {}
+        moves = defaultdict(list)
         for case_id, (new_drc, resource) in updated_drcs.items():
             if case_id in existing_drcs and existing_drcs[case_id] != new_drc:
-                # Save the original DRC for rollback
                 original_states[case_id] = existing_drcs[case_id]
+                moves[(existing_drcs[case_id], new_drc, resource)].append(case_id)
 
-                # Update the case distribution
-                result = case_collection.update_one(
-                    {"Case_Id": case_id},
-                    {
-                        "$set": {
-                            "NEW_DRC_ID": new_drc,
-                            "Proceed_On": datetime.now(),
-                            "Amend_Status": "Completed",
-                            "Amend_Description": f"Transferred to {new_drc}"
-                        }
-                    }
-                )
-                logger.debug(f"Update result for Case_Id {case_id}: {result.matched_count} documents matched, {result.modified_count} documents modified.")
+        write_counts = {"matched": 0, "modified": 0, "case_flows": [], "case_moves": []}
+        written_states = {}
+        try:
+            for (original_drc, new_drc, resource), case_ids in moves.items():
+                modified_count = 0
+                modified_case_ids = []
+                for start in range(0, len(case_ids), chunk_size):
+                    written_states.update(dict.fromkeys(case_ids[start:start + chunk_size], original_drc))
+                    result, window_modified_case_ids = _update_case_window(case_collection, case_distribution_batch_id, case_ids[start:start + chunk_size], original_drc, new_drc, fencing_token, amend_batch_seq)
+                    write_counts["matched"] += result.matched_count
+                    modified_count += result.modified_count
+                    modified_case_ids.extend(window_modified_case_ids)
+                write_counts["modified"] += modified_count
+                write_counts["case_flows"].append((original_drc, new_drc, resource, modified_count))
+                if modified_case_ids:
+                    write_counts["case_moves"].append((original_drc, new_drc, resource, modified_case_ids))
+            _check_case_fencing(case_collection, case_distribution_batch_id, fencing_token, write_counts, len(original_states))
+        except Exception:
+            _rollback_written_cases(case_collection, written_states, case_distribution_batch_id, fencing_token)
+            raise
+
+        logger.info(f"Case distribution update for Batch ID {case_distribution_batch_id}: {len(original_states)} cases planned, {write_counts['matched']} matched, {write_counts['modified']} modified.")
+        return True, original_states, write_counts  # Success
+    except TaskProcessingError:
+        raise
+    except Exception as update_error:
+        logger.error(f"Failed to update case distribution collection: {update_error}")
+        raise DatabaseUpdateError(f"Failed to update case distribution collection: {update_error}")
+
+def update_case_distribution_in_windows(case_collection, case_distribution_batch_id, case_flows, window_size=1000, fencing_token=None, amend_batch_seq=None):
+    """
+    Moves cases between DRCs without loading the batch: for every (from_drc, to_drc, rtom, count) flow,
+    the Case_Ids of the moving cases are streamed from a cursor and updated window_size at a time.
+    Cases are picked by their DRC before the amend action amend_batch_seq, as the flows were planned.
+    Returns: (success, original_states or error, write_counts) as update_case_distribution_collection
+    """
+    try:
+        logger.info(f"Updating case distribution collection in windows of {window_size} cases...")
+
+        # Cases already taken from a (DRC, RTOM) bucket by an earlier flow are skipped
+        bucket_offsets = defaultdict(int)
+        original_states = {}
+        write_counts = {"matched": 0, "modified": 0, "case_flows": [], "case_moves": []}
+        try:
+            for from_drc, to_drc, rtom, count in case_flows:
+                cursor = case_collection.find(
+                    dict(prior_drc_filter(from_drc, amend_batch_seq), Case_Distribution_Batch_ID=case_distribution_batch_id, RTOM=rtom),
+                    {"Case_Id": 1, "_id": 0}
+                ).sort("Case_Id", 1).skip(bucket_offsets[(from_drc, rtom)]).limit(count).batch_size(window_size)
+                bucket_offsets[(from_drc, rtom)] += count
 
-        return True, original_states  # Success
+                window = []
+                modified_count = 0
+                flow_case_ids = []
+                for case in cursor:
+                    window.append(case["Case_Id"])
+                    if len(window) == window_size:
+                        original_states.update(dict.fromkeys(window, from_drc))
+                        result, window_modified_case_ids = _update_case_window(case_collection, case_distribution_batch_id, window, from_drc, to_drc, fencing_token, amend_batch_seq)
+                        write_counts["matched"] += result.matched_count
+                        modified_count += result.modified_count
+                        flow_case_ids.extend(window_modified_case_ids)
+                        window = []
+                if window:
+                    original_states.update(dict.fromkeys(window, from_drc))
+                    result, window_modified_case_ids = _update_case_window(case_collection, case_distribution_batch_id, window, from_drc, to_drc, fencing_token, amend_batch_seq)
+                    write_counts["matched"] += result.matched_count
+                    modified_count += result.modified_count
+                    flow_case_ids.extend(window_modified_case_ids)
+                write_counts["modified"] += modified_count
+                if flow_case_ids:
+                    write_counts["case_moves"].append((from_drc, to_drc, rtom, flow_case_ids))
+                write_counts["case_flows"].append((from_drc, to_drc, rtom, modified_count))
+            _check_case_fencing(case_collection, case_distribution_batch_id, fencing_token, write_counts, len(original_states))
+        except Exception:
+            _rollback_written_cases(case_collection, original_states, case_distribution_batch_id, fencing_token)
+            raise
+
+        logger.info(f"Case distribution update for Batch ID {case_distribution_batch_id}: {len(original_states)} cases planned, {write_counts['matched']} matched, {write_counts['modified']} modified.")
+        return True, original_states, write_counts  # Success
+    except TaskProcessingError:
+        raise
     except Exception as update_error:
         logger.error(f"Failed to update case distribution collection: {update_error}")
         raise DatabaseUpdateError(f"Failed to update case distribution collection: {update_error}")
 
-def rollback_case_distribution_collection(case_collection, original_states):
+def _update_case_window(case_collection, case_distribution_batch_id, case_ids, original_drc, new_drc, fencing_token=None, amend_batch_seq=None):
+    """
+    Assigns one window of cases to new_drc. The filter is the expected prior state of the cases (their
+    current DRC is still original_drc), so cases that already moved are matched by nothing and are not rewritten.
+    Every moved case is stamped with the amend action and its prior DRC, which re-runs of that action plan from.
+    Returns: (update result, Case_Ids of the cases this write modified)
+    """
+    case_filter = {
+        "Case_Distribution_Batch_ID": case_distribution_batch_id,
+        "Case_Id": {"$in": case_ids},
+        "$and": [prior_drc_filter(original_drc)]
+    }
+    # MongoDB stores dates to the millisecond, so Proceed_On is truncated to read the modified cases back
+    proceed_on = datetime.now()
+    proceed_on = proceed_on.replace(microsecond=proceed_on.microsecond // 1000 * 1000)
+    case_update = {
+        "NEW_DRC_ID": new_drc,
+        "Proceed_On": proceed_on,
+        "Amend_Status": "Completed",
+        "Amend_Description": f"Transferred to {new_drc}",
+        "Amend_Batch_Seq": amend_batch_seq,
+        "Amend_Prior_DRC_ID": original_drc
+    }
+    if fencing_token is not None:
+        case_filter["$and"].append(fencing_filter(fencing_token))
+        case_update["Fencing_Token"] = fencing_token
+
+    result = call_with_retry("update_case_distribution_collection", case_collection.update_many, case_filter, {"$set": case_update})
+    logger.debug(f"Window update from {original_drc} to {new_drc}: {len(case_ids)} cases, {result.matched_count} documents matched, {result.modified_count} documents modified.")
+    if result.modified_count == len(case_ids):
+        return result, list(case_ids)
+    if result.modified_count == 0:
+        return result, []
+    # Only part of the window moved (e.g. a re-run after a partial commit): read back which cases this write stamped
+    modified_cases = call_with_retry("update_case_distribution_collection", lambda: list(case_collection.find(
+        {"Case_Distribution_Batch_ID": case_distribution_batch_id, "Case_Id": {"$in": case_ids}, "NEW_DRC_ID": new_drc, "Proceed_On": proceed_on},
+        {"Case_Id": 1, "_id": 0}
+    )))
+    return result, [case["Case_Id"] for case in modified_cases]
+
+def _check_case_fencing(case_collection, case_distribution_batch_id, fencing_token, write_counts, planned_count):
+    """
+    Raises StaleFencingTokenError when planned cases were not matched because a newer lock holder wrote them.
+    """
+    if fencing_token is None or write_counts["matched"] >= planned_count:
+        return
+    if case_collection.count_documents({"Case_Distribution_Batch_ID": case_distribution_batch_id, "Fencing_Token": {"$gt": fencing_token}}):
+        error_message = f"Cases of Batch ID {case_distribution_batch_id} were written under a newer fencing token than {fencing_token}."
+        logger.error(error_message)
+        raise StaleFencingTokenError(error_message)
+
+def _rollback_written_cases(case_collection, written_states, case_distribution_batch_id, fencing_token=None):
+    """
+    Rolls back the cases a failed update may have written before it failed. A failed rollback is only logged.
+    """
+    if not written_states:
+        return
+    try:
+        rollback_case_distribution_collection(case_collection, written_states, case_distribution_batch_id, fencing_token)
+    except DatabaseUpdateError:
+        pass
+
+def rollback_case_distribution_collection(case_collection, original_states, case_distribution_batch_id, fencing_token=None):
     """
     Rolls back the case distribution collection to its original state.
+    With a fencing_token, only cases this lock holder wrote are rolled back.
     Returns: (success, message or error)
     """
     try:
         logger.info("Rolling back case distribution collection...")
+        rollback_filter = {"Case_Distribution_Batch_ID": case_distribution_batch_id}
+        if fencing_token is not None:
+            rollback_filter["Fencing_Token"] = fencing_token
         for case_id, original_drc in original_states.items():
             case_collection.update_one(
-                {"Case_Id": case_id},
+                dict(rollback_filter, Case_Id=case_id, NEW_DRC_ID={"$ne": original_drc}),
                 {
                     "$set": {
                         "NEW_DRC_ID": original_drc,
@@ -140,79 +283,130 @@ def rollback_case_distribution_collection(case_collection, original_states):
         logger.error(f"Failed to roll back case distribution collection: {rollback_error}")
         raise DatabaseUpdateError(f"Failed to roll back case distribution collection: {rollback_error}")
 
-def update_summary_in_mongo(summary_collection, transaction_collection, updated_drcs, case_distribution_batch_id):
+def update_summary_in_mongo(summary_collection, transaction_collection, updated_drcs, case_distribution_batch_id, fencing_token=None):
     """
     Updates the summary collection in MongoDB with the new counts after balancing.
     Also marks CRD_Distribution_Status and summery_status as 'close' once amendments are done.
     Returns: (success, message or error, original_counts)
     """
+    count_dict = defaultdict(lambda: defaultdict(int))
+    for case_id, (drc, rtom) in updated_drcs.items():
+        count_dict[drc][rtom] += 1
+
+    return update_summary_counts_in_mongo(summary_collection, transaction_collection, count_dict, case_distribution_batch_id, fencing_token)
+
+def update_summary_counts_in_mongo(summary_collection, transaction_collection, count_dict, case_distribution_batch_id, fencing_token=None):
+    """
+    Updates the summary collection in MongoDB from per-(DRC, RTOM) counts ({drc: {rtom: count}}).
+    Also marks CRD_Distribution_Status and summery_status as 'close' once amendments are done.
+    Returns: (success, message or error, original_counts)
+    """
     try:
         logger.info("Updating summary in MongoDB...")
         
         # Store the original state for rollback
-        original_counts = {}
-        for case_id, (drc, rtom) in updated_drcs.items():
-            original_counts[(drc, rtom)] = summary_collection.find_one(
-                {"Case_Distribution_Batch_ID": case_distribution_batch_id, "DRC_Id": drc, "RTOM": rtom},
-                {"Count": 1}
+        existing_summaries = {
+            (summary.get("DRC_Id"), summary.get("RTOM")): summary
+            for summary in call_with_retry(
+                "update_summary_in_mongo",
+                lambda: list(summary_collection.find(
+                    {"Case_Distribution_Batch_ID": case_distribution_batch_id},
+                    {"DRC_Id": 1, "RTOM": 1, "Count": 1, "Fencing_Token": 1}
+                ))
             )
+        }
+        new_counts = {(drc, rtom): count for drc, resources in count_dict.items() for rtom, count in resources.items()}
+        # Buckets whose cases all moved away no longer show up in count_dict, but must drop to 0
+        for bucket in existing_summaries:
+            new_counts.setdefault(bucket, 0)
+        original_counts = {bucket: existing_summaries.get(bucket) for bucket in new_counts}
+        if fencing_token is not None and any((summary.get("Fencing_Token") or 0) > fencing_token for summary in existing_summaries.values()):
+            raise StaleFencingTokenError(f"Summary of Batch ID {case_distribution_batch_id} was written under a newer fencing token than {fencing_token}.")
 
-        # Update the summary collection
-        count_dict = defaultdict(lambda: defaultdict(int))
-        for case_id, (drc, rtom) in updated_drcs.items():
-            count_dict[drc][rtom] += 1
-
-        for drc, resources in count_dict.items():
-            for rtom, count in resources.items():
-                summary_collection.update_one(
-                    {
-                        "Case_Distribution_Batch_ID": case_distribution_batch_id,
-                        "DRC_Id": drc,
-                        "RTOM": rtom
-                    },
-                    {"$set": {"Count": count}},
-                    upsert=True
+        # Update the summary collection, skipping buckets that already hold their new count.
+        # A failure part way (e.g. a row taken over by a newer lock holder) undoes the rows written so far.
+        applied_counts = {}
+        try:
+            for (drc, rtom), count in new_counts.items():
+                if (existing_summaries.get((drc, rtom)) or {}).get("Count") == count:
+                    continue
+                summary_filter = {
+                    "Case_Distribution_Batch_ID": case_distribution_batch_id,
+                    "DRC_Id": drc,
+                    "RTOM": rtom
+                }
+                summary_update = {"Count": count}
+                if fencing_token is not None:
+                    summary_filter.update(fencing_filter(fencing_token))
+                    summary_update["Fencing_Token"] = fencing_token
+                result = call_with_retry(
+                    "update_summary_in_mongo",
+                    summary_collection.update_one,
+                    summary_filter,
+                    {"$set": summary_update},
+                    upsert=(drc, rtom) not in existing_summaries
                 )
+                if result.matched_count == 0 and result.upserted_id is None:
+                    raise StaleFencingTokenError(f"Summary of Batch ID {case_distribution_batch_id} for {drc} / {rtom} was written under a newer fencing token than {fencing_token}.")
+                applied_counts[(drc, rtom)] = original_counts[(drc, rtom)]
         
-        logger.info("Summary updated in MongoDB successfully.")
+            logger.info("Summary updated in MongoDB successfully.")
 
-        # Mark CRD_Distribution_Status and summery_status as 'close'
-        transaction_collection.update_one(
-            {
-                "Case_Distribution_Batch_ID": case_distribution_batch_id,
-                "batch_seq_details.action_type": "amend",
-                "batch_seq_details.CRD_Distribution_Status": "open",
-                "summery_status": "open"
-            },
-            {
-                "$set": {
-                    "batch_seq_details.$.CRD_Distribution_Status": "close",
-                    "summery_status": "close"
+            # Mark CRD_Distribution_Status and summery_status as 'close'
+            call_with_retry(
+                "update_summary_in_mongo",
+                transaction_collection.update_one,
+                {
+                    "Case_Distribution_Batch_ID": case_distribution_batch_id,
+                    # $elemMatch makes "$" the amend element itself, not the first element of either condition
+                    "batch_seq_details": {"$elemMatch": {"action_type": "amend", "CRD_Distribution_Status": "open"}},
+                    "summery_status": "open"
+                },
+                {
+                    "$set": {
+                        "batch_seq_details.$.CRD_Distribution_Status": "close",
+                        "summery_status": "close"
+                    }
                 }
-            }
-        )
+            )
+        except Exception:
+            if applied_counts:
+                try:
+                    rollback_summary_in_mongo(summary_collection, applied_counts, case_distribution_batch_id, fencing_token)
+                except DatabaseUpdateError:
+                    pass
+            raise
 
         logger.info(f"Updated CRD_Distribution_Status to 'close' for Batch ID: {case_distribution_batch_id}")
         return True, original_counts  # Success
+    except StaleFencingTokenError as stale_error:
+        logger.error(str(stale_error))
+        raise
+    except TaskProcessingError:
+        raise
     except Exception as update_error:
         logger.error(f"Failed to update summary in MongoDB: {update_error}")
         raise DatabaseUpdateError(f"Failed to update summary in MongoDB: {update_error}")
 
-def rollback_summary_in_mongo(summary_collection, original_counts, case_distribution_batch_id):
+def rollback_summary_in_mongo(summary_collection, original_counts, case_distribution_batch_id, fencing_token=None):
     """
     Rolls back the summary collection to its original state.
+    With a fencing_token, only summary rows this lock holder wrote are rolled back.
     Returns: (success, message or error)
     """
     try:
         logger.info("Rolling back summary in MongoDB...")
         for (drc, rtom), original_count in original_counts.items():
+            rollback_filter = {
+                "Case_Distribution_Batch_ID": case_distribution_batch_id,
+                "DRC_Id": drc,
+                "RTOM": rtom
+            }
+            if fencing_token is not None:
+                rollback_filter["Fencing_Token"] = fencing_token
             summary_collection.update_one(
-                {
-                    "Case_Distribution_Batch_ID": case_distribution_batch_id,
-                    "DRC_Id": drc,
-                    "RTOM": rtom
-                },
-                {"$set": {"Count": original_count.get("Count", 0)}}
+                rollback_filter,
+                {"$set": {"Count": (original_count or {}).get("Count", 0)}}
             )
         logger.info("Summary collection rolled back successfully.")
         return True, "Summary collection rolled back successfully."  # Success
@@ -0,0 +1,269 @@
+'''
+load_test.py file is as follows:
+
+    Purpose: This script load-tests amend processing against a local mongod with concurrent task submitters and amend workers.
+    Created Date: 2025-04-10
+    Created By:  T.S.Balasooriya (tharindutsb@gmail.com) , Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Last Modified Date: 2025-04-10
+    Modified By: T.S.Balasooriya (tharindutsb@gmail.com), Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Version: Python 3.9
+    Dependencies: argparse, itertools, math, multiprocessing, random, threading, time, collections, datetime, pymongo, utils.connectDB, utils.storage_backend, utils.read_template_task_id_ini, actionManipulation.task_processor
+    Notes:
+        - Usage: python load_test.py --submitters 4 --tasks-per-submitter 50 --rate 5 --workers 1,2,4,8
+        - Every run starts from an empty --db database on the local mongod (it is dropped first), so the
+          URI must point at localhost. Runs are repeated for every worker count in --workers.
+        - N submitter threads insert batches in the shapes of "Database json files": the transaction with an
+          open amend action, its cases and summary rows, and then the open System_tasks task, at --rate tasks
+          per second each.
+        - M worker processes run amend_task_processing in a loop, exactly as main.py does, until every task
+          has left the open and processing states or --timeout seconds have passed.
+        - Task latency is created_dtm (set by the submitter) to status_changed_dtm of the final status.
+          Throughput is finished tasks per second from the first submission to the last finished task.
+          The queue wait is created_dtm to the task's "processing" claim in its status_history.
+        - Tasks of a load test never mismatch their template, so a "mismatch" error means workers raced on
+          shared state: the script prints the run and then fails instead of reporting it as a result.
+'''
+
+import argparse
+import itertools
+import math
+import multiprocessing
+import random
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from pymongo import MongoClient
+from pymongo.uri_parser import parse_uri
+from utils.connectDB import create_amend_indexes, CASE_COLLECTION, TRANSACTION_COLLECTION, CASE_DRC_SUMMARY, SYSTEM_TASKS, TEMPLATE_TASK
+from utils.storage_backend import MongoStorageBackend, set_storage_backend
+from utils.read_template_task_id_ini import get_template_task_id
+
+AMEND_TASK_TYPE = "Case Amend Planning among DRC"
+DRCS = ["D1", "D2", "D3"]
+RTOMS = ["CW", "AG", "AD", "KL"]
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+def build_batch_documents(task_id, batch_id, template_task_id, case_count, rng):
+    """
+    Builds the documents of one amend task: its System_tasks task, transaction, cases and summary rows.
+    Cases are spread evenly over DRCS x RTOMS, and the amend moves one case between two DRCs of one RTOM.
+    Returns: {collection name: list of documents}
+    """
+    now = datetime.now()
+    cases = [
+        {
+            "Case_Distribution_Batch_ID": batch_id, "Batch_seq": 1, "Created_Dtm": now, "Case_Id": f"{batch_id}-{case_id}",
+            "DRC_Id": DRCS[case_id % len(DRCS)], "RTOM": RTOMS[(case_id // len(DRCS)) % len(RTOMS)], "Arrease": 0,
+            "NEW_DRC_ID": None, "Proceed_On": None, "Amend_Status": None, "Amend_Description": None
+        }
+        for case_id in range(case_count)
+    ]
+    donor_drc, receiver_drc = rng.sample(DRCS, 2)
+    return {
+        TRANSACTION_COLLECTION: [{
+            "Case_Distribution_Batch_ID": batch_id,
+            "summery_status": "open",
+            "created_dtm": now,
+            "created_by": "load_test",
+            "batch_seq_details": [
+                {"batch_seq": 1, "created_dtm": now, "created_by": "load_test", "action_type": "distribution", "CRD_Distribution_Status": "close", "array_of_distributions": []},
+                {"batch_seq": 2, "created_dtm": now, "created_by": "load_test", "action_type": "amend", "CRD_Distribution_Status": "open", "array_of_distributions": [
+                    {"rtom": rng.choice(RTOMS), "donor_drc_id": donor_drc, "receiver_drc_id": receiver_drc, "transfer_count": 1}
+                ]}
+            ]
+        }],
+        CASE_COLLECTION: cases,
+        CASE_DRC_SUMMARY: [
+            {"Case_Distribution_Batch_ID": batch_id, "DRC_Id": drc, "RTOM": rtom, "Count": count}
+            for (drc, rtom), count in Counter((case["DRC_Id"], case["RTOM"]) for case in cases).items()
+        ],
+        SYSTEM_TASKS: [{
+            "Task_Id": task_id,
+            "Template_Task_Id": template_task_id,
+            "task_type": AMEND_TASK_TYPE,
+            "parameters": {"Case_Distribution_Batch_ID": batch_id},
+            "Created_By": "load_test",
+            "task_status": "open",
+            "status_changed_dtm": None,
+            "status_description": "",
+            "created_dtm": now
+        }]
+    }
+
+def submit_task(db, documents):
+    """
+    Inserts the documents of one task. The task goes in last, so a worker never sees it before its batch.
+    """
+    for collection_name in (TRANSACTION_COLLECTION, CASE_COLLECTION, CASE_DRC_SUMMARY):
+        db[collection_name].insert_many(documents[collection_name])
+    task = documents[SYSTEM_TASKS][0]
+    # Latency is measured from the moment the task becomes visible to the workers
+    task["created_dtm"] = datetime.now()
+    db[SYSTEM_TASKS].insert_one(task)
+
+def run_submitter(db, submitter_id, task_count, rate, case_count, template_task_id, next_task_id):
+    """
+    Submits task_count tasks at rate tasks per second (0 submits as fast as possible).
+    """
+    rng = random.Random(submitter_id)
+    interval = 1 / rate if rate > 0 else 0
+    next_submit_at = time.monotonic()
+    for sequence in range(task_count):
+        task_id = next_task_id()
+        submit_task(db, build_batch_documents(task_id, f"LT-{submitter_id}-{sequence}", template_task_id, case_count, rng))
+        next_submit_at += interval
+        time.sleep(max(0, next_submit_at - time.monotonic()))
+
+def run_amend_worker(uri, db_name, stop_event, poll_seconds):
+    """
+    Runs the amend processing loop of one worker process until stop_event is set.
+    """
+    # Imported in the worker, after its storage backend is set
+    from actionManipulation.task_processor import amend_task_processing
+
+    set_storage_backend(MongoStorageBackend(MongoClient(uri)[db_name]))
+    while not stop_event.is_set():
+        amend_task_processing()
+        stop_event.wait(poll_seconds)
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile of values (None when there are none).
+    """
+    if not values:
+        return None
+    ordered_values = sorted(values)
+    return ordered_values[max(0, math.ceil(fraction * len(ordered_values)) - 1)]
+
+def collect_task_metrics(system_task_collection):
+    """
+    Summarises the load-test tasks: counts per status, throughput, p50/p99 latency and error rate.
+    Returns: metrics dictionary
+    """
+    tasks = list(system_task_collection.find(
+        {"task_type": AMEND_TASK_TYPE, "Created_By": "load_test"},
+        {"task_status": 1, "created_dtm": 1, "status_changed_dtm": 1, "status_description": 1, "status_history": 1}
+    ))
+    status_counts = Counter(task["task_status"] for task in tasks)
+    finished_tasks = [task for task in tasks if task["task_status"] in ("completed", "error")]
+    latencies = [(task["status_changed_dtm"] - task["created_dtm"]).total_seconds() for task in finished_tasks]
+    # Time spent open before a worker claimed the task, from the first "processing" entry of its status_history
+    queue_waits = []
+    for task in finished_tasks:
+        claimed_at = next((entry["dtm"] for entry in task.get("status_history", []) if entry["status"] == "processing"), None)
+        if claimed_at is not None:
+            queue_waits.append((claimed_at - task["created_dtm"]).total_seconds())
+
+    elapsed_seconds = 0
+    if finished_tasks:
+        elapsed_seconds = (max(task["status_changed_dtm"] for task in finished_tasks) - min(task["created_dtm"] for task in tasks)).total_seconds()
+    return {
+        "submitted": len(tasks),
+        "completed": status_counts["completed"],
+        "error": status_counts["error"],
+        "unfinished": len(tasks) - len(finished_tasks),
+        "throughput": len(finished_tasks) / elapsed_seconds if elapsed_seconds > 0 else 0,
+        "p50_latency": percentile(latencies, 0.50),
+        "p99_latency": percentile(latencies, 0.99),
+        "p50_queue_wait": percentile(queue_waits, 0.50),
+        "error_rate": status_counts["error"] / len(finished_tasks) if finished_tasks else 0,
+        "mismatch_errors": sum(1 for task in finished_tasks if task["task_status"] == "error" and "mismatch" in task.get("status_description", "")),
+        "error_reasons": Counter(
+            task.get("status_description", "")[:80] for task in finished_tasks if task["task_status"] == "error"
+        ).most_common(3)
+    }
+
+def reset_database(client, db_name, template_task_id):
+    """
+    Drops the load-test database and recreates its template task and indexes.
+    """
+    client.drop_database(db_name)
+    db = client[db_name]
+    db[TEMPLATE_TASK].insert_one({"Template_Task_Id": template_task_id, "task_type": AMEND_TASK_TYPE, "parameters": {}})
+    create_amend_indexes(db)
+    return db
+
+def run_load_test(uri, db_name, submitter_count, worker_count, tasks_per_submitter, rate, case_count, timeout, poll_seconds=0.5):
+    """
+    Runs one load test with submitter_count submitters and worker_count amend workers.
+    Returns: metrics dictionary (see collect_task_metrics)
+    """
+    client = MongoClient(uri)
+    template_task_id = get_template_task_id()
+    db = reset_database(client, db_name, template_task_id)
+
+    stop_event = multiprocessing.get_context("spawn").Event()
+    workers = [
+        multiprocessing.get_context("spawn").Process(target=run_amend_worker, args=(uri, db_name, stop_event, poll_seconds), daemon=True)
+        for _ in range(worker_count)
+    ]
+    for worker in workers:
+        worker.start()
+
+    task_ids = itertools.count(1)
+    task_ids_lock = threading.Lock()
+    def next_task_id():
+        with task_ids_lock:
+            return next(task_ids)
+    submitters = [
+        threading.Thread(
+            target=run_submitter,
+            args=(db, submitter_id, tasks_per_submitter, rate, case_count, template_task_id, next_task_id)
+        )
+        for submitter_id in range(submitter_count)
+    ]
+    for submitter in submitters:
+        submitter.start()
+    for submitter in submitters:
+        submitter.join()
+
+    # Wait for the workers to drain the queue
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline and db[SYSTEM_TASKS].count_documents({"task_status": {"$in": ["open", "processing"]}}):
+        time.sleep(poll_seconds)
+
+    stop_event.set()
+    for worker in workers:
+        worker.join(timeout=60)
+        if worker.is_alive():
+            worker.terminate()
+
+    metrics = collect_task_metrics(db[SYSTEM_TASKS])
+    metrics["workers"] = worker_count
+    client.close()
+    return metrics
+
+def format_seconds(value):
+    return "-" if value is None else f"{value:.3f}"
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test amend processing against a local mongod.")
+    parser.add_argument("--uri", default="mongodb://localhost:27017", help="MongoDB URI of a local mongod")
+    parser.add_argument("--db", default="drs_amend_load_test", help="Database used (and dropped) by every run")
+    parser.add_argument("--submitters", type=int, default=4, help="Number of concurrent task submitters (N)")
+    parser.add_argument("--tasks-per-submitter", type=int, default=25, help="Tasks inserted by every submitter")
+    parser.add_argument("--rate", type=float, default=5, help="Tasks per second per submitter (0 for no limit)")
+    parser.add_argument("--cases", type=int, default=200, help="Cases per batch")
+    parser.add_argument("--workers", default="1,2,4", help="Comma-separated amend worker counts (M) to run")
+    parser.add_argument("--timeout", type=float, default=300, help="Seconds to wait for the workers to drain the tasks")
+    args = parser.parse_args()
+
+    hosts = [host for host, port in parse_uri(args.uri)["nodelist"]]
+    if any(host not in LOCAL_HOSTS for host in hosts):
+        parser.error(f"--uri must point at a local mongod, got {', '.join(hosts)}: every run drops --db.")
+
+    print(f"{'workers':>7} {'submitted':>9} {'completed':>9} {'error':>5} {'unfinished':>10} {'tasks/s':>8} {'p50 s':>8} {'p99 s':>8} {'wait p50':>8} {'error %':>7}")
+    for worker_count in [int(count) for count in args.workers.split(",")]:
+        metrics = run_load_test(args.uri, args.db, args.submitters, worker_count, args.tasks_per_submitter, args.rate, args.cases, args.timeout)
+        print(
+            f"{metrics['workers']:>7} {metrics['submitted']:>9} {metrics['completed']:>9} {metrics['error']:>5} {metrics['unfinished']:>10} "
+            f"{metrics['throughput']:>8.2f} {format_seconds(metrics['p50_latency']):>8} {format_seconds(metrics['p99_latency']):>8} {format_seconds(metrics['p50_queue_wait']):>8} {metrics['error_rate'] * 100:>7.1f}"
+        )
+        for reason, count in metrics["error_reasons"]:
+            print(f"{'':>7} {count} x {reason}")
+        if metrics["mismatch_errors"]:
+            raise SystemExit(f"{metrics['mismatch_errors']} tasks failed with a template mismatch on {worker_count} workers: the results are not valid.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+'''
+plan_benchmark.py file is as follows:
+
+    Purpose: This script times the planning of many amend batches serially and on the process pool of the parallel mode,
+             and the worst cases of the balance-back.
+    Created Date: 2025-04-12
+    Created By:  T.S.Balasooriya (tharindutsb@gmail.com) , Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Last Modified Date: 2025-04-12
+    Modified By: T.S.Balasooriya (tharindutsb@gmail.com), Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Version: Python 3.9
+    Dependencies: argparse, os, random, time, actionManipulation.balance_resources, actionManipulation.plan_batches
+    Notes:
+        - Usage: python plan_benchmark.py --batches 8 --cases 200000 --workers 2,4,8
+        - No database is needed: the batches are generated in memory, in the shape _load_batch gives them.
+        - The serial time is plan_batch_moves per batch, as the serial mode plans. The parallel time is
+          plan_batches_in_parallel, including sending the batches to the workers and the plans back.
+        - Both runs must move the same cases; the script fails otherwise.
+        - python plan_benchmark.py --balance-back times the balance-back worst cases instead: one huge bucket pair
+          whose receiver runs out of other cases, and a transfer of 10^11 cases over 1000 buckets.
+'''
+
+import argparse
+import os
+import random
+import time
+from actionManipulation.balance_resources import balance_resources, compute_balance_back_takes
+from actionManipulation.plan_batches import plan_batch_moves, plan_batches_in_parallel
+
+DRCS = ["D1", "D2", "D3", "D4"]
+RTOMS = ["CW", "AG", "AD", "KL", "GM", "MH"]
+
+def build_batch_allocations(batch_count, case_count, transfer_count, rng):
+    """
+    Builds batch_allocations for plan_batches_in_parallel: batch_count random batches of case_count cases,
+    each with one amend distribution of transfer_count cases.
+    """
+    batch_allocations = {}
+    for batch_index in range(batch_count):
+        drcs = {
+            batch_index * case_count + case_id: [rng.choice(DRCS), rng.choice(RTOMS)]
+            for case_id in range(case_count)
+        }
+        distribution = {"rtom": RTOMS[batch_index % len(RTOMS)], "donor_drc_id": "D2", "receiver_drc_id": "D1", "transfer_count": transfer_count}
+        batch_allocations[batch_index] = (drcs, [distribution])
+    return batch_allocations
+
+def time_serial_planning(batch_allocations):
+    """
+    Returns: (seconds, {key: moved cases})
+    """
+    start = time.perf_counter()
+    plans = {key: plan_batch_moves(drcs, array_of_distributions) for key, (drcs, array_of_distributions) in batch_allocations.items()}
+    seconds = time.perf_counter() - start
+
+    moved_cases = {}
+    for key, (success_plan, updated_drcs) in plans.items():
+        if not success_plan:
+            raise SystemExit(f"Batch {key} could not be planned: {updated_drcs}")
+        drcs = batch_allocations[key][0]
+        moved_cases[key] = {case_id: allocation for case_id, allocation in updated_drcs.items() if allocation[0] != drcs[case_id][0]}
+    return seconds, moved_cases
+
+def time_parallel_planning(batch_allocations, max_workers):
+    """
+    Returns: (seconds, {key: moved cases})
+    """
+    start = time.perf_counter()
+    plans = plan_batches_in_parallel(batch_allocations, max_workers)
+    seconds = time.perf_counter() - start
+    for key, (success_plan, moved_cases) in plans.items():
+        if not success_plan:
+            raise SystemExit(f"Batch {key} could not be planned: {moved_cases}")
+    return seconds, {key: moved_cases for key, (success_plan, moved_cases) in plans.items()}
+
+def time_balance_back_worst_cases(case_count, rng):
+    """
+    Times balance_resources on one huge bucket pair with a transfer that drains most of the receiver's
+    other buckets, and compute_balance_back_takes on huge transfers.
+    Returns: [(name, seconds)]
+    """
+    drcs = {
+        case_id: ["D1" if case_id % 2 else "D2", RTOMS[0] if case_id < case_count // 2 else rng.choice(RTOMS[1:])]
+        for case_id in range(case_count)
+    }
+    start = time.perf_counter()
+    success_balance, balance_result = balance_resources(drcs, "D1", "D2", RTOMS[0], case_count // 5)
+    balance_seconds = time.perf_counter() - start
+    if not success_balance:
+        raise SystemExit(f"The balance-back worst case could not be planned: {balance_result}")
+
+    start = time.perf_counter()
+    takes, shortfall = compute_balance_back_takes([10 ** 9] * 1000, 10 ** 11)
+    takes_seconds = time.perf_counter() - start
+    if shortfall or sum(takes) != 10 ** 11:
+        raise SystemExit("The balance-back of a huge transfer took the wrong number of cases.")
+    return [(f"balance_resources, {case_count} cases", balance_seconds), ("compute_balance_back_takes, 10^11 cases", takes_seconds)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Time serial and parallel planning of amend batches.")
+    parser.add_argument("--batches", type=int, default=8, help="Number of batches")
+    parser.add_argument("--cases", type=int, default=200000, help="Cases per batch")
+    parser.add_argument("--transfer", type=int, default=1000, help="transfer_count of the amend distribution of every batch")
+    parser.add_argument("--workers", default=str(os.cpu_count() or 1), help="Comma-separated process counts to run")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the generated batches")
+    parser.add_argument("--balance-back", action="store_true", help="Time the balance-back worst cases (with --cases cases) instead")
+    args = parser.parse_args()
+
+    if args.balance_back:
+        for name, seconds in time_balance_back_worst_cases(args.cases, random.Random(args.seed)):
+            print(f"{name:<42} {seconds:>8.2f}")
+        return
+
+    batch_allocations = build_batch_allocations(args.batches, args.cases, args.transfer, random.Random(args.seed))
+    serial_seconds, serial_moves = time_serial_planning(batch_allocations)
+    print(f"{'workers':>7} {'seconds':>8} {'speedup':>7}")
+    print(f"{'serial':>7} {serial_seconds:>8.2f} {1:>7.2f}")
+    for worker_count in [int(count) for count in args.workers.split(",")]:
+        parallel_seconds, parallel_moves = time_parallel_planning(batch_allocations, worker_count)
+        if parallel_moves != serial_moves:
+            raise SystemExit(f"Planning on {worker_count} processes moved other cases than serial planning.")
+        print(f"{worker_count:>7} {parallel_seconds:>8.2f} {serial_seconds / parallel_seconds:>7.2f}")
+
+if __name__ == "__main__":
+    main()
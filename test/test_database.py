@@ -0,0 +1,770 @@
+'''
+test_database.py file is as follows:
+
+    Purpose: This script tests the in-memory storage backend and runs amend tasks end to end against it.
+    Created Date: 2025-03-29
+    Created By:  T.S.Balasooriya (tharindutsb@gmail.com) , Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Last Modified Date: 2025-03-29
+    Modified By: T.S.Balasooriya (tharindutsb@gmail.com), Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Version: Python 3.9
+    Dependencies: json, random, collections, functools, pytest, pymongo, load_test, plan_benchmark, utils.batch_lock, utils.bulk_loader, utils.read_amend_processing_ini, utils.resilience, utils.task_profiler, utils.storage_backend, actionManipulation.batch_pipeline, actionManipulation.count_matrix, actionManipulation.database_checks, actionManipulation.move_plan_export, actionManipulation.plan_batches, actionManipulation.task_processor, actionManipulation.task_scheduler, actionManipulation.update_databases
+    Notes:
+        - Every test runs on a fresh InMemoryStorageBackend, so no MongoDB server is needed.
+'''
+
+import json
+import random
+from collections import Counter
+from functools import partial
+import pytest
+from pymongo import UpdateOne
+from pymongo.errors import AutoReconnect, BulkWriteError
+from utils import batch_lock, bulk_loader, read_amend_processing_ini, resilience, task_profiler
+from utils.Custom_Exceptions import BatchLockedError, CircuitOpenError, DatabaseUpdateError, StaleFencingTokenError, TaskProcessingException
+from utils.storage_backend import InMemoryStorageBackend, set_storage_backend
+import load_test
+import plan_benchmark
+from actionManipulation import batch_pipeline, count_matrix, database_checks, move_plan_export, plan_batches, task_processor, task_scheduler, update_databases
+
+RTOMS = ["CW", "AG", "AD", "KL"]
+
+@pytest.fixture
+def backend():
+    in_memory_backend = InMemoryStorageBackend()
+    previous_backend = set_storage_backend(in_memory_backend)
+    yield in_memory_backend
+    set_storage_backend(previous_backend)
+
+def seed_batch(backend, task_id, batch_id, cases, array_of_distributions):
+    """
+    Inserts a System_tasks task, its transaction, its cases and their summary.
+    cases is a list of (case_id, drc, rtom).
+    """
+    backend["System_tasks"].insert_one({
+        "Task_Id": task_id,
+        "Template_Task_Id": 26,
+        "task_type": "Case Amend Planning among DRC",
+        "parameters": {"Case_Distribution_Batch_ID": batch_id},
+        "task_status": "open"
+    })
+    # amend_task_processing points the template task at the batch before processing it
+    backend["Template_task"].update_one(
+        {"Template_Task_Id": 26, "task_type": "Case Amend Planning among DRC"},
+        {"$set": {"parameters.Case_Distribution_Batch_ID": batch_id}},
+        upsert=True
+    )
+    backend["Case_distribution_drc_transactions"].insert_one({
+        "Case_Distribution_Batch_ID": batch_id,
+        "summery_status": "open",
+        "batch_seq_details": [
+            {"batch_seq": 1, "action_type": "distribution", "CRD_Distribution_Status": "close"},
+            {"batch_seq": 2, "action_type": "amend", "CRD_Distribution_Status": "open", "array_of_distributions": array_of_distributions}
+        ]
+    })
+    backend["DRS.Tmp_Case_Distribution_DRC"].insert_many([
+        {"Case_Distribution_Batch_ID": batch_id, "Case_Id": case_id, "DRC_Id": drc, "RTOM": rtom, "NEW_DRC_ID": None}
+        for case_id, drc, rtom in cases
+    ])
+    backend["DRS_Database.Case_Distribution_DRC_Summary"].insert_many([
+        {"Case_Distribution_Batch_ID": batch_id, "DRC_Id": drc, "RTOM": rtom, "Count": count}
+        for (drc, rtom), count in Counter((drc, rtom) for _, drc, rtom in cases).items()
+    ])
+
+def current_allocation(backend, batch_id):
+    return Counter(
+        (case["NEW_DRC_ID"] or case["DRC_Id"], case["RTOM"])
+        for case in backend["DRS.Tmp_Case_Distribution_DRC"].find({"Case_Distribution_Batch_ID": batch_id})
+    )
+
+def test_in_memory_collection_queries(backend):
+    collection = backend["DRS.Tmp_Case_Distribution_DRC"]
+    collection.insert_many([{"Case_Distribution_Batch_ID": "B1", "Case_Id": case_id, "DRC_Id": "D1" if case_id % 2 else "D2", "RTOM": "CW"} for case_id in range(10)])
+
+    assert [case["Case_Id"] for case in collection.find({"Case_Id": {"$in": [3, 4]}}, {"Case_Id": 1, "_id": 0})] == [3, 4]
+    assert collection.count_documents({"Case_Distribution_Batch_ID": "B1", "DRC_Id": {"$ne": "D1"}}) == 5
+    assert [case["Case_Id"] for case in collection.find({"DRC_Id": "D1"}).sort("Case_Id", -1).skip(1).limit(2)] == [7, 5]
+
+    result = collection.bulk_write([UpdateOne({"Case_Id": 1}, {"$set": {"DRC_Id": "D2"}}), UpdateOne({"Case_Id": 2}, {"$set": {"DRC_Id": "D2"}})])
+    assert (result.matched_count, result.modified_count) == (2, 1)
+
+    groups = {group["_id"]["DRC_Id"]: group["Count"] for group in collection.aggregate([
+        {"$match": {"Case_Distribution_Batch_ID": "B1"}},
+        {"$group": {"_id": {"DRC_Id": "$DRC_Id"}, "Count": {"$sum": 1}}}
+    ])}
+    assert groups == {"D1": 4, "D2": 6}
+
+def test_positional_update_closes_only_the_open_amend(backend):
+    seed_batch(backend, 1, "B1", [(1, "D1", "CW")], [])
+    transactions = backend["Case_distribution_drc_transactions"]
+    # As in the sample data, the distribution element before the amend is still open
+    transactions.update_one({"Case_Distribution_Batch_ID": "B1"}, {"$set": {"batch_seq_details.0.CRD_Distribution_Status": "open"}})
+
+    transactions.update_one(
+        {"Case_Distribution_Batch_ID": "B1", "batch_seq_details": {"$elemMatch": {"action_type": "amend", "CRD_Distribution_Status": "open"}}},
+        {"$set": {"batch_seq_details.$.CRD_Distribution_Status": "close"}}
+    )
+
+    statuses = [detail["CRD_Distribution_Status"] for detail in transactions.find_one({})["batch_seq_details"]]
+    assert statuses == ["open", "close"]
+
+@pytest.mark.parametrize("read_size", [1, 7, 1 << 20])
+@pytest.mark.parametrize("file_format", ["ndjson", "array"])
+def test_json_documents_are_streamed_across_reads(tmp_path, file_format, read_size):
+    documents = [{"Case_Id": case_id, "DRC_Id": "D1", "Note": "a, [b] {c}" * case_id, "Created_Dtm": {"$date": "2025-03-27T00:00:00Z"}} for case_id in range(20)]
+    file_path = tmp_path / f"cases.{file_format}"
+    if file_format == "ndjson":
+        file_path.write_text("\n".join(json.dumps(document) for document in documents) + "\n", encoding="utf-8")
+    else:
+        file_path.write_text(json.dumps(documents, indent=2), encoding="utf-8")
+
+    loaded_documents = list(bulk_loader.iter_json_documents(str(file_path), read_size))
+
+    assert [(document["Case_Id"], document["Note"]) for document in loaded_documents] == [(document["Case_Id"], document["Note"]) for document in documents]
+    assert all(document["Created_Dtm"].year == 2025 for document in loaded_documents)
+
+@pytest.mark.parametrize("head, valid_document, tail", [
+    ('{"Case_Id": 1}\n{"Case_Id": 2,, "DRC_Id": "D1"}\n', '{"Case_Id": 3}\n', ''),
+    ('[{"Case_Id": 1}, {"Case_Id": tru}, ', '{"Case_Id": 3}, ', '{"Case_Id": 4}]'),
+    ('{"Case_Id": 1}\n{"Case_Id": "D1\n', '{"Case_Id": 3}\n', '')
+])
+def test_invalid_json_document_fails_without_reading_on(tmp_path, monkeypatch, head, valid_document, tail):
+    file_path = tmp_path / "cases.json"
+    # The valid documents after the invalid one must not be read
+    file_path.write_text(head + valid_document * 1000 + tail, encoding="utf-8")
+    read_sizes = []
+    real_open = open
+    class CountingFile:
+        def __init__(self, file):
+            self.file = file
+        def read(self, size):
+            chunk = self.file.read(size)
+            read_sizes.append(len(chunk))
+            return chunk
+        def __enter__(self):
+            return self
+        def __exit__(self, *exc_info):
+            self.file.close()
+    monkeypatch.setattr(bulk_loader, "open", lambda *args, **kwargs: CountingFile(real_open(*args, **kwargs)), raising=False)
+
+    documents = bulk_loader.iter_json_documents(str(file_path), read_size=64)
+    assert next(documents) == {"Case_Id": 1}
+    with pytest.raises(DatabaseUpdateError, match="Invalid JSON"):
+        next(documents)
+    assert sum(read_sizes) < 200
+
+@pytest.mark.parametrize("seed", range(10))
+def test_amend_end_to_end(backend, seed):
+    rng = random.Random(seed)
+    completed_count = 0
+    for task_id in range(1, 51):
+        batch_id = f"{seed}-{task_id}"
+        cases = [(f"{batch_id}-{case_id}", rng.choice(["D1", "D2"]), rng.choice(RTOMS)) for case_id in range(rng.randint(10, 60))]
+        distribution = {"rtom": "CW", "donor_drc_id": "D2", "receiver_drc_id": "D1", "transfer_count": rng.randint(1, 4)}
+        seed_batch(backend, task_id, batch_id, cases, [distribution])
+        before = current_allocation(backend, batch_id)
+
+        task_processor.process_single_batch(backend["System_tasks"].find_one({"Task_Id": task_id}))
+
+        task = backend["System_tasks"].find_one({"Task_Id": task_id})
+        after = current_allocation(backend, batch_id)
+        if task["task_status"] != "completed":
+            # A rejected task leaves the batch untouched
+            assert task["task_status"] == "error"
+            assert after == before
+            continue
+
+        completed_count += 1
+        transfer_count = distribution["transfer_count"]
+        assert after[("D1", "CW")] == before[("D1", "CW")] + transfer_count
+        assert after[("D2", "CW")] == before[("D2", "CW")] - transfer_count
+        assert sum(after.values()) == sum(before.values())
+        summary = {
+            (row["DRC_Id"], row["RTOM"]): row["Count"]
+            for row in backend["DRS_Database.Case_Distribution_DRC_Summary"].find({"Case_Distribution_Batch_ID": batch_id})
+        }
+        assert {key: count for key, count in summary.items() if count} == {key: count for key, count in after.items() if count}
+        assert backend["Case_distribution_drc_transactions"].find_one({"Case_Distribution_Batch_ID": batch_id})["summery_status"] == "close"
+    assert completed_count > 0
+
+@pytest.mark.parametrize("processing_mode", ["serial", "parallel", "pipeline"])
+def test_amend_task_processing_completes_every_batch(backend, monkeypatch, processing_mode):
+    rng = random.Random(3)
+    for task_id in range(1, 6):
+        cases = [(f"{task_id}-{case_id}", "D1" if case_id % 2 else "D2", rng.choice(RTOMS)) for case_id in range(40)]
+        seed_batch(backend, task_id, f"B{task_id}", cases, [{"rtom": "CW", "donor_drc_id": "D2", "receiver_drc_id": "D1", "transfer_count": 1}])
+    real_get_processing_setting = task_processor.get_processing_setting
+    monkeypatch.setattr(task_processor, "get_processing_setting", lambda section, key, fallback=None, value_type=str: processing_mode if (section, key) == ("PROCESSING", "PROCESSING_MODE") else real_get_processing_setting(section, key, fallback, value_type))
+
+    system_tasks = backend["System_tasks"]
+    status_writes = Counter()
+    for method_name in ("update_one", "find_one_and_update", "bulk_write"):
+        def counted(*args, method=getattr(system_tasks, method_name), method_name=method_name, **kwargs):
+            status_writes[method_name] += 1
+            return method(*args, **kwargs)
+        monkeypatch.setattr(system_tasks, method_name, counted)
+
+    task_processor.amend_task_processing()
+
+    assert [task["task_status"] for task in system_tasks.find({})] == ["completed"] * 5
+    assert all([entry["status"] for entry in task["status_history"]] == ["processing", "completed"] for task in system_tasks.find({}))
+    # One conditional claim per task; the completed statuses are bulk-written outside the serial mode
+    assert status_writes["find_one_and_update"] == 5
+    if processing_mode == "serial":
+        assert (status_writes["update_one"], status_writes["bulk_write"]) == (5, 0)
+    else:
+        assert status_writes["update_one"] == 0 and 1 <= status_writes["bulk_write"] <= (1 if processing_mode == "parallel" else 5)
+
+def test_parallel_planning_returns_the_moved_cases(monkeypatch):
+    batch_allocations = plan_benchmark.build_batch_allocations(3, 300, 5, random.Random(0))
+    start_methods = []
+    real_process_pool_executor = plan_batches.ProcessPoolExecutor
+    monkeypatch.setattr(plan_batches, "ProcessPoolExecutor", lambda *args, **kwargs: start_methods.append(kwargs["mp_context"].get_start_method()) or real_process_pool_executor(*args, **kwargs))
+
+    serial_seconds, serial_moves = plan_benchmark.time_serial_planning(batch_allocations)
+    parallel_seconds, parallel_moves = plan_benchmark.time_parallel_planning(batch_allocations, 2)
+
+    # Workers never fork the caller's connections and threads
+    assert start_methods == ["spawn"]
+    assert parallel_moves == serial_moves
+    assert all(len(moved_cases) == 10 for moved_cases in parallel_moves.values())
+
+def test_task_claim_is_exclusive_and_history_is_capped(backend):
+    seed_batch(backend, 1, "B1", [(1, "D1", "CW")], [])
+    system_tasks = backend["System_tasks"]
+
+    assert database_checks.claim_task(system_tasks, 1, "worker-1") == (True, None)
+    # A retry of the same claim succeeds, any other claimant is refused
+    assert database_checks.claim_task(system_tasks, 1, "worker-1") == (True, None)
+    assert database_checks.claim_task(system_tasks, 1, "worker-2") == (False, "processing")
+
+    for attempt in range(5):
+        status_filter, status_update = database_checks.build_status_update("error", f"attempt {attempt}", history_limit=3)
+        system_tasks.update_one(dict(status_filter, Task_Id=1), status_update)
+    history = system_tasks.find_one({"Task_Id": 1})["status_history"]
+    assert [entry["description"] for entry in history] == ["attempt 2", "attempt 3", "attempt 4"]
+
+def test_pipeline_drains_when_the_prefetcher_fails(backend):
+    seed_batch(backend, 1, "B1", [(case_id, "D1" if case_id % 3 else "D2", RTOMS[case_id % 2]) for case_id in range(40)], [{"rtom": "CW", "donor_drc_id": "D2", "receiver_drc_id": "D1", "transfer_count": 2}])
+    tasks = [backend["System_tasks"].find_one({"Task_Id": 1}), {"Task_Id": 2, "task_type": "Case Amend Planning among DRC"}]
+
+    # The task without parameters fails outside the load of a task; the committer still gets the end marker
+    with pytest.raises(TaskProcessingException, match="stopped before every task was loaded"):
+        batch_pipeline.process_batches_in_pipeline(tasks, partial(task_processor.load_batch_for_task, template_validated=True), task_processor.commit_batch_plan)
+
+    assert backend["System_tasks"].find_one({"Task_Id": 1})["task_status"] == "completed"
+
+def test_serial_task_writes_its_status_twice(backend, monkeypatch):
+    seed_batch(backend, 1, "B1", [(case_id, "D1" if case_id % 3 else "D2", RTOMS[case_id % 2]) for case_id in range(40)], [{"rtom": "CW", "donor_drc_id": "D2", "receiver_drc_id": "D1", "transfer_count": 2}])
+    system_tasks = backend["System_tasks"]
+    status_writes = []
+    for method_name in ("update_one", "update_many", "find_one_and_update", "bulk_write"):
+        method = getattr(system_tasks, method_name)
+        monkeypatch.setattr(system_tasks, method_name, lambda *args, _method=method, _name=method_name, **kwargs: status_writes.append(_name) or _method(*args, **kwargs))
+
+    task_processor.process_single_batch(system_tasks.find_one({"Task_Id": 1}))
+
+    # The claim is the "processing" transition itself, the only other write is the final status
+    assert status_writes == ["find_one_and_update", "update_one"]
+    assert [entry["status"] for entry in system_tasks.find_one({"Task_Id": 1})["status_history"]] == ["processing", "completed"]
+
+def test_scheduler_orders_by_priority_cost_and_batch_turns(backend):
+    distribution = {"rtom": "CW", "donor_drc_id": "D2", "receiver_drc_id": "D1", "transfer_count": 1}
+    for task_id, batch_id, case_count in [(1, "HUGE", 500), (2, "SMALL", 10), (3, "MEDIUM", 100)]:
+        seed_batch(backend, task_id, batch_id, [(f"{batch_id}-{case_id}", "D1", "CW") for case_id in range(case_count)], [distribution])
+    # Two more tasks on SMALL: they must follow task 2, and take turns with the other batches
+    for task_id in (4, 5):
+        backend["System_tasks"].insert_one({"Task_Id": task_id, "Template_Task_Id": 26, "task_type": "Case Amend Planning among DRC", "parameters": {"Case_Distribution_Batch_ID": "SMALL"}, "task_status": "open"})
+    tasks = list(backend["System_tasks"].find({}))
+
+    assert [task["Task_Id"] for task in task_scheduler.schedule_tasks(tasks, "fifo")[1]] == [1, 2, 3, 4, 5]
+    assert [task["Task_Id"] for task in task_scheduler.schedule_tasks(tasks, "shortest_first", fair_share=False)[1]] == [2, 4, 5, 3, 1]
+    assert [task["Task_Id"] for task in task_scheduler.schedule_tasks(tasks, "shortest_first", fair_share=True)[1]] == [2, 3, 1, 4, 5]
+
+    backend["System_tasks"].update_one({"Task_Id": 1}, {"$set": {"priority": 1}})
+    # A null priority counts as 0
+    backend["System_tasks"].update_one({"Task_Id": 3}, {"$set": {"priority": None}})
+    tasks = list(backend["System_tasks"].find({}))
+    assert [task["Task_Id"] for task in task_scheduler.schedule_tasks(tasks, "shortest_first", fair_share=False)[1]] == [1, 2, 4, 5, 3]
+
+    # A numeric string is converted, anything else counts as 0
+    backend["System_tasks"].update_one({"Task_Id": 1}, {"$set": {"priority": "urgent"}})
+    backend["System_tasks"].update_one({"Task_Id": 3}, {"$set": {"priority": "2"}})
+    tasks = list(backend["System_tasks"].find({}))
+    assert [task["Task_Id"] for task in task_scheduler.schedule_tasks(tasks, "shortest_first", fair_share=False)[1]] == [3, 2, 4, 5, 1]
+
+def test_tasks_are_processed_in_arrival_order_when_they_cannot_be_scheduled(backend, fast_retries, monkeypatch):
+    distribution = {"rtom": "CW", "donor_drc_id": "D2", "receiver_drc_id": "D1", "transfer_count": 1}
+    for task_id, batch_id, case_count in [(1, "HUGE", 50), (2, "SMALL", 10)]:
+        seed_batch(backend, task_id, batch_id, [(f"{batch_id}-{case_id}", "D1" if case_id % 2 else "D2", "CW") for case_id in range(case_count)], [distribution])
+    summary_collection = backend["DRS_Database.Case_Distribution_DRC_Summary"]
+    monkeypatch.setattr(summary_collection, "aggregate", flaky(summary_collection.aggregate, 100))
+    monkeypatch.setattr(task_scheduler, "get_processing_setting", lambda section, key, fallback=None, value_type=str: "shortest_first" if (section, key) == ("SCHEDULER", "POLICY") else fallback)
+    processed_task_ids = []
+    monkeypatch.setattr(task_processor, "process_single_batch", lambda task, template_validated=False: processed_task_ids.append(task["Task_Id"]))
+
+    success_schedule_tasks, error = task_scheduler.schedule_tasks(list(backend["System_tasks"].find({})))
+    task_processor.amend_task_processing()
+
+    assert not success_schedule_tasks and "connection reset" in error
+    assert processed_task_ids == [1, 2]
+
+def test_load_test_tasks_are_processed_and_measured(backend):
+    backend["Template_task"].insert_one({"Template_Task_Id": 26, "task_type": "Case Amend Planning among DRC", "parameters": {}})
+    rng = random.Random(0)
+    for task_id in range(1, 6):
+        load_test.submit_task(backend, load_test.build_batch_documents(task_id, f"LT-{task_id}", 26, 120, rng))
+
+    task_processor.amend_task_processing()
+
+    metrics = load_test.collect_task_metrics(backend["System_tasks"])
+    assert (metrics["submitted"], metrics["completed"], metrics["error"], metrics["unfinished"]) == (5, 5, 0, 0)
+    assert 0 <= metrics["p50_queue_wait"] <= metrics["p50_latency"] <= metrics["p99_latency"]
+    assert metrics["throughput"] > 0 and metrics["error_rate"] == 0 and metrics["mismatch_errors"] == 0
+    assert load_test.percentile([4, 1, 3, 2], 0.5) == 2 and load_test.percentile([4, 1, 3, 2], 0.99) == 4
+
+    backend["System_tasks"].update_one({"Task_Id": 1}, {"$set": {"task_status": "error", "status_description": "Case_Distribution_Batch_ID mismatch: System_tasks has LT-1, Template_Task has LT-2."}})
+    assert load_test.collect_task_metrics(backend["System_tasks"])["mismatch_errors"] == 1
+
+def test_precheck_rejects_task_before_loading_cases(backend, monkeypatch):
+    cases = [(1, "D1", "CW"), (2, "D2", "CW"), (3, "D1", "AG"), (4, "D2", "AG")]
+    seed_batch(backend, 1, "B1", cases, [{"rtom": "CW", "donor_drc_id": "D2", "receiver_drc_id": "D1", "transfer_count": 1}])
+    monkeypatch.setattr(task_processor, "fetch_cases_for_batch", lambda *args: pytest.fail("cases were loaded"))
+
+    task_processor.process_single_batch(backend["System_tasks"].find_one({"Task_Id": 1}))
+
+    task = backend["System_tasks"].find_one({"Task_Id": 1})
+    assert task["task_status"] == "error"
+    assert "Precheck failed" in task["status_description"]
+
+def test_precheck_counts_a_rerun_from_the_drc_before_the_amend(backend):
+    cases = [(case_id, "D1" if case_id % 3 else "D2", RTOMS[case_id % 2]) for case_id in range(40)]
+    distributions = [{"rtom": "CW", "donor_drc_id": "D2", "receiver_drc_id": "D1", "transfer_count": 2}]
+    seed_batch(backend, 1, "B1", cases, distributions)
+    before = current_allocation(backend, "B1")
+    task_processor.process_single_batch(backend["System_tasks"].find_one({"Task_Id": 1}))
+    assert current_allocation(backend, "B1") != before
+
+    # A re-run of amend 2 falls back to the cases, which are counted where they were before it
+    success_precheck, bucket_counts = database_checks.precheck_distributions(
+        backend["DRS_Database.Case_Distribution_DRC_Summary"], backend["DRS.Tmp_Case_Distribution_DRC"], "B1", distributions, "cases", amend_batch_seq=2
+    )
+
+    assert success_precheck
+    assert Counter({(drc, rtom): count for drc, resources in bucket_counts.items() for rtom, count in resources.items()}) == before
+
+def test_out_of_core_mode_moves_the_same_counts(backend, monkeypatch):
+    rng = random.Random(7)
+    cases = [(case_id, rng.choice(["D1", "D2"]), rng.choice(RTOMS)) for case_id in range(400)]
+    distributions = [{"rtom": "CW", "donor_drc_id": "D2", "receiver_drc_id": "D1", "transfer_count": 10}]
+    seed_batch(backend, 1, "B1", cases, distributions)
+    expected = Counter()
+    success, updated_drcs = task_processor.plan_batch_context({
+        "drcs": {case_id: [drc, rtom] for case_id, drc, rtom in cases},
+        "array_of_distributions": distributions
+    })
+    assert success
+    expected.update((drc, rtom) for drc, rtom in updated_drcs.values())
+
+    settings = {("OUT_OF_CORE", "CASE_THRESHOLD"): 100, ("OUT_OF_CORE", "WINDOW_SIZE"): 7}
+    real_get_processing_setting = task_processor.get_processing_setting
+    monkeypatch.setattr(task_processor, "get_processing_setting", lambda section, key, fallback=None, value_type=str: settings.get((section, key), real_get_processing_setting(section, key, fallback, value_type)))
+    monkeypatch.setattr(task_processor, "fetch_cases_for_batch", lambda *args: pytest.fail("cases were loaded"))
+
+    task_processor.process_single_batch(backend["System_tasks"].find_one({"Task_Id": 1}))
+
+    assert backend["System_tasks"].find_one({"Task_Id": 1})["task_status"] == "completed"
+    assert current_allocation(backend, "B1") == expected
+
+def test_failed_out_of_core_plan_fails_only_its_task(backend, monkeypatch):
+    distribution = {"rtom": "CW", "donor_drc_id": "D2", "receiver_drc_id": "D1", "transfer_count": 2}
+    for task_id, batch_id in [(1, "B1"), (2, "B2")]:
+        seed_batch(backend, task_id, batch_id, [(f"{batch_id}-{case_id}", "D1" if case_id % 2 else "D2", RTOMS[case_id % 3]) for case_id in range(30)], [distribution])
+    real_get_processing_setting = task_processor.get_processing_setting
+    monkeypatch.setattr(task_processor, "get_processing_setting", lambda section, key, fallback=None, value_type=str: 10 if (section, key) == ("OUT_OF_CORE", "CASE_THRESHOLD") else real_get_processing_setting(section, key, fallback, value_type))
+    real_plan_batch_context = task_processor.plan_batch_context
+    def failing_plan_batch_context(batch_context):
+        if batch_context["case_distribution_batch_id"] == "B1":
+            raise ValueError("planning failed")
+        return real_plan_batch_context(batch_context)
+    monkeypatch.setattr(task_processor, "plan_batch_context", failing_plan_batch_context)
+
+    task_processor.process_batches_in_parallel(list(backend["System_tasks"].find({})), max_workers=1)
+
+    assert [task["task_status"] for task in backend["System_tasks"].find({}).sort("Task_Id", 1)] == ["error", "completed"]
+    assert batch_lock.acquire_batch_lock("B1")[0] and batch_lock.acquire_batch_lock("B2")[0]
+
+def test_rerun_writes_nothing_and_stays_in_its_batch(backend):
+    cases = [(case_id, "D1" if case_id % 3 else "D2", RTOMS[case_id % 2]) for case_id in range(40)]
+    distribution = {"rtom": "CW", "donor_drc_id": "D2", "receiver_drc_id": "D1", "transfer_count": 2}
+    seed_batch(backend, 2, "B2", cases, [distribution])
+    seed_batch(backend, 1, "B1", cases, [distribution])
+
+    task_processor.process_single_batch(backend["System_tasks"].find_one({"Task_Id": 1}))
+    first_run = backend["System_tasks"].find_one({"Task_Id": 1})
+    assert first_run["task_status"] == "completed"
+    assert "modified: 0" not in first_run["status_description"]
+    assert all(case["NEW_DRC_ID"] is None for case in backend["DRS.Tmp_Case_Distribution_DRC"].find({"Case_Distribution_Batch_ID": "B2"}))
+
+    # Re-open the task and its amend action, as a retried or re-submitted task would find them
+    backend["System_tasks"].update_one({"Task_Id": 1}, {"$set": {"task_status": "open"}})
+    backend["Case_distribution_drc_transactions"].update_one(
+        {"Case_Distribution_Batch_ID": "B1", "batch_seq_details.action_type": "amend"},
+        {"$set": {"batch_seq_details.$.CRD_Distribution_Status": "open", "summery_status": "open"}}
+    )
+    summary_before = list(backend["DRS_Database.Case_Distribution_DRC_Summary"].find({"Case_Distribution_Batch_ID": "B1"}))
+
+    task_processor.process_single_batch(backend["System_tasks"].find_one({"Task_Id": 1}))
+
+    second_run = backend["System_tasks"].find_one({"Task_Id": 1})
+    assert second_run["task_status"] == "completed"
+    assert "matched: 0, modified: 0" in second_run["status_description"]
+    assert list(backend["DRS_Database.Case_Distribution_DRC_Summary"].find({"Case_Distribution_Batch_ID": "B1"})) == summary_before
+
+def test_count_matrix_is_built_once_and_follows_the_moves(backend, monkeypatch):
+    cases = [(case_id, "D1" if case_id % 3 else "D2", RTOMS[case_id % 2]) for case_id in range(40)]
+    seed_batch(backend, 1, "B1", cases, [{"rtom": "CW", "donor_drc_id": "D2", "receiver_drc_id": "D1", "transfer_count": 2}])
+
+    task_processor.process_single_batch(backend["System_tasks"].find_one({"Task_Id": 1}))
+
+    assert backend["System_tasks"].find_one({"Task_Id": 1})["task_status"] == "completed"
+    transaction = backend["Case_distribution_drc_transactions"].find_one({"Case_Distribution_Batch_ID": "B1"})
+    assert transaction["count_matrix_version"] == 1
+    stored_counts = Counter({(drc, rtom): count for drc, resources in transaction["count_matrix"].items() for rtom, count in resources.items() if count})
+    assert stored_counts == current_allocation(backend, "B1")
+
+    # The next amend of the batch reads the matrix instead of the summary
+    monkeypatch.setattr(count_matrix, "fetch_summary_counts_for_batch", lambda *args: pytest.fail("summary was read"))
+    success_fetch, matrix = count_matrix.fetch_count_matrix(
+        backend["Case_distribution_drc_transactions"], backend["DRS_Database.Case_Distribution_DRC_Summary"],
+        backend["DRS.Tmp_Case_Distribution_DRC"], "B1"
+    )
+    assert matrix["version"] == 1
+    assert Counter({(drc, rtom): count for drc, resources in matrix["counts"].items() for rtom, count in resources.items()}) == stored_counts
+
+    success_update, updated_matrix = count_matrix.update_count_matrix(
+        backend["Case_distribution_drc_transactions"], "B1", matrix, {("D1", "AG"): -1, ("D2", "AG"): 1}
+    )
+    count_matrix.rollback_count_matrix(backend["Case_distribution_drc_transactions"], "B1", matrix, updated_matrix)
+    transaction = backend["Case_distribution_drc_transactions"].find_one({"Case_Distribution_Batch_ID": "B1"})
+    assert transaction["count_matrix_version"] == 3
+    assert Counter({(drc, rtom): count for drc, resources in transaction["count_matrix"].items() for rtom, count in resources.items() if count}) == stored_counts
+
+def test_count_matrix_is_seeded_from_the_cases_not_a_stale_summary(backend):
+    cases = [(case_id, "D1" if case_id % 3 else "D2", RTOMS[case_id % 2]) for case_id in range(30)]
+    seed_batch(backend, 1, "B1", cases, [{"rtom": "CW", "donor_drc_id": "D2", "receiver_drc_id": "D1", "transfer_count": 2}])
+    backend["DRS_Database.Case_Distribution_DRC_Summary"].update_many({"Case_Distribution_Batch_ID": "B1"}, {"$set": {"Count": 1000}})
+
+    success_fetch, matrix = count_matrix.fetch_count_matrix(
+        backend["Case_distribution_drc_transactions"], backend["DRS_Database.Case_Distribution_DRC_Summary"],
+        backend["DRS.Tmp_Case_Distribution_DRC"], "B1"
+    )
+
+    assert success_fetch
+    assert Counter({(drc, rtom): count for drc, resources in matrix["counts"].items() for rtom, count in resources.items()}) == current_allocation(backend, "B1")
+
+@pytest.mark.parametrize("case_threshold", [0, 10])
+def test_consecutive_amends_count_from_the_current_drc(backend, monkeypatch, case_threshold):
+    # A threshold of 10 cases runs both amends out of core
+    real_get_processing_setting = task_processor.get_processing_setting
+    monkeypatch.setattr(task_processor, "get_processing_setting", lambda section, key, fallback=None, value_type=str: case_threshold if (section, key) == ("OUT_OF_CORE", "CASE_THRESHOLD") else real_get_processing_setting(section, key, fallback, value_type))
+    cases = [(case_id, ["D1", "D2", "D3"][case_id % 3], RTOMS[case_id // 3 % 2]) for case_id in range(60)]
+    seed_batch(backend, 1, "B1", cases, [{"rtom": "CW", "donor_drc_id": "D2", "receiver_drc_id": "D1", "transfer_count": 3}])
+    task_processor.process_single_batch(backend["System_tasks"].find_one({"Task_Id": 1}))
+    assert backend["System_tasks"].find_one({"Task_Id": 1})["task_status"] == "completed"
+
+    # A second amend action on the same batch moves cases that already carry a NEW_DRC_ID
+    backend["System_tasks"].insert_one({"Task_Id": 2, "Template_Task_Id": 26, "task_type": "Case Amend Planning among DRC", "parameters": {"Case_Distribution_Batch_ID": "B1"}, "task_status": "open"})
+    backend["Case_distribution_drc_transactions"].update_one({"Case_Distribution_Batch_ID": "B1"}, {
+        "$set": {"summery_status": "open"},
+        "$push": {"batch_seq_details": {"batch_seq": 3, "action_type": "amend", "CRD_Distribution_Status": "open", "array_of_distributions": [{"rtom": "CW", "donor_drc_id": "D2", "receiver_drc_id": "D3", "transfer_count": 3}]}}
+    })
+    before = current_allocation(backend, "B1")
+    # The matrix already holds the counts before the second amend, so an out-of-core plan does not group the cases again
+    monkeypatch.setattr(task_processor, "fetch_case_counts_for_batch", lambda *args: pytest.fail("cases were grouped"))
+    task_processor.process_single_batch(backend["System_tasks"].find_one({"Task_Id": 2}))
+
+    assert backend["System_tasks"].find_one({"Task_Id": 2})["task_status"] == "completed"
+    after = current_allocation(backend, "B1")
+    assert (after[("D2", "CW")], after[("D3", "CW")]) == (before[("D2", "CW")] - 3, before[("D3", "CW")] + 3)
+    transaction = backend["Case_distribution_drc_transactions"].find_one({"Case_Distribution_Batch_ID": "B1"})
+    assert Counter({(drc, rtom): count for drc, resources in transaction["count_matrix"].items() for rtom, count in resources.items() if count}) == after
+    summary = Counter({(row["DRC_Id"], row["RTOM"]): row["Count"] for row in backend["DRS_Database.Case_Distribution_DRC_Summary"].find({"Case_Distribution_Batch_ID": "B1"}) if row["Count"]})
+    assert summary == after
+
+def test_batch_lock_is_exclusive_and_fences_stale_holders(backend):
+    seed_batch(backend, 1, "B1", [(case_id, "D1" if case_id % 2 else "D2", "CW") for case_id in range(20)], [])
+    success, expired_lock = batch_lock.acquire_batch_lock("B1", lease_seconds=0)
+    assert success and expired_lock["fencing_token"] == 1
+
+    # The expired lease is taken over with a newer token, which then excludes everyone else
+    success, current_lock = batch_lock.acquire_batch_lock("B1")
+    assert current_lock["fencing_token"] == 2
+    with pytest.raises(BatchLockedError):
+        batch_lock.acquire_batch_lock("B1")
+    with pytest.raises(StaleFencingTokenError):
+        batch_lock.renew_batch_lock(expired_lock)
+
+    # Writes under the current token are stamped with it, and block writes under the old one
+    summary_collection = backend["DRS_Database.Case_Distribution_DRC_Summary"]
+    transaction_collection = backend["Case_distribution_drc_transactions"]
+    update_databases.update_summary_counts_in_mongo(summary_collection, transaction_collection, {"D1": {"CW": 12}, "D2": {"CW": 8}}, "B1", current_lock["fencing_token"])
+    with pytest.raises(StaleFencingTokenError):
+        update_databases.update_summary_counts_in_mongo(summary_collection, transaction_collection, {"D1": {"CW": 5}, "D2": {"CW": 15}}, "B1", expired_lock["fencing_token"])
+    assert {row["DRC_Id"]: (row["Count"], row["Fencing_Token"]) for row in summary_collection.find({"Case_Distribution_Batch_ID": "B1"})} == {"D1": (12, 2), "D2": (8, 2)}
+
+    batch_lock.release_batch_lock(current_lock)
+    assert batch_lock.acquire_batch_lock("B1")[1]["fencing_token"] == 3
+
+def test_summary_rows_written_before_a_stale_row_are_rolled_back(backend, monkeypatch):
+    seed_batch(backend, 1, "B1", [(case_id, ["D1", "D2", "D3"][case_id % 3], "CW") for case_id in range(30)], [])
+    summary_collection = backend["DRS_Database.Case_Distribution_DRC_Summary"]
+    transaction_collection = backend["Case_distribution_drc_transactions"]
+    summary_before = {row["DRC_Id"]: row["Count"] for row in summary_collection.find({})}
+    # A newer lock holder takes over the D3 row after the token precheck, while D1 and D2 are being written
+    update_one = summary_collection.update_one
+    def racing_update_one(query_filter, update, *args, **kwargs):
+        if query_filter.get("DRC_Id") == "D3":
+            update_one({"DRC_Id": "D3"}, {"$set": {"Fencing_Token": 5}})
+        return update_one(query_filter, update, *args, **kwargs)
+    monkeypatch.setattr(summary_collection, "update_one", racing_update_one)
+
+    with pytest.raises(StaleFencingTokenError):
+        update_databases.update_summary_counts_in_mongo(summary_collection, transaction_collection, {"D1": {"CW": 12}, "D2": {"CW": 9}, "D3": {"CW": 9}}, "B1", 1)
+
+    assert {row["DRC_Id"]: row["Count"] for row in summary_collection.find({})} == summary_before
+
+def test_task_on_a_locked_batch_is_left_open(backend):
+    seed_batch(backend, 1, "B1", [(1, "D1", "CW"), (2, "D2", "CW")], [])
+    batch_lock.acquire_batch_lock("B1")
+
+    task_processor.process_single_batch(backend["System_tasks"].find_one({"Task_Id": 1}))
+
+    assert backend["System_tasks"].find_one({"Task_Id": 1})["task_status"] == "open"
+
+def test_task_is_validated_against_its_own_locked_batch(backend):
+    cases = [(case_id, "D1" if case_id % 2 else "D2", RTOMS[case_id % 3]) for case_id in range(30)]
+    distribution = {"rtom": "CW", "donor_drc_id": "D2", "receiver_drc_id": "D1", "transfer_count": 2}
+    seed_batch(backend, 1, "B1", cases, [distribution])
+    seed_batch(backend, 2, "B2", cases, [distribution])
+    # Another process has pointed the shared template task at its own batch since task 1 was validated
+    update_databases.update_template_task_collection("B1")
+    update_databases.update_template_task_collection("B2")
+
+    task_processor.process_single_batch(backend["System_tasks"].find_one({"Task_Id": 1}))
+
+    assert backend["System_tasks"].find_one({"Task_Id": 1})["task_status"] == "completed"
+
+def test_task_that_could_not_be_locked_is_left_open(backend, monkeypatch):
+    seed_batch(backend, 1, "B1", [(1, "D1", "CW"), (2, "D2", "CW")], [])
+    def failing_acquire_batch_lock(case_distribution_batch_id):
+        raise DatabaseUpdateError(f"Failed to lock Batch ID {case_distribution_batch_id}: connection reset")
+    monkeypatch.setattr(task_processor, "acquire_batch_lock", failing_acquire_batch_lock)
+
+    task_processor.process_single_batch(backend["System_tasks"].find_one({"Task_Id": 1}))
+
+    task = backend["System_tasks"].find_one({"Task_Id": 1})
+    assert task["task_status"] == "open" and "status_history" not in task
+
+def test_profiling_writes_reports_only_for_requested_tasks(backend, monkeypatch, tmp_path):
+    monkeypatch.setattr(task_profiler, "_settings", {
+        "enabled": False, "task_ids": set(), "output_dir": str(tmp_path),
+        "top_functions": 10, "top_allocations": 5, "traceback_frames": 1
+    })
+    cases = [(case_id, "D1" if case_id % 2 else "D2", RTOMS[case_id % 3]) for case_id in range(30)]
+    seed_batch(backend, 2, "B2", cases, [{"rtom": "CW", "donor_drc_id": "D2", "receiver_drc_id": "D1", "transfer_count": 1}])
+    task_processor.process_single_batch(backend["System_tasks"].find_one({"Task_Id": 2}))
+    assert list(tmp_path.iterdir()) == []
+
+    seed_batch(backend, 1, "B1", cases, [{"rtom": "CW", "donor_drc_id": "D2", "receiver_drc_id": "D1", "transfer_count": 1}])
+    backend["System_tasks"].update_one({"Task_Id": 1}, {"$set": {"profile": True}})
+    task_processor.process_single_batch(backend["System_tasks"].find_one({"Task_Id": 1}))
+
+    assert backend["System_tasks"].find_one({"Task_Id": 1})["task_status"] == "completed"
+    assert sorted(path.name.split(".", 1)[1] for path in tmp_path.iterdir()) == ["alloc.txt", "profile.txt", "pstats"]
+    assert "_process_single_batch" in next(tmp_path.glob("*.profile.txt")).read_text()
+
+def test_committed_plan_is_exported_as_a_mapped_move_file(backend, monkeypatch, tmp_path):
+    settings = {("MOVE_PLAN", "ENABLED"): True, ("MOVE_PLAN", "OUTPUT_DIR"): str(tmp_path), ("MOVE_PLAN", "FORMAT"): "binary"}
+    monkeypatch.setattr(move_plan_export, "get_processing_setting", lambda section, key, fallback=None, value_type=str: settings.get((section, key), fallback))
+    cases = [(f"C-{case_id}", "D1" if case_id % 3 else "D2", RTOMS[case_id % 2]) for case_id in range(40)]
+    seed_batch(backend, 7, "B7", cases, [{"rtom": "CW", "donor_drc_id": "D2", "receiver_drc_id": "D1", "transfer_count": 2}])
+
+    task_processor.process_single_batch(backend["System_tasks"].find_one({"Task_Id": 7}))
+
+    assert backend["System_tasks"].find_one({"Task_Id": 7})["task_status"] == "completed"
+    moved_cases = {
+        case["Case_Id"]: (case["DRC_Id"], case["NEW_DRC_ID"], case["RTOM"])
+        for case in backend["DRS.Tmp_Case_Distribution_DRC"].find({"Case_Distribution_Batch_ID": "B7", "NEW_DRC_ID": {"$ne": None}})
+    }
+    with move_plan_export.MovePlanFile(str(tmp_path / "task_7.moveplan")) as plan:
+        assert (plan.task_id, plan.case_distribution_batch_id, len(plan)) == (7, "B7", len(moved_cases))
+        assert {case_id: (from_drc, to_drc, rtom) for case_id, from_drc, to_drc, rtom, _ in plan} == moved_cases
+        # The transfer and its balance-back both come from the only distribution
+        assert {distribution_index for *_, distribution_index in plan} == {0}
+        assert plan[-1] == list(plan)[-1]
+
+    # Integer case ids are stored in the records themselves; net moves no distribution explains stay unattributed
+    file_path = str(tmp_path / "ints.moveplan")
+    move_plan_export.write_move_plan(file_path, 8, "B8", [{"rtom": "CW", "donor_drc_id": "D2", "receiver_drc_id": "D1", "transfer_count": 1}], [
+        ("D2", "D1", "CW", [5, 2 ** 40]), ("D3", "D1", "AG", [9])
+    ])
+    with move_plan_export.MovePlanFile(file_path) as plan:
+        assert list(plan) == [(5, "D2", "D1", "CW", 0), (2 ** 40, "D2", "D1", "CW", 0), (9, "D3", "D1", "AG", None)]
+
+@pytest.mark.parametrize("case_threshold", [0, 10])
+def test_rerun_exports_only_the_cases_it_modified(backend, monkeypatch, tmp_path, case_threshold):
+    settings = {("MOVE_PLAN", "ENABLED"): True, ("MOVE_PLAN", "OUTPUT_DIR"): str(tmp_path), ("MOVE_PLAN", "FORMAT"): "binary"}
+    monkeypatch.setattr(move_plan_export, "get_processing_setting", lambda section, key, fallback=None, value_type=str: settings.get((section, key), fallback))
+    real_get_processing_setting = task_processor.get_processing_setting
+    monkeypatch.setattr(task_processor, "get_processing_setting", lambda section, key, fallback=None, value_type=str: case_threshold if (section, key) == ("OUT_OF_CORE", "CASE_THRESHOLD") else real_get_processing_setting(section, key, fallback, value_type))
+    cases = [(f"C-{case_id}", "D1" if case_id % 3 else "D2", RTOMS[case_id % 2]) for case_id in range(40)]
+    seed_batch(backend, 7, "B7", cases, [{"rtom": "CW", "donor_drc_id": "D2", "receiver_drc_id": "D1", "transfer_count": 2}])
+    case_collection = backend["DRS.Tmp_Case_Distribution_DRC"]
+    def rerun():
+        # Re-open the task and its amend action, as a retried or re-submitted task would find them
+        backend["System_tasks"].update_one({"Task_Id": 7}, {"$set": {"task_status": "open"}})
+        backend["Case_distribution_drc_transactions"].update_one(
+            {"Case_Distribution_Batch_ID": "B7", "batch_seq_details.action_type": "amend"},
+            {"$set": {"batch_seq_details.$.CRD_Distribution_Status": "open", "summery_status": "open"}}
+        )
+        task_processor.process_single_batch(backend["System_tasks"].find_one({"Task_Id": 7}))
+    def exported_case_ids():
+        with move_plan_export.MovePlanFile(str(tmp_path / "task_7.moveplan")) as plan:
+            return sorted(case_id for case_id, *_ in plan)
+
+    task_processor.process_single_batch(backend["System_tasks"].find_one({"Task_Id": 7}))
+    moved_case_ids = sorted(case["Case_Id"] for case in case_collection.find({"Case_Distribution_Batch_ID": "B7", "NEW_DRC_ID": {"$ne": None}}))
+    assert len(moved_case_ids) > 1 and exported_case_ids() == moved_case_ids
+
+    # As if the first commit had only written part of its cases: the re-run exports the cases it wrote itself
+    case_collection.update_one({"Case_Id": moved_case_ids[0]}, {"$set": {"NEW_DRC_ID": None, "Amend_Batch_Seq": None, "Amend_Prior_DRC_ID": None}})
+    rerun()
+    assert "modified: 1" in backend["System_tasks"].find_one({"Task_Id": 7})["status_description"]
+    assert exported_case_ids() == moved_case_ids[:1]
+
+    # A re-run that modifies nothing keeps the last plan
+    rerun()
+    assert "modified: 0" in backend["System_tasks"].find_one({"Task_Id": 7})["status_description"]
+    assert exported_case_ids() == moved_case_ids[:1]
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(resilience, "_settings", {
+        "max_attempts": 4, "base_delay": 0.001, "max_delay": 0.002, "deadline": 5,
+        "breaker_failure_threshold": 3, "breaker_reset_seconds": 60
+    })
+    monkeypatch.setattr(resilience, "_breakers", {})
+
+def flaky(operation, failures):
+    """
+    Wraps a collection method so that its first calls fail with a transient error.
+    """
+    calls = {"count": 0}
+    def flaky_operation(*args, **kwargs):
+        calls["count"] += 1
+        if calls["count"] <= failures:
+            raise AutoReconnect("connection reset")
+        return operation(*args, **kwargs)
+    return flaky_operation
+
+def test_transient_write_errors_are_retried(backend, fast_retries, monkeypatch):
+    cases = [(case_id, "D1" if case_id % 2 else "D2", RTOMS[case_id % 3]) for case_id in range(30)]
+    seed_batch(backend, 1, "B1", cases, [{"rtom": "CW", "donor_drc_id": "D2", "receiver_drc_id": "D1", "transfer_count": 2}])
+    summary_collection = backend["DRS_Database.Case_Distribution_DRC_Summary"]
+    monkeypatch.setattr(summary_collection, "update_one", flaky(summary_collection.update_one, 2))
+
+    task_processor.process_single_batch(backend["System_tasks"].find_one({"Task_Id": 1}))
+
+    assert backend["System_tasks"].find_one({"Task_Id": 1})["task_status"] == "completed"
+
+def test_failed_count_matrix_update_rolls_back_the_task(backend, fast_retries, monkeypatch):
+    cases = [(case_id, "D1" if case_id % 2 else "D2", RTOMS[case_id % 3]) for case_id in range(30)]
+    seed_batch(backend, 1, "B1", cases, [{"rtom": "CW", "donor_drc_id": "D2", "receiver_drc_id": "D1", "transfer_count": 2}])
+    transactions = backend["Case_distribution_drc_transactions"]
+    update_one = transactions.update_one
+    def failing_update_one(query_filter, update, *args, **kwargs):
+        if "$inc" in update:
+            raise AutoReconnect("connection reset")
+        return update_one(query_filter, update, *args, **kwargs)
+    monkeypatch.setattr(transactions, "update_one", failing_update_one)
+    before = current_allocation(backend, "B1")
+    summary_before = Counter({(row["DRC_Id"], row["RTOM"]): row["Count"] for row in backend["DRS_Database.Case_Distribution_DRC_Summary"].find({})})
+
+    task_processor.process_single_batch(backend["System_tasks"].find_one({"Task_Id": 1}))
+
+    assert backend["System_tasks"].find_one({"Task_Id": 1})["task_status"] == "error"
+    assert current_allocation(backend, "B1") == before
+    assert Counter({(row["DRC_Id"], row["RTOM"]): row["Count"] for row in backend["DRS_Database.Case_Distribution_DRC_Summary"].find({})}) == summary_before
+
+def test_failed_status_writes_fall_back_only_for_the_failed_tasks(backend, fast_retries, monkeypatch):
+    for task_id in (1, 2):
+        seed_batch(backend, task_id, f"B{task_id}", [(1, "D1", "CW")], [])
+    system_tasks = backend["System_tasks"]
+    bulk_write = system_tasks.bulk_write
+    def partly_failing_bulk_write(requests, ordered=True, **kwargs):
+        bulk_write(requests[:1], ordered=ordered)
+        raise BulkWriteError({"writeErrors": [{"index": index, "code": 2, "errmsg": "failed"} for index in range(1, len(requests))], "nInserted": 0, "nMatched": 1})
+    monkeypatch.setattr(system_tasks, "bulk_write", partly_failing_bulk_write)
+    failed_task_ids = []
+    status_batch = database_checks.TaskStatusBatch(system_tasks, bulk_size=10)
+    for task_id in (1, 2):
+        status_batch.add(task_id, "completed", "done", lambda task_id=task_id: failed_task_ids.append(task_id))
+
+    assert status_batch.flush() == (False, [2])
+    assert failed_task_ids == [2]
+    assert [task["task_status"] for task in system_tasks.find({}).sort("Task_Id", 1)] == ["completed", "open"]
+
+    # A queued "error" transition that cannot be bulk-written is written on its own
+    monkeypatch.setattr(system_tasks, "bulk_write", flaky(bulk_write, 100))
+    cases = [(1, "D1", "CW"), (2, "D2", "CW"), (3, "D1", "AG"), (4, "D2", "AG")]
+    seed_batch(backend, 3, "B3", cases, [{"rtom": "CW", "donor_drc_id": "D2", "receiver_drc_id": "D1", "transfer_count": 1}])
+
+    task_processor.process_batches_in_parallel([system_tasks.find_one({"Task_Id": 3})], max_workers=1)
+
+    task = system_tasks.find_one({"Task_Id": 3})
+    assert task["task_status"] == "error" and "Precheck failed" in task["status_description"]
+
+def test_failed_lock_renewal_fails_the_task(backend, fast_retries, monkeypatch):
+    cases = [(case_id, "D1" if case_id % 2 else "D2", RTOMS[case_id % 3]) for case_id in range(30)]
+    seed_batch(backend, 1, "B1", cases, [{"rtom": "CW", "donor_drc_id": "D2", "receiver_drc_id": "D1", "transfer_count": 2}])
+    lock_collection = backend["Amend_batch_locks"]
+    monkeypatch.setattr(lock_collection, "update_one", flaky(lock_collection.update_one, 100))
+    before = current_allocation(backend, "B1")
+
+    task_processor.process_single_batch(backend["System_tasks"].find_one({"Task_Id": 1}))
+
+    task = backend["System_tasks"].find_one({"Task_Id": 1})
+    assert task["task_status"] == "error" and "renew the lock" in task["status_description"]
+    assert current_allocation(backend, "B1") == before
+
+def test_processing_settings_are_read_once(monkeypatch):
+    reads = []
+    def read_ini():
+        reads.append(1)
+        return False, "not found"
+    monkeypatch.setattr(read_amend_processing_ini, "_config", None)
+    monkeypatch.setattr(read_amend_processing_ini, "read_amend_processing_ini", read_ini)
+
+    assert [read_amend_processing_ini.get_processing_setting("STATUS", "BULK_SIZE", 100, int) for _ in range(3)] == [100] * 3
+    assert len(reads) == 1
+
+def test_circuit_opens_after_repeated_failures(fast_retries):
+    with pytest.raises(AutoReconnect):
+        resilience.call_with_retry("flaky_operation", flaky(lambda: None, 100))
+    with pytest.raises(CircuitOpenError):
+        resilience.call_with_retry("flaky_operation", lambda: None)
+
+def test_task_hit_by_an_open_circuit_is_left_open(backend, fast_retries):
+    cases = [(case_id, "D1" if case_id % 2 else "D2", RTOMS[case_id % 3]) for case_id in range(30)]
+    seed_batch(backend, 1, "B1", cases, [{"rtom": "CW", "donor_drc_id": "D2", "receiver_drc_id": "D1", "transfer_count": 2}])
+    with pytest.raises(AutoReconnect):
+        resilience.call_with_retry("update_summary_in_mongo", flaky(lambda: None, 100))
+    before = current_allocation(backend, "B1")
+    summary_before = Counter({(row["DRC_Id"], row["RTOM"]): row["Count"] for row in backend["DRS_Database.Case_Distribution_DRC_Summary"].find({})})
+
+    task_processor.process_single_batch(backend["System_tasks"].find_one({"Task_Id": 1}))
+
+    task = backend["System_tasks"].find_one({"Task_Id": 1})
+    assert (task["task_status"], task.get("claimed_by")) == ("open", None)
+    assert current_allocation(backend, "B1") == before
+    assert Counter({(row["DRC_Id"], row["RTOM"]): row["Count"] for row in backend["DRS_Database.Case_Distribution_DRC_Summary"].find({})}) == summary_before
@@ -0,0 +1,136 @@
+'''
+test_process_logic.py file is as follows:
+
+    Purpose: This script tests the resource balancing logic.
+    Created Date: 2025-03-25
+    Created By:  T.S.Balasooriya (tharindutsb@gmail.com) , Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Last Modified Date: 2025-03-25
+    Modified By: T.S.Balasooriya (tharindutsb@gmail.com), Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Version: Python 3.9
+    Dependencies: random, collections, pytest, actionManipulation.balance_resources
+    Notes:
+        - The property tests run balance_resources on many randomly generated batches with fixed seeds.
+        - The worst cases of the balance-back (large transfers, receivers that run out of cases) are checked by counting
+          the cases moved and the buckets read. plan_benchmark.py --balance-back times them.
+'''
+
+import random
+from collections import Counter
+import pytest
+from actionManipulation import balance_resources as balance_resources_module
+from actionManipulation.balance_resources import balance_resources, balance_resource_counts, compute_balance_back_takes
+
+DRC_IDS = ["D1", "D2", "D3"]
+RTOMS = ["CW", "AG", "AD", "KL", "MT"]
+
+def round_robin_takes(bucket_sizes, transfer_value):
+    """
+    Reference round-robin: one case from every non-empty bucket per round.
+    """
+    takes = [0] * len(bucket_sizes)
+    remaining_value = transfer_value
+    while remaining_value > 0 and any(take < size for take, size in zip(takes, bucket_sizes)):
+        for index, size in enumerate(bucket_sizes):
+            if remaining_value > 0 and takes[index] < size:
+                takes[index] += 1
+                remaining_value -= 1
+    return takes, remaining_value
+
+def random_batch(rng, case_count):
+    return {case_id: [rng.choice(DRC_IDS), rng.choice(RTOMS)] for case_id in range(case_count)}
+
+def count_buckets(drcs):
+    bucket_counts = {}
+    for drc, rtom in drcs.values():
+        bucket_counts.setdefault(drc, {}).setdefault(rtom, 0)
+        bucket_counts[drc][rtom] += 1
+    return bucket_counts
+
+@pytest.mark.parametrize("seed", range(20))
+def test_balance_back_takes_match_round_robin(seed):
+    rng = random.Random(seed)
+    for _ in range(200):
+        bucket_sizes = [rng.randint(0, 12) for _ in range(rng.randint(0, 8))]
+        transfer_value = rng.randint(0, 60)
+        assert compute_balance_back_takes(bucket_sizes, transfer_value) == round_robin_takes(bucket_sizes, transfer_value)
+
+@pytest.mark.parametrize("seed", range(20))
+def test_balance_resources_properties(seed):
+    rng = random.Random(seed)
+    for _ in range(50):
+        drcs = random_batch(rng, rng.randint(1, 80))
+        receiver_drc, donor_drc = rng.sample(DRC_IDS, 2)
+        rtom = rng.choice(RTOMS)
+        transfer_value = rng.randint(0, 10)
+
+        success, updated_drcs = balance_resources(drcs, receiver_drc, donor_drc, rtom, transfer_value)
+        success_counts, updated_counts = balance_resource_counts(count_buckets(drcs), receiver_drc, donor_drc, rtom, transfer_value)
+        assert success == success_counts
+        if not success:
+            assert isinstance(updated_drcs, str)
+            continue
+
+        # Every case is kept, and keeps its RTOM
+        assert updated_drcs.keys() == drcs.keys()
+        assert all(updated_drcs[case_id][1] == drcs[case_id][1] for case_id in drcs)
+
+        # Only the donor and receiver change, by exactly transfer_value cases of rtom each way
+        before = Counter((drc, resource) for drc, resource in drcs.values())
+        after = Counter((drc, resource) for drc, resource in updated_drcs.values())
+        assert after[(receiver_drc, rtom)] - before[(receiver_drc, rtom)] == transfer_value
+        assert before[(donor_drc, rtom)] - after[(donor_drc, rtom)] == transfer_value
+        assert Counter(drc for drc, _ in updated_drcs.values()) == Counter(drc for drc, _ in drcs.values())
+        for drc in set(DRC_IDS) - {receiver_drc, donor_drc}:
+            assert all(after[(drc, resource)] == before[(drc, resource)] for resource in RTOMS)
+
+        # The count-only planner ends with the same matrix
+        assert {key: count for key, count in after.items() if count} == {
+            (drc, resource): count for drc, resources in updated_counts.items() for resource, count in resources.items() if count
+        }
+
+def test_balance_resources_reports_shortfall_without_common_resources():
+    drcs = {1: ["D1", "CW"], 2: ["D1", "CW"], 3: ["D2", "CW"], 4: ["D2", "CW"], 5: ["D2", "CW"], 6: ["D2", "CW"], 7: ["D2", "CW"]}
+
+    success, error = balance_resources(drcs, "D1", "D2", "CW", 1)
+
+    assert not success
+    assert "balance back 1 of 1" in error
+
+def test_balance_back_worst_case_moves_each_case_once(monkeypatch):
+    # One huge bucket pair and a transfer that drains most of the receiver's other buckets
+    rng = random.Random(0)
+    drcs = {}
+    for case_id in range(20000):
+        drcs[case_id] = ["D1" if case_id % 2 else "D2", "CW" if case_id < 10000 else rng.choice(RTOMS[1:])]
+    moves = []
+    real_move_cases = balance_resources_module._move_cases
+    monkeypatch.setattr(balance_resources_module, "_move_cases", lambda source, target, count: moves.append(count) or real_move_cases(source, target, count))
+
+    success, _ = balance_resources(drcs, "D1", "D2", "CW", 4000)
+
+    # The transfer and the balance-back each move 4000 cases, with one slice per RTOM whatever the number of rounds
+    assert success
+    assert sum(moves) == 2 * 4000
+    assert len(moves) <= len(RTOMS)
+
+class CountingList(list):
+    """
+    A list that counts the items read by iterating over it.
+    """
+    def __init__(self, items):
+        super().__init__(items)
+        self.items_read = 0
+
+    def __iter__(self):
+        for item in super().__iter__():
+            self.items_read += 1
+            yield item
+
+def test_balance_back_takes_do_not_depend_on_the_transfer_size():
+    bucket_sizes = CountingList([10 ** 9] * 1000)
+    takes, shortfall = compute_balance_back_takes(bucket_sizes, 10 ** 11)
+
+    assert shortfall == 0
+    assert sum(takes) == 10 ** 11
+    # A few passes over the buckets, not one step per round or per case
+    assert bucket_sizes.items_read <= 3 * len(bucket_sizes)
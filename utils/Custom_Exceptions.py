@@ -26,4 +26,16 @@ class INIFileReadError(TaskProcessingError):
 
 class TaskProcessingException(TaskProcessingError):
     """Raised when there is a general task processing error."""
-    pass
\ No newline at end of file
+    pass
+
+class CircuitOpenError(DatabaseConnectionError):
+    """Raised when a database operation is skipped because its circuit breaker is open."""
+    pass
+
+class BatchLockedError(TaskProcessingError):
+    """Raised when a task cannot be locked or claimed, e.g. another process holds its batch or has taken it. The task is left open."""
+    pass
+
+class StaleFencingTokenError(DatabaseUpdateError):
+    """Raised when a write is rejected because a newer lock holder has written to the batch."""
+    pass
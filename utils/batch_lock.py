@@ -0,0 +1,136 @@
+'''
+batch_lock.py file is as follows:
+
+    Purpose: This script provides per-batch locks with leases and fencing tokens, so that only one process amends a batch at a time.
+    Created Date: 2025-04-03
+    Created By:  T.S.Balasooriya (tharindutsb@gmail.com) , Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Last Modified Date: 2025-04-03
+    Modified By: T.S.Balasooriya (tharindutsb@gmail.com), Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Version: Python 3.9
+    Dependencies: os, socket, uuid, datetime, pymongo, utils.loggers, utils.connectDB, utils.Custom_Exceptions, utils.resilience, utils.read_amend_processing_ini
+    Notes:
+        - One document per batch in Amend_batch_locks: {_id: Case_Distribution_Batch_ID, owner, fencing_token, lease_expires_at}.
+        - A lock is free when it has no owner or its lease has expired, so a crashed process blocks its batch
+          for at most LEASE_SECONDS. Lease times come from the clock of each process, which must be kept in sync.
+        - fencing_token is incremented on every acquire and lock documents are never deleted, so tokens only grow.
+          Case and summary updates are stamped with the token and skip documents that carry a newer one,
+          so a process whose lease expired cannot overwrite the work of the next lock holder.
+'''
+
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from utils.loggers import get_logger
+from utils.connectDB import get_collection, BATCH_LOCKS
+from utils.Custom_Exceptions import TaskProcessingError, BatchLockedError, StaleFencingTokenError, DatabaseUpdateError
+from utils.resilience import call_with_retry
+from utils.read_amend_processing_ini import get_processing_setting
+
+logger = get_logger("amend_status_logger")
+
+def _lease_seconds(lease_seconds):
+    if lease_seconds is None:
+        lease_seconds = get_processing_setting("LOCKING", "LEASE_SECONDS", 600, int)
+    return lease_seconds
+
+def acquire_batch_lock(case_distribution_batch_id, lease_seconds=None):
+    """
+    Takes the lock of a batch for lease_seconds and increments its fencing token.
+    Raises BatchLockedError if another process holds a lease that has not expired.
+    Returns: (success, lock) where lock is {batch_id, owner, fencing_token}
+    """
+    lock_collection = get_collection(BATCH_LOCKS)
+    owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex}"
+    now = datetime.now()
+    lease_expires_at = now + timedelta(seconds=_lease_seconds(lease_seconds))
+
+    try:
+        # Take over a released or expired lock. A retry after a lost reply finds the lock under our
+        # own owner id and only increments the token once more, which keeps it monotonic.
+        lock_document = call_with_retry(
+            "acquire_batch_lock",
+            lock_collection.find_one_and_update,
+            {
+                "_id": case_distribution_batch_id,
+                "$or": [{"owner": None}, {"owner": owner}, {"lease_expires_at": {"$lte": now}}]
+            },
+            {
+                "$set": {"owner": owner, "acquired_at": now, "lease_expires_at": lease_expires_at},
+                "$inc": {"fencing_token": 1}
+            },
+            return_document=ReturnDocument.AFTER
+        )
+        if lock_document is None:
+            # First lock of this batch, unless another process holds it
+            lock_document = {"_id": case_distribution_batch_id, "owner": owner, "fencing_token": 1, "acquired_at": now, "lease_expires_at": lease_expires_at}
+            lock_collection.insert_one(lock_document)
+    except DuplicateKeyError:
+        holder = lock_collection.find_one({"_id": case_distribution_batch_id}) or {}
+        error_message = f"Batch ID {case_distribution_batch_id} is locked by {holder.get('owner')} until {holder.get('lease_expires_at')}."
+        logger.warning(error_message)
+        raise BatchLockedError(error_message)
+    except Exception as lock_error:
+        logger.error(f"Failed to lock Batch ID {case_distribution_batch_id}: {lock_error}")
+        raise DatabaseUpdateError(f"Failed to lock Batch ID {case_distribution_batch_id}: {lock_error}")
+
+    lock = {"batch_id": case_distribution_batch_id, "owner": owner, "fencing_token": lock_document["fencing_token"]}
+    logger.info(f"Locked Batch ID {case_distribution_batch_id} with fencing token {lock['fencing_token']} until {lease_expires_at}.")
+    return True, lock
+
+def renew_batch_lock(lock, lease_seconds=None):
+    """
+    Extends the lease of a lock that is still held with the same fencing token.
+    Raises StaleFencingTokenError if the lease was lost, so no write is started without it,
+    and DatabaseUpdateError if the lease could not be renewed.
+    Returns: (success, lock)
+    """
+    if lock is None:
+        return True, lock
+
+    lock_collection = get_collection(BATCH_LOCKS)
+    lease_expires_at = datetime.now() + timedelta(seconds=_lease_seconds(lease_seconds))
+    try:
+        result = call_with_retry(
+            "renew_batch_lock",
+            lock_collection.update_one,
+            {"_id": lock["batch_id"], "owner": lock["owner"], "fencing_token": lock["fencing_token"]},
+            {"$set": {"lease_expires_at": lease_expires_at}}
+        )
+    except TaskProcessingError:
+        raise
+    except Exception as renew_error:
+        logger.error(f"Failed to renew the lock of Batch ID {lock['batch_id']}: {renew_error}")
+        raise DatabaseUpdateError(f"Failed to renew the lock of Batch ID {lock['batch_id']}: {renew_error}")
+    if result.matched_count == 0:
+        error_message = f"Lock of Batch ID {lock['batch_id']} with fencing token {lock['fencing_token']} was lost to another process."
+        logger.error(error_message)
+        raise StaleFencingTokenError(error_message)
+    return True, lock
+
+def release_batch_lock(lock):
+    """
+    Releases a lock (keeping its fencing token). Never raises: an unreleased lock expires with its lease.
+    Returns: (success, message or error)
+    """
+    if lock is None:
+        return True, "No lock to release."
+
+    try:
+        get_collection(BATCH_LOCKS).update_one(
+            {"_id": lock["batch_id"], "owner": lock["owner"], "fencing_token": lock["fencing_token"]},
+            {"$set": {"owner": None, "lease_expires_at": datetime.now()}}
+        )
+        logger.info(f"Released lock of Batch ID {lock['batch_id']} (fencing token {lock['fencing_token']}).")
+        return True, "Lock released."
+    except Exception as release_error:
+        logger.error(f"Failed to release lock of Batch ID {lock['batch_id']}: {release_error}")
+        return False, str(release_error)
+
+def fencing_filter(fencing_token):
+    """
+    Query condition matching documents that no newer lock holder has written to.
+    """
+    return {"$or": [{"Fencing_Token": None}, {"Fencing_Token": {"$lte": fencing_token}}]}
@@ -0,0 +1,159 @@
+'''
+bulk_loader.py file is as follows:
+
+    Purpose: This script seeds MongoDB collections from JSON / NDJSON files and exports them back as snapshots.
+    Created Date: 2025-03-27
+    Created By:  T.S.Balasooriya (tharindutsb@gmail.com) , Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Last Modified Date: 2025-03-27
+    Modified By: T.S.Balasooriya (tharindutsb@gmail.com), Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Version: Python 3.9
+    Dependencies: json, concurrent.futures, bson.json_util, utils.loggers, utils.connectDB, utils.Custom_Exceptions
+    Notes:
+        - Files are read incrementally: a JSON array, a single JSON document or NDJSON (one document per line)
+          are all parsed as a stream of documents, so a file is never held in memory as a whole.
+        - MongoDB Extended JSON ($oid, $date, ...) is converted to BSON types while parsing.
+        - Documents are inserted in unordered insert_many chunks by a small pool of threads.
+        - Collections are dropped before loading and indexes are created after the data is in,
+          which is much faster than maintaining them during the load.
+'''
+
+import json
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from bson import json_util
+from utils.loggers import get_logger
+from utils.connectDB import create_amend_indexes
+from utils.Custom_Exceptions import DatabaseUpdateError
+
+logger = get_logger("database_logger")
+
+_JSON_DECODER = json.JSONDecoder(object_hook=json_util.object_hook)
+_WHITESPACE = " \t\r\n"
+# A decode error this close to the end of the buffer may only be a cut-off literal or escape (e.g. "-Infinity")
+_INCOMPLETE_TAIL = 16
+
+def _is_incomplete(decode_error, buffer_length):
+    """
+    Tells a document cut off by the end of the buffer apart from an invalid one.
+    """
+    return decode_error.msg.startswith("Unterminated string") or buffer_length - decode_error.pos <= _INCOMPLETE_TAIL
+
+def iter_json_documents(file_path, read_size=1 << 20):
+    """
+    Streams the documents of a JSON array, a single JSON document or an NDJSON file.
+    Raises DatabaseUpdateError at the first invalid document, without reading the rest of the file.
+    """
+    with open(file_path, "r", encoding="utf-8") as file:
+        buffer = ""
+        position = 0
+        buffer_offset = 0
+        in_array = None
+        end_of_file = False
+
+        while True:
+            # Skip whitespace and array punctuation between documents
+            while position < len(buffer) and (buffer[position] in _WHITESPACE or (in_array and buffer[position] in ",]")):
+                position += 1
+            if position < len(buffer) and in_array is None:
+                in_array = buffer[position] == "["
+                if in_array:
+                    position += 1
+                continue
+
+            if position >= len(buffer) and end_of_file:
+                return
+
+            try:
+                if position >= len(buffer):
+                    raise json.JSONDecodeError("Need more data", buffer, position)
+                document, end = _JSON_DECODER.raw_decode(buffer, position)
+            except json.JSONDecodeError as decode_error:
+                # Only a document cut off by the end of the buffer is worth reading more of the file for
+                if end_of_file or not _is_incomplete(decode_error, len(buffer)):
+                    raise DatabaseUpdateError(f"Invalid JSON in {file_path} near character {buffer_offset + decode_error.pos}: {decode_error.msg}.")
+                chunk = file.read(read_size)
+                end_of_file = not chunk
+                buffer_offset += position
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+
+            position = end
+            yield document
+
+def _chunked(documents, chunk_size):
+    chunk = []
+    for document in documents:
+        chunk.append(document)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def bulk_insert_documents(collection, documents, chunk_size=5000, workers=4):
+    """
+    Inserts documents with unordered insert_many chunks on a pool of threads.
+    At most twice as many chunks as workers are held in memory at a time.
+    Returns: (success, inserted count or error)
+    """
+    inserted_count = 0
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            pending = set()
+            for chunk in _chunked(documents, chunk_size):
+                if len(pending) >= workers * 2:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    inserted_count += sum(len(future.result().inserted_ids) for future in done)
+                pending.add(executor.submit(collection.insert_many, chunk, ordered=False))
+            inserted_count += sum(len(future.result().inserted_ids) for future in pending)
+        return True, inserted_count
+    except Exception as insert_error:
+        logger.error(f"Failed to insert documents into {collection.name}: {insert_error}")
+        raise DatabaseUpdateError(f"Failed to insert documents into {collection.name}: {insert_error}")
+
+def load_collection_from_file(db, collection_name, file_path, chunk_size=5000, workers=4, drop=True):
+    """
+    Replaces (or appends to, when drop is False) a collection with the documents of a JSON / NDJSON file.
+    Returns: (success, inserted count or error)
+    """
+    logger.info(f"Loading {file_path} into {collection_name}...")
+    if drop:
+        db.drop_collection(collection_name)
+    success_insert, inserted_count = bulk_insert_documents(db[collection_name], iter_json_documents(file_path), chunk_size, workers)
+    logger.info(f"Inserted {inserted_count} documents into {collection_name}.")
+    return success_insert, inserted_count
+
+def load_snapshot(db, collection_files, chunk_size=5000, workers=4, drop=True):
+    """
+    Loads every {collection_name: file_path} pair and creates the amend indexes afterwards.
+    Returns: (success, {collection_name: inserted count} or error)
+    """
+    inserted_counts = {}
+    for collection_name, file_path in collection_files.items():
+        success_load, inserted_counts[collection_name] = load_collection_from_file(db, collection_name, file_path, chunk_size, workers, drop)
+        if not success_load:
+            return False, inserted_counts[collection_name]
+
+    success_index, index_names = create_amend_indexes(db, list(collection_files))
+    if not success_index:
+        return False, index_names
+    return True, inserted_counts
+
+def export_collection_to_file(db, collection_name, file_path, batch_size=5000):
+    """
+    Writes a collection as an NDJSON snapshot in MongoDB Extended JSON, one document per line.
+    Returns: (success, exported count or error)
+    """
+    try:
+        logger.info(f"Exporting {collection_name} to {file_path}...")
+        exported_count = 0
+        with open(file_path, "w", encoding="utf-8") as file:
+            for document in db[collection_name].find({}, batch_size=batch_size):
+                file.write(json_util.dumps(document, json_options=json_util.CANONICAL_JSON_OPTIONS))
+                file.write("\n")
+                exported_count += 1
+        logger.info(f"Exported {exported_count} documents from {collection_name}.")
+        return True, exported_count
+    except Exception as export_error:
+        logger.error(f"Failed to export {collection_name}: {export_error}")
+        raise DatabaseUpdateError(f"Failed to export {collection_name}: {export_error}")
@@ -7,16 +7,17 @@ connectDB.py file is as follows:
     Last Modified Date: 2025-03-15
     Modified By: T.S.Balasooriya (tharindutsb@gmail.com), Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)     
     Version: Python 3.9
-    Dependencies: configparser, pymongo, os, utils.loggers, utils.Custom_Exceptions
+    Dependencies: configparser, pymongo, os, utils.loggers, utils.Custom_Exceptions, utils.storage_backend
     Notes:
 '''
 
 import configparser
-from pymongo import MongoClient
+from pymongo import MongoClient, ASCENDING
 import os
 from utils.loggers import get_logger
 from utils.Custom_Exceptions import DatabaseConnectionError
 from utils.filePath import get_filePath
+from utils.storage_backend import get_storage_backend
 
 # Collection names
 CASE_COLLECTION = "DRS.Tmp_Case_Distribution_DRC"   # Temporary collection for case distribution
@@ -24,13 +25,38 @@ TRANSACTION_COLLECTION = "Case_distribution_drc_transactions"  # Collection for
 CASE_DRC_SUMMARY = "DRS_Database.Case_Distribution_DRC_Summary" # Collection for case distribution summary after amendment
 SYSTEM_TASKS = "System_tasks"  # Collection for system tasks
 TEMPLATE_TASK = "Template_task" # Collection for template task 
+BATCH_LOCKS = "Amend_batch_locks" # Collection for per-batch locks and fencing tokens
+
+# Indexes used by the amend queries, per collection
+AMEND_INDEXES = {
+    CASE_COLLECTION: [
+        [("Case_Distribution_Batch_ID", ASCENDING), ("DRC_Id", ASCENDING), ("RTOM", ASCENDING), ("Case_Id", ASCENDING)],
+        [("Case_Distribution_Batch_ID", ASCENDING), ("NEW_DRC_ID", ASCENDING), ("RTOM", ASCENDING), ("Case_Id", ASCENDING)],
+        [("Case_Id", ASCENDING)],
+    ],
+    TRANSACTION_COLLECTION: [
+        [("Case_Distribution_Batch_ID", ASCENDING)],
+    ],
+    CASE_DRC_SUMMARY: [
+        [("Case_Distribution_Batch_ID", ASCENDING), ("DRC_Id", ASCENDING), ("RTOM", ASCENDING)],
+    ],
+    SYSTEM_TASKS: [
+        [("task_status", ASCENDING), ("task_type", ASCENDING)],
+        [("Task_Id", ASCENDING)],
+    ],
+    TEMPLATE_TASK: [
+        [("task_type", ASCENDING)],
+    ],
+}
 
 # Initialize logger
 logger = get_logger("database_logger")
 
-# Read configuration from DB_Config.ini file
-def get_db_connection():
-
+def read_db_config():
+    """
+    Reads MONGO_URI and DB_NAME from DB_Config.ini.
+    Returns: (mongo_uri, db_name)
+    """
     config_path = get_filePath("DB_Config")
     if not os.path.exists(config_path):
         logger.error(f"Configuration file '{config_path}' not found.")
@@ -49,7 +75,11 @@ def get_db_connection():
     if not mongo_uri or not db_name:
         logger.error("Missing MONGO_URI or DB_NAME in DB_Config.ini")
         raise DatabaseConnectionError("Missing MONGO_URI or DB_NAME in DB_Config.ini")
+    return mongo_uri, db_name
 
+# Read configuration from DB_Config.ini file
+def get_db_connection():
+    mongo_uri, db_name = read_db_config()
     try:
         client = MongoClient(mongo_uri)
         db = client[db_name]
@@ -61,12 +91,31 @@ def get_db_connection():
 # Get a specific collection
 def get_collection(collection_name):
     """
-    Returns a specific collection after establishing a DB connection.
+    Returns a specific collection from the active storage backend (MongoDB unless replaced
+    with utils.storage_backend.set_storage_backend). The MongoDB connection is opened once and reused.
     If the connection fails, logs an error and exits.
     """
-    db = get_db_connection()
-    if db is None:
+    collection = get_storage_backend().get_collection(collection_name)
+    if collection is None:
         logger.error("Database connection failed. Exiting...")
         raise DatabaseConnectionError("Database connection failed. Exiting...")
 
-    return db[collection_name]
\ No newline at end of file
+    return collection
+
+def create_amend_indexes(db, collection_names=None):
+    """
+    Creates the indexes used by the amend queries (existing indexes are left as they are).
+    Returns: (success, created index names or error)
+    """
+    created_indexes = []
+    try:
+        for collection_name, index_specs in AMEND_INDEXES.items():
+            if collection_names is not None and collection_name not in collection_names:
+                continue
+            for index_spec in index_specs:
+                created_indexes.append(f"{collection_name}.{db[collection_name].create_index(index_spec)}")
+        logger.info(f"Amend indexes ready: {', '.join(created_indexes)}")
+        return True, created_indexes
+    except Exception as index_error:
+        logger.error(f"Failed to create amend indexes: {index_error}")
+        raise DatabaseConnectionError(f"Failed to create amend indexes: {index_error}")
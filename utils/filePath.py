@@ -56,6 +56,7 @@ def get_filePath(key):
             "DB_Config": "DB_ConfigFile_Path",
             "filePaths": "FilePathConfigFile_path",
             "Set_Template_TaskID": "Set_Template_TaskIDFile_Path",
+            "Amend_Processing": "Amend_ProcessingFile_Path",
         }
 
         # Retrieve section name
@@ -0,0 +1,63 @@
+'''
+read_amend_processing_ini.py file is as follows:
+
+    Purpose: This script reads the amend processing settings from the Amend_Processing INI file.
+    Created Date: 2025-03-20
+    Created By:  T.S.Balasooriya (tharindutsb@gmail.com) , Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Last Modified Date: 2025-03-20
+    Modified By: T.S.Balasooriya (tharindutsb@gmail.com), Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Version: Python 3.9
+    Dependencies: configparser, utils.loggers, utils.Custom_Exceptions, utils.filePath
+    Notes:
+        - Every setting has a fallback, so a missing file or section keeps the default serial behaviour.
+        - The file is read once per process; settings are looked up in hot paths, on every task.
+'''
+
+import configparser
+from utils.loggers import get_logger
+from utils.Custom_Exceptions import INIFileReadError
+from utils.filePath import get_filePath
+
+logger = get_logger("amend_status_logger")
+
+_config = None
+
+def read_amend_processing_ini():
+    """
+    Reads the Amend_Processing INI file.
+    Returns: (success, config or error)
+    """
+    file_path = get_filePath("Amend_Processing")
+    try:
+        config = configparser.ConfigParser(inline_comment_prefixes=(";", "#"))
+        if not file_path or not config.read(file_path):
+            error_message = f"Amend processing configuration file {file_path} not found."
+            logger.warning(error_message)
+            return False, error_message
+        return True, config
+    except Exception as ini_read_error:
+        logger.error(f"Failed to read INI file {file_path}: {ini_read_error}")
+        raise INIFileReadError(f"Failed to read INI file {file_path}: {ini_read_error}")
+
+def get_processing_setting(section, key, fallback=None, value_type=str):
+    """
+    Gets a single setting from the Amend_Processing INI file, converted to value_type.
+    Returns: the setting value, or fallback if the file, section or key is missing.
+    """
+    global _config
+    if _config is None:
+        # A missing file is remembered too, so that it is only reported once
+        _config = read_amend_processing_ini()
+    success_read_ini, config = _config
+    if not success_read_ini or section not in config or key not in config[section]:
+        return fallback
+
+    raw_value = config[section][key].strip()
+    try:
+        if value_type is bool:
+            return config[section].getboolean(key)
+        return value_type(raw_value)
+    except ValueError as conversion_error:
+        error_message = f"Invalid value '{raw_value}' for {key} in section [{section}]: {conversion_error}"
+        logger.error(error_message)
+        raise INIFileReadError(error_message)
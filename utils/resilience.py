@@ -0,0 +1,138 @@
+'''
+resilience.py file is as follows:
+
+    Purpose: This script retries idempotent MongoDB operations with jittered backoff, deadlines and circuit breakers.
+    Created Date: 2025-04-01
+    Created By:  T.S.Balasooriya (tharindutsb@gmail.com) , Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Last Modified Date: 2025-04-01
+    Modified By: T.S.Balasooriya (tharindutsb@gmail.com), Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Version: Python 3.9
+    Dependencies: random, threading, time, pymongo, utils.loggers, utils.Custom_Exceptions, utils.read_amend_processing_ini
+    Notes:
+        - Only transient errors are retried: connection failures, timeouts and errors MongoDB labels as retryable.
+          Anything else (validation, duplicate keys, ...) is raised straight away.
+        - Only use call_with_retry for idempotent operations ($set updates, upserts keyed on the filter,
+          reads): a retried operation may already have been applied by the server before the error.
+        - Backoff is "full jitter": a random delay between 0 and min(MAX_DELAY, BASE_DELAY * 2^attempt),
+          never sleeping past the operation deadline.
+        - One circuit breaker per operation name. After BREAKER_FAILURE_THRESHOLD consecutive transient failures
+          it opens and calls fail fast with CircuitOpenError for BREAKER_RESET_SECONDS, then one trial call is let through.
+'''
+
+import random
+import threading
+import time
+from pymongo.errors import ConnectionFailure, ExecutionTimeout, PyMongoError, WTimeoutError
+from utils.loggers import get_logger
+from utils.Custom_Exceptions import CircuitOpenError
+from utils.read_amend_processing_ini import get_processing_setting
+
+logger = get_logger("amend_status_logger")
+
+_settings = None
+_breakers = {}
+_breakers_lock = threading.Lock()
+
+def get_resilience_settings():
+    """
+    Reads the [RESILIENCE] settings once per process.
+    """
+    global _settings
+    if _settings is None:
+        _settings = {
+            "max_attempts": get_processing_setting("RESILIENCE", "MAX_ATTEMPTS", 5, int),
+            "base_delay": get_processing_setting("RESILIENCE", "BASE_DELAY_MS", 50, int) / 1000,
+            "max_delay": get_processing_setting("RESILIENCE", "MAX_DELAY_MS", 2000, int) / 1000,
+            "deadline": get_processing_setting("RESILIENCE", "OPERATION_DEADLINE_MS", 10000, int) / 1000,
+            "breaker_failure_threshold": get_processing_setting("RESILIENCE", "BREAKER_FAILURE_THRESHOLD", 5, int),
+            "breaker_reset_seconds": get_processing_setting("RESILIENCE", "BREAKER_RESET_SECONDS", 30, float),
+        }
+    return _settings
+
+def is_transient_error(error):
+    """
+    Returns True for errors that are worth retrying.
+    """
+    if isinstance(error, (ConnectionFailure, ExecutionTimeout, WTimeoutError)):
+        return True
+    return isinstance(error, PyMongoError) and (error.has_error_label("RetryableWriteError") or error.has_error_label("TransientTransactionError"))
+
+class CircuitBreaker:
+    """
+    Consecutive-failure circuit breaker: closed -> open -> half-open -> closed.
+    """
+
+    def __init__(self, name, failure_threshold, reset_seconds):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._lock = threading.Lock()
+
+    def is_open(self):
+        with self._lock:
+            return self.opened_at is not None
+
+    def before_call(self):
+        with self._lock:
+            if self.opened_at is None:
+                return
+            if time.monotonic() - self.opened_at < self.reset_seconds:
+                raise CircuitOpenError(f"Circuit for {self.name} is open after {self.consecutive_failures} consecutive failures.")
+            # Half-open: let this call through as a trial, and fail the others fast until it reports back
+            self.opened_at = time.monotonic()
+
+    def record_success(self):
+        with self._lock:
+            if self.opened_at is not None:
+                logger.info(f"Circuit for {self.name} closed again.")
+            self.consecutive_failures = 0
+            self.opened_at = None
+
+    def record_failure(self):
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.failure_threshold:
+                if self.opened_at is None:
+                    logger.error(f"Circuit for {self.name} opened after {self.consecutive_failures} consecutive failures.")
+                self.opened_at = time.monotonic()
+
+def get_circuit_breaker(operation_name):
+    with _breakers_lock:
+        if operation_name not in _breakers:
+            settings = get_resilience_settings()
+            _breakers[operation_name] = CircuitBreaker(operation_name, settings["breaker_failure_threshold"], settings["breaker_reset_seconds"])
+        return _breakers[operation_name]
+
+def call_with_retry(operation_name, operation, *args, **kwargs):
+    """
+    Calls operation(*args, **kwargs), retrying transient MongoDB errors with jittered exponential backoff
+    until it succeeds, MAX_ATTEMPTS is reached or OPERATION_DEADLINE_MS has passed.
+    Raises CircuitOpenError without calling the operation while its circuit is open.
+    """
+    settings = get_resilience_settings()
+    breaker = get_circuit_breaker(operation_name)
+    deadline = time.monotonic() + settings["deadline"]
+
+    attempt = 0
+    while True:
+        breaker.before_call()
+        try:
+            result = operation(*args, **kwargs)
+        except Exception as operation_error:
+            if not is_transient_error(operation_error):
+                raise
+            breaker.record_failure()
+            attempt += 1
+            remaining_time = deadline - time.monotonic()
+            if attempt >= settings["max_attempts"] or remaining_time <= 0 or breaker.is_open():
+                logger.error(f"{operation_name} failed after {attempt} attempts: {operation_error}")
+                raise
+            delay = min(random.uniform(0, min(settings["max_delay"], settings["base_delay"] * 2 ** attempt)), remaining_time)
+            logger.warning(f"{operation_name} failed with a transient error ({operation_error}), retrying in {delay * 1000:.0f} ms (attempt {attempt + 1}).")
+            time.sleep(delay)
+            continue
+
+        breaker.record_success()
+        return result
@@ -0,0 +1,643 @@
+'''
+storage_backend.py file is as follows:
+
+    Purpose: This script provides the storage backends behind get_collection: MongoDB, or an in-process stand-in.
+    Created Date: 2025-03-29
+    Created By:  T.S.Balasooriya (tharindutsb@gmail.com) , Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Last Modified Date: 2025-03-29
+    Modified By: T.S.Balasooriya (tharindutsb@gmail.com), Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Version: Python 3.9
+    Dependencies: itertools, threading, bson, pymongo, utils.Custom_Exceptions
+    Notes:
+        - MongoStorageBackend opens one client per backend and reuses it for every collection.
+        - InMemoryStorageBackend keeps collections in process memory and supports the subset of the pymongo
+          collection API that the amend code uses: find / find_one / find_one_and_update, insert, update,
+          bulk_write, delete, count_documents and aggregate ($match, $group, $sort, $project, $limit).
+        - In-memory collections are indexed by Case_Distribution_Batch_ID and Case_Id, so batch and case
+          lookups do not scan the collection.
+        - The backend used by get_collection is switched with set_storage_backend, e.g. in tests.
+        - A duplicate _id raises pymongo's DuplicateKeyError, as MongoDB does.
+'''
+
+import itertools
+import threading
+from datetime import datetime
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+from utils.Custom_Exceptions import DatabaseConnectionError, DatabaseUpdateError
+
+# Fields the in-memory collections keep an equality index on
+INDEXED_FIELDS = ("Case_Distribution_Batch_ID", "Case_Id")
+
+_active_backend = None
+_active_backend_lock = threading.Lock()
+
+def get_storage_backend():
+    """
+    Returns the active storage backend, creating the MongoDB backend on first use.
+    """
+    global _active_backend
+    if _active_backend is None:
+        with _active_backend_lock:
+            if _active_backend is None:
+                _active_backend = MongoStorageBackend()
+    return _active_backend
+
+def set_storage_backend(backend):
+    """
+    Replaces the active storage backend and returns the previous one.
+    """
+    global _active_backend
+    with _active_backend_lock:
+        previous_backend = _active_backend
+        _active_backend = backend
+    return previous_backend
+
+class MongoStorageBackend:
+    """
+    Storage backend backed by a MongoDB database.
+    The database defaults to the one in DB_Config.ini; a pymongo Database can be passed in instead.
+    """
+
+    def __init__(self, db=None):
+        self._db = db
+        self._lock = threading.Lock()
+
+    def get_db(self):
+        if self._db is None:
+            with self._lock:
+                if self._db is None:
+                    # Imported here because connectDB imports this module
+                    from utils.connectDB import get_db_connection
+                    self._db = get_db_connection()
+        return self._db
+
+    def get_collection(self, collection_name):
+        return self.get_db()[collection_name]
+
+class InMemoryStorageBackend:
+    """
+    Storage backend that keeps every collection in process memory.
+    """
+
+    def __init__(self):
+        self._collections = {}
+        self._lock = threading.Lock()
+
+    def get_collection(self, collection_name):
+        with self._lock:
+            if collection_name not in self._collections:
+                self._collections[collection_name] = InMemoryCollection(collection_name)
+            return self._collections[collection_name]
+
+    def __getitem__(self, collection_name):
+        return self.get_collection(collection_name)
+
+    def drop_collection(self, collection_name):
+        with self._lock:
+            self._collections.pop(collection_name, None)
+
+    def list_collection_names(self):
+        return list(self._collections)
+
+class InsertResult:
+    def __init__(self, inserted_ids):
+        self.inserted_ids = inserted_ids
+        self.inserted_id = inserted_ids[0] if inserted_ids else None
+
+class UpdateResult:
+    def __init__(self, matched_count=0, modified_count=0, upserted_id=None):
+        self.matched_count = matched_count
+        self.modified_count = modified_count
+        self.upserted_id = upserted_id
+
+class DeleteResult:
+    def __init__(self, deleted_count):
+        self.deleted_count = deleted_count
+
+class BulkWriteResult:
+    def __init__(self):
+        self.inserted_count = 0
+        self.matched_count = 0
+        self.modified_count = 0
+        self.deleted_count = 0
+        self.upserted_count = 0
+        self.upserted_ids = {}
+
+class InMemoryCursor:
+    """
+    Lazily evaluated cursor supporting sort, skip, limit and batch_size.
+    """
+
+    def __init__(self, collection, query_filter, projection):
+        self._collection = collection
+        self._filter = query_filter or {}
+        self._projection = projection
+        self._sort = []
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key_or_list, direction=1):
+        self._sort = [(key_or_list, direction)] if isinstance(key_or_list, str) else list(key_or_list)
+        return self
+
+    def skip(self, count):
+        self._skip = count
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def close(self):
+        pass
+
+    def __iter__(self):
+        documents = self._collection._matching_documents(self._filter)
+        if self._sort:
+            documents = _sort_documents(list(documents), self._sort)
+        documents = itertools.islice(documents, self._skip, self._skip + self._limit if self._limit else None)
+        for document in documents:
+            yield _project(document, self._projection)
+
+class InMemoryCollection:
+    """
+    In-process collection with the pymongo calls used by the amend code.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._documents = {}
+        self._sequence = {}
+        self._next_sequence = itertools.count()
+        self._indexes = {field: {} for field in INDEXED_FIELDS}
+        self._lock = threading.RLock()
+        self.index_information_specs = []
+
+    # ---- reads ----
+
+    def find(self, query_filter=None, projection=None, **kwargs):
+        cursor = InMemoryCursor(self, query_filter, projection)
+        if kwargs.get("sort"):
+            cursor.sort(kwargs["sort"])
+        return cursor.skip(kwargs.get("skip", 0)).limit(kwargs.get("limit", 0))
+
+    def find_one(self, query_filter=None, projection=None, **kwargs):
+        for document in self.find(query_filter, projection, **kwargs).limit(1):
+            return document
+        return None
+
+    def count_documents(self, query_filter, **kwargs):
+        return sum(1 for _ in self._matching_documents(query_filter))
+
+    def aggregate(self, pipeline, **kwargs):
+        documents = None
+        for stage in pipeline:
+            (operator, argument), = stage.items()
+            if operator == "$match" and documents is None:
+                documents = [_copy_value(document) for document in self._matching_documents(argument)]
+                continue
+            if documents is None:
+                documents = [_copy_value(document) for document in self._matching_documents({})]
+            if operator == "$match":
+                documents = [document for document in documents if _matches(document, argument)]
+            elif operator == "$group":
+                documents = _group_documents(documents, argument)
+            elif operator == "$sort":
+                documents = _sort_documents(documents, list(argument.items()))
+            elif operator == "$project":
+                documents = [_project(document, argument) for document in documents]
+            elif operator == "$limit":
+                documents = documents[:argument]
+            else:
+                raise DatabaseConnectionError(f"Aggregation stage {operator} is not supported by the in-memory backend.")
+        return iter(documents if documents is not None else [])
+
+    # ---- writes ----
+
+    def insert_one(self, document, **kwargs):
+        return InsertResult(self._insert_documents([document]))
+
+    def insert_many(self, documents, ordered=True, **kwargs):
+        return InsertResult(self._insert_documents(documents))
+
+    def update_one(self, query_filter, update, upsert=False, **kwargs):
+        return self._update(query_filter, update, upsert, multi=False)
+
+    def update_many(self, query_filter, update, upsert=False, **kwargs):
+        return self._update(query_filter, update, upsert, multi=True)
+
+    def find_one_and_update(self, query_filter, update, projection=None, upsert=False, return_document=False, sort=None, **kwargs):
+        with self._lock:
+            documents = self._matching_documents(query_filter)
+            if sort:
+                documents = _sort_documents(list(documents), sort)
+            document = next(iter(documents), None)
+            if document is None:
+                if not upsert:
+                    return None
+                result = self._update(query_filter, update, True, multi=False)
+                return _project(self._documents[result.upserted_id], projection) if return_document else None
+
+            before = _copy_value(document)
+            self._apply_update(document, update, query_filter, inserting=False)
+            return _project(document if return_document else before, projection)
+
+    def bulk_write(self, requests, ordered=True, **kwargs):
+        result = BulkWriteResult()
+        with self._lock:
+            for index, request in enumerate(requests):
+                request_type = type(request).__name__
+                if request_type == "InsertOne":
+                    self._insert_documents([request._doc])
+                    result.inserted_count += 1
+                elif request_type in ("UpdateOne", "UpdateMany"):
+                    update_result = self._update(request._filter, request._doc, request._upsert, multi=request_type == "UpdateMany")
+                    result.matched_count += update_result.matched_count
+                    result.modified_count += update_result.modified_count
+                    if update_result.upserted_id is not None:
+                        result.upserted_count += 1
+                        result.upserted_ids[index] = update_result.upserted_id
+                elif request_type in ("DeleteOne", "DeleteMany"):
+                    result.deleted_count += self._delete(request._filter, multi=request_type == "DeleteMany")
+                else:
+                    raise DatabaseUpdateError(f"Bulk operation {request_type} is not supported by the in-memory backend.")
+        return result
+
+    def delete_one(self, query_filter, **kwargs):
+        return DeleteResult(self._delete(query_filter, multi=False))
+
+    def delete_many(self, query_filter, **kwargs):
+        return DeleteResult(self._delete(query_filter, multi=True))
+
+    def create_index(self, keys, **kwargs):
+        keys = [(keys, 1)] if isinstance(keys, str) else list(keys)
+        self.index_information_specs.append((keys, kwargs))
+        return "_".join(f"{field}_{direction}" for field, direction in keys)
+
+    def drop(self):
+        with self._lock:
+            self._documents.clear()
+            self._sequence.clear()
+            self._indexes = {field: {} for field in INDEXED_FIELDS}
+
+    # ---- internals ----
+
+    def _candidate_ids(self, query_filter):
+        """
+        Uses the equality indexes to narrow down the documents a filter can match.
+        """
+        for field in INDEXED_FIELDS:
+            if field not in query_filter:
+                continue
+            condition = query_filter[field]
+            if isinstance(condition, dict) and set(condition) == {"$in"}:
+                values = condition["$in"]
+            elif isinstance(condition, dict) and set(condition) == {"$eq"}:
+                values = [condition["$eq"]]
+            elif isinstance(condition, (dict, list)):
+                continue
+            else:
+                values = [condition]
+            candidate_ids = set()
+            for value in values:
+                candidate_ids.update(self._indexes[field].get(_index_key(value), ()))
+            return sorted(candidate_ids, key=self._sequence.__getitem__)
+        return None
+
+    def _matching_documents(self, query_filter):
+        query_filter = query_filter or {}
+        with self._lock:
+            candidate_ids = self._candidate_ids(query_filter)
+            documents = self._documents.values() if candidate_ids is None else [self._documents[document_id] for document_id in candidate_ids]
+            return [document for document in documents if _matches(document, query_filter)]
+
+    def _index_document(self, document, add=True):
+        for field in INDEXED_FIELDS:
+            if field not in document:
+                continue
+            bucket = self._indexes[field].setdefault(_index_key(document[field]), set())
+            if add:
+                bucket.add(document["_id"])
+            else:
+                bucket.discard(document["_id"])
+
+    def _insert_documents(self, documents):
+        inserted_ids = []
+        with self._lock:
+            for document in documents:
+                if "_id" not in document:
+                    document["_id"] = ObjectId()
+                if document["_id"] in self._documents:
+                    raise DuplicateKeyError(f"E11000 duplicate key error collection: {self.name} _id: {document['_id']}", 11000)
+                stored_document = _copy_value(document)
+                self._documents[stored_document["_id"]] = stored_document
+                self._sequence[stored_document["_id"]] = next(self._next_sequence)
+                self._index_document(stored_document)
+                inserted_ids.append(stored_document["_id"])
+        return inserted_ids
+
+    def _update(self, query_filter, update, upsert, multi):
+        with self._lock:
+            documents = self._matching_documents(query_filter)
+            if not multi:
+                documents = documents[:1]
+            if not documents:
+                if not upsert:
+                    return UpdateResult()
+                document = _upsert_seed(query_filter)
+                self._apply_update(document, update, query_filter, inserting=True)
+                upserted_id = self._insert_documents([document])[0]
+                return UpdateResult(upserted_id=upserted_id)
+
+            modified_count = 0
+            for document in documents:
+                if self._apply_update(document, update, query_filter, inserting=False):
+                    modified_count += 1
+            return UpdateResult(len(documents), modified_count)
+
+    def _apply_update(self, document, update, query_filter, inserting):
+        """
+        Applies an update document in place. Returns True when the document changed.
+        """
+        before = _copy_value(document)
+        self._index_document(document, add=False)
+        try:
+            for operator, fields in update.items():
+                if operator == "$setOnInsert" and not inserting:
+                    continue
+                for path, value in fields.items():
+                    path = _resolve_positional(document, path, query_filter)
+                    if operator in ("$set", "$setOnInsert"):
+                        _set_path(document, path, _copy_value(value))
+                    elif operator == "$unset":
+                        _unset_path(document, path)
+                    elif operator == "$inc":
+                        _set_path(document, path, _get_path(document, path, 0) + value)
+                    elif operator == "$min":
+                        current = _get_path(document, path, _MISSING)
+                        if current is _MISSING or value < current:
+                            _set_path(document, path, value)
+                    elif operator == "$max":
+                        current = _get_path(document, path, _MISSING)
+                        if current is _MISSING or value > current:
+                            _set_path(document, path, value)
+                    elif operator == "$push":
+                        current = list(_get_path(document, path, []))
+                        if isinstance(value, dict) and "$each" in value:
+                            current.extend(_copy_value(value["$each"]))
+                            if "$slice" in value:
+                                current = current[value["$slice"]:] if value["$slice"] < 0 else current[:value["$slice"]]
+                        else:
+                            current.append(_copy_value(value))
+                        _set_path(document, path, current)
+                    elif operator == "$currentDate":
+                        _set_path(document, path, datetime.now())
+                    else:
+                        raise DatabaseUpdateError(f"Update operator {operator} is not supported by the in-memory backend.")
+        finally:
+            self._index_document(document)
+        return document != before
+
+    def _delete(self, query_filter, multi):
+        with self._lock:
+            documents = self._matching_documents(query_filter)
+            if not multi:
+                documents = documents[:1]
+            for document in documents:
+                self._index_document(document, add=False)
+                del self._documents[document["_id"]]
+                del self._sequence[document["_id"]]
+            return len(documents)
+
+# ---- query helpers ----
+
+_MISSING = object()
+
+def _index_key(value):
+    return repr(value) if isinstance(value, (dict, list)) else value
+
+def _copy_value(value):
+    if isinstance(value, dict):
+        return {key: _copy_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_copy_value(item) for item in value]
+    return value
+
+def _get_values(document, path):
+    """
+    Returns every value reachable by a dotted path, descending into arrays.
+    """
+    values = [document]
+    for part in path.split("."):
+        next_values = []
+        for value in values:
+            if isinstance(value, dict):
+                if part in value:
+                    next_values.append(value[part])
+            elif isinstance(value, list):
+                if part.isdigit() and int(part) < len(value):
+                    next_values.append(value[int(part)])
+                else:
+                    next_values.extend(item[part] for item in value if isinstance(item, dict) and part in item)
+        values = next_values
+    return values
+
+def _get_path(document, path, default=None):
+    current = document
+    for part in path.split("."):
+        if isinstance(current, dict) and part in current:
+            current = current[part]
+        elif isinstance(current, list) and part.isdigit() and int(part) < len(current):
+            current = current[int(part)]
+        else:
+            return default
+    return current
+
+def _set_path(document, path, value):
+    parts = path.split(".")
+    current = document
+    for part in parts[:-1]:
+        if isinstance(current, list):
+            current = current[int(part)]
+        else:
+            if not isinstance(current.get(part), (dict, list)):
+                current[part] = {}
+            current = current[part]
+    if isinstance(current, list):
+        current[int(parts[-1])] = value
+    else:
+        current[parts[-1]] = value
+
+def _unset_path(document, path):
+    parts = path.split(".")
+    parent = _get_path(document, ".".join(parts[:-1])) if len(parts) > 1 else document
+    if isinstance(parent, dict):
+        parent.pop(parts[-1], None)
+
+def _resolve_positional(document, path, query_filter):
+    """
+    Replaces the positional "$" in an update path with the index of the first array
+    element that satisfies every filter condition on that array, including those of an $elemMatch.
+    """
+    if ".$." not in path and not path.endswith(".$"):
+        return path
+    array_path, _, rest = path.partition(".$")
+    conditions = {
+        key[len(array_path) + 1:]: condition
+        for key, condition in (query_filter or {}).items()
+        if key.startswith(array_path + ".")
+    }
+    array_condition = (query_filter or {}).get(array_path)
+    if isinstance(array_condition, dict) and "$elemMatch" in array_condition:
+        conditions.update(array_condition["$elemMatch"])
+    for index, element in enumerate(_get_path(document, array_path, [])):
+        if _matches(element if isinstance(element, dict) else {}, conditions):
+            return f"{array_path}.{index}{rest}"
+    raise DatabaseUpdateError(f"The positional operator did not find the match needed from the query for {path}.")
+
+def _compare(left, right):
+    try:
+        return (left > right) - (left < right)
+    except TypeError:
+        return None
+
+def _matches_condition(values, condition):
+    if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+        for operator, argument in condition.items():
+            if operator == "$exists":
+                if bool(values) != bool(argument):
+                    return False
+            elif operator == "$eq":
+                if not _matches_condition(values, argument):
+                    return False
+            elif operator == "$ne":
+                if _matches_condition(values, argument):
+                    return False
+            elif operator == "$in":
+                if not any(_matches_condition(values, item) for item in argument):
+                    return False
+            elif operator == "$nin":
+                if any(_matches_condition(values, item) for item in argument):
+                    return False
+            elif operator in ("$gt", "$gte", "$lt", "$lte"):
+                expected = {"$gt": (1,), "$gte": (0, 1), "$lt": (-1,), "$lte": (-1, 0)}[operator]
+                if not any(_compare(value, argument) in expected for value in values if value is not None):
+                    return False
+            elif operator == "$elemMatch":
+                if not any(isinstance(value, list) and any(_matches(item, argument) for item in value if isinstance(item, dict)) for value in values):
+                    return False
+            else:
+                raise DatabaseConnectionError(f"Query operator {operator} is not supported by the in-memory backend.")
+        return True
+
+    if condition is None:
+        return not values or any(value is None for value in values)
+    for value in values:
+        if value == condition or (isinstance(value, list) and condition in value):
+            return True
+    return False
+
+def _matches(document, query_filter):
+    for key, condition in query_filter.items():
+        if key == "$or":
+            if not any(_matches(document, sub_filter) for sub_filter in condition):
+                return False
+        elif key == "$and":
+            if not all(_matches(document, sub_filter) for sub_filter in condition):
+                return False
+        elif not _matches_condition(_get_values(document, key), condition):
+            return False
+    return True
+
+def _project(document, projection):
+    if document is None:
+        return None
+    if not projection:
+        return _copy_value(document)
+    if isinstance(projection, (list, tuple)):
+        projection = dict.fromkeys(projection, 1)
+    include_id = projection.get("_id", 1)
+    fields = {key: value for key, value in projection.items() if key != "_id"}
+    if fields and all(not value for value in fields.values()):
+        projected = _copy_value(document)
+        for key in fields:
+            _unset_path(projected, key)
+    else:
+        projected = {}
+        for key in fields:
+            value = _get_path(document, key, _MISSING)
+            if value is not _MISSING:
+                _set_path(projected, key, _copy_value(value))
+    if include_id and "_id" in document:
+        projected["_id"] = document["_id"]
+    elif not include_id:
+        projected.pop("_id", None)
+    return projected
+
+def _sort_documents(documents, sort_spec):
+    for key, direction in reversed(sort_spec):
+        documents.sort(key=lambda document: (_get_path(document, key) is None, _get_path(document, key)), reverse=direction < 0)
+    return documents
+
+def _evaluate_expression(document, expression):
+    if isinstance(expression, str) and expression.startswith("$"):
+        return _get_path(document, expression[1:])
+    if isinstance(expression, dict):
+        if len(expression) == 1 and next(iter(expression)) in EXPRESSION_OPERATORS:
+            (operator, arguments), = expression.items()
+            return EXPRESSION_OPERATORS[operator](*[_evaluate_expression(document, argument) for argument in arguments])
+        return {key: _evaluate_expression(document, value) for key, value in expression.items()}
+    return expression
+
+# Aggregation expression operators understood by _evaluate_expression, applied to their evaluated arguments
+EXPRESSION_OPERATORS = {
+    "$ifNull": lambda value, replacement: replacement if value is None else value,
+    "$eq": lambda left, right: left == right,
+    "$cond": lambda condition, if_true, if_false: if_true if condition else if_false
+}
+
+def _group_documents(documents, group_spec):
+    groups = {}
+    for document in documents:
+        group_id = _evaluate_expression(document, group_spec["_id"])
+        group_key = repr(group_id)
+        if group_key not in groups:
+            groups[group_key] = {"_id": group_id}
+        group = groups[group_key]
+        for field, accumulator in group_spec.items():
+            if field == "_id":
+                continue
+            (operator, expression), = accumulator.items()
+            value = _evaluate_expression(document, expression)
+            if operator == "$sum":
+                group[field] = group.get(field, 0) + (value if isinstance(value, (int, float)) else 0)
+            elif operator == "$min":
+                group[field] = value if field not in group else min(group[field], value)
+            elif operator == "$max":
+                group[field] = value if field not in group else max(group[field], value)
+            elif operator == "$first":
+                group.setdefault(field, value)
+            elif operator == "$push":
+                group.setdefault(field, []).append(value)
+            else:
+                raise DatabaseConnectionError(f"Group accumulator {operator} is not supported by the in-memory backend.")
+    return list(groups.values())
+
+def _upsert_seed(query_filter):
+    """
+    Builds the document an upsert starts from: the equality conditions of the filter.
+    """
+    document = {}
+    for key, condition in (query_filter or {}).items():
+        if key.startswith("$"):
+            continue
+        if isinstance(condition, dict) and any(operator.startswith("$") for operator in condition):
+            if "$eq" in condition:
+                _set_path(document, key, _copy_value(condition["$eq"]))
+            continue
+        _set_path(document, key, _copy_value(condition))
+    return document
@@ -0,0 +1,115 @@
+'''
+task_profiler.py file is as follows:
+
+    Purpose: This script profiles single amend tasks with cProfile and tracemalloc on demand.
+    Created Date: 2025-04-05
+    Created By:  T.S.Balasooriya (tharindutsb@gmail.com) , Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Last Modified Date: 2025-04-05
+    Modified By: T.S.Balasooriya (tharindutsb@gmail.com), Pasan(pasanbathiya246@gmail.com),Amupama(anupamamaheepala999@gmail.com)
+    Version: Python 3.9
+    Dependencies: cProfile, io, os, pstats, tracemalloc, datetime, contextlib, utils.loggers, utils.read_amend_processing_ini
+    Notes:
+        - A task is profiled when [PROFILING] ENABLED is true (optionally limited to TASK_IDS),
+          or when its System_tasks document has "profile": true.
+        - Per profiled task, OUTPUT_DIR gets task_<Task_Id>_<time>.pstats (load with pstats / snakeviz),
+          a .profile.txt with the top functions by cumulative time, and an .alloc.txt with the top
+          allocation sites and the peak traced memory.
+        - The [PROFILING] settings are read once per process. With profiling off, a task costs one
+          dictionary lookup: no profiler or tracemalloc hook is installed.
+'''
+
+import cProfile
+import io
+import os
+import pstats
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+from utils.loggers import get_logger
+from utils.read_amend_processing_ini import get_processing_setting
+
+logger = get_logger("amend_status_logger")
+
+_settings = None
+
+def get_profiling_settings():
+    """
+    Reads the [PROFILING] settings once per process.
+    """
+    global _settings
+    if _settings is None:
+        task_ids = get_processing_setting("PROFILING", "TASK_IDS", "")
+        _settings = {
+            "enabled": get_processing_setting("PROFILING", "ENABLED", False, bool),
+            "task_ids": {task_id.strip() for task_id in task_ids.split(",") if task_id.strip()},
+            "output_dir": get_processing_setting("PROFILING", "OUTPUT_DIR", "profiles"),
+            "top_functions": get_processing_setting("PROFILING", "TOP_FUNCTIONS", 40, int),
+            "top_allocations": get_processing_setting("PROFILING", "TOP_ALLOCATIONS", 25, int),
+            "traceback_frames": get_processing_setting("PROFILING", "TRACEBACK_FRAMES", 1, int),
+        }
+    return _settings
+
+def is_profiling_requested(task):
+    """
+    Returns True if the task asks for profiling, or profiling is switched on for it in the INI file.
+    """
+    if task.get("profile"):
+        return True
+    settings = get_profiling_settings()
+    return settings["enabled"] and (not settings["task_ids"] or str(task["Task_Id"]) in settings["task_ids"])
+
+@contextmanager
+def profile_task(task_id):
+    """
+    Runs the body under cProfile and tracemalloc and writes the reports of task_id when it ends.
+    """
+    settings = get_profiling_settings()
+    started_tracemalloc = not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start(settings["traceback_frames"])
+    else:
+        tracemalloc.reset_peak()
+    profiler = cProfile.Profile()
+
+    logger.info(f"Profiling Task ID {task_id}...")
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        snapshot = tracemalloc.take_snapshot()
+        current_memory, peak_memory = tracemalloc.get_traced_memory()
+        if started_tracemalloc:
+            tracemalloc.stop()
+        try:
+            write_profile_reports(task_id, profiler, snapshot, peak_memory, settings)
+        except OSError as report_error:
+            # A report that cannot be written must not fail the task
+            logger.error(f"Failed to write profile reports for Task ID {task_id}: {report_error}")
+
+def write_profile_reports(task_id, profiler, snapshot, peak_memory, settings):
+    """
+    Writes the pstats, function and allocation reports of one task.
+    Returns: (success, report base path)
+    """
+    os.makedirs(settings["output_dir"], exist_ok=True)
+    base_path = os.path.join(settings["output_dir"], f"task_{task_id}_{datetime.now().strftime('%Y%m%d_%H%M%S')}")
+
+    profiler.dump_stats(f"{base_path}.pstats")
+
+    function_report = io.StringIO()
+    pstats.Stats(profiler, stream=function_report).sort_stats("cumulative").print_stats(settings["top_functions"])
+    with open(f"{base_path}.profile.txt", "w", encoding="utf-8") as report_file:
+        report_file.write(function_report.getvalue())
+
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+    ))
+    with open(f"{base_path}.alloc.txt", "w", encoding="utf-8") as report_file:
+        report_file.write(f"Task ID {task_id}: peak traced memory {peak_memory / 1024:.1f} KiB\n\n")
+        for statistic in snapshot.statistics("lineno")[:settings["top_allocations"]]:
+            report_file.write(f"{statistic}\n")
+
+    logger.info(f"Profile reports for Task ID {task_id} written to {base_path}.*")
+    return True, base_path